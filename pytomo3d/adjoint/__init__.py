@@ -11,6 +11,7 @@
 from __future__ import (absolute_import, division, print_function)  # NOQA
 
 from .adjoint_source import calculate_adjsrc_on_stream              # NOQA
+from .adjoint_source import cached_calculate_adjsrc_on_stream       # NOQA
 from .adjoint_source import calculate_and_process_adjsrc_on_stream  # NOQA
 from .adjoint_source import calculate_adjsrc_on_trace            # NOQA
 from .adjoint_source import calculate_attenuation_adjsrc_on_stream  # NOQA
@@ -385,3 +385,24 @@ def measure_adjoint_on_stream(
     for adj in adjsrcs:
         results[adj.id] = adj.measurement
     return results
+
+
+def cached_calculate_adjsrc_on_stream(observed, synthetic, windows, config,
+                                      adj_src_type, result_cache, **kwargs):
+    """
+    Same as calculate_adjsrc_on_stream, but the adjoint sources are taken
+    from result_cache if the streams, windows and config are unchanged.
+    The cache is bypassed in figure mode.
+
+    :param result_cache: on-disk result cache
+    :type result_cache: pytomo3d.utils.cache.ResultCache
+    :param kwargs: the rest arguments of calculate_adjsrc_on_stream
+    :return: list of adjoint sources
+    """
+    if kwargs.get("figure_mode", False):
+        return calculate_adjsrc_on_stream(observed, synthetic, windows,
+                                          config, adj_src_type, **kwargs)
+    return result_cache.call(
+        "calculate_adjsrc_on_stream", calculate_adjsrc_on_stream,
+        args=(observed, synthetic, windows, config, adj_src_type),
+        kwargs=kwargs)
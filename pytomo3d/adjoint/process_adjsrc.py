@@ -13,10 +13,10 @@ from __future__ import (print_function, division)
 import numpy as np
 from copy import deepcopy
 from obspy import Stream, Trace
-from obspy.geodetics import gps2dist_azimuth
 from pyadjoint import AdjointSource
 from pytomo3d.signal.process import filter_trace
-from pytomo3d.signal.rotate import rotate_stream
+from pytomo3d.signal.rotate import rotate_stream, sort_stream_by_station
+from pytomo3d.utils.geodesic import calculate_distance_azimuth
 
 
 def calculate_baz(elat, elon, slat, slon):
@@ -29,9 +29,10 @@ def calculate_baz(elat, elon, slat, slon):
     :param slon: station longitude
     :return: back azimuth
     """
-    _, _, baz = gps2dist_azimuth(elat, elon, slat, slon)
+    _, _, baz = calculate_distance_azimuth(elat, elon, slat, slon,
+                                           method="ellipsoid")
 
-    return baz % 360
+    return float(baz) % 360
 
 
 def change_channel_name(stream, channel_name):
@@ -267,19 +268,9 @@ def add_missing_components(stream, component_list=["Z", "R", "T"]):
     measurements, so we just set the missing components to
     zero trace
     """
-    done_list = []
-
     nadds = 0
-    for tr in stream:
-        nw = tr.stats.network
-        sta = tr.stats.station
-        loc = tr.stats.location
-        station_id = "%s.%s.%s" % (nw, sta, loc)
-        if station_id not in done_list:
-            stream_sta = stream.select(network=nw, station=sta, location=loc)
-        else:
-            continue
-
+    sorted_st_dict = sort_stream_by_station(stream, by_channel=False)
+    for stream_sta in sorted_st_dict.values():
         missinglist = component_list[:]
         # search for missing location id list
         for tr in stream_sta:
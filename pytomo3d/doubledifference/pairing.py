@@ -16,6 +16,8 @@ from itertools import combinations
 import numpy as np
 from collections import Counter
 
+from pytomo3d.utils.fft import correlate
+
 
 def create_all_pairs(windows):
     """Create all possible pairs from windows
@@ -100,7 +102,7 @@ def similar_pairs(data, threshold, old_pairs):
     def pair_by_similarity(pair_i, pair_j):
         data_i = data[pair_i]
         data_j = data[pair_j]
-        corr = np.correlate(data_i, data_j, "full")
+        corr = correlate(data_i, data_j)
         ratio = max(corr)/np.sqrt(sum(data_i**2)*sum(data_j**2))
         is_paired = abs(ratio) > threshold
         return ratio, is_paired
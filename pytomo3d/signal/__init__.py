@@ -10,4 +10,9 @@
 
 from __future__ import (absolute_import, division, print_function)
 
-from .process import process_stream  # NOQA
+from .process import (process_stream, process_stream_multiband,  # NOQA
+                      process_stream_parallel, cached_process_stream,
+                      process_pair)
+from .response import ResponseCache  # NOQA
+from .inventory_index import InventoryIndex  # NOQA
+from .sanity_registry import SanityRegistry  # NOQA
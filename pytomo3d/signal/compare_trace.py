@@ -9,9 +9,11 @@ Functions that compare two traces, return the measurements metrics.
     GNU Lesser General Public License, version 3 (LGPLv3)
     (http://www.gnu.org/licenses/lgpl-3.0.en.html)
 """
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
-from obspy import Trace
+from obspy import Stream, Trace
+from .kernel_cache import get_taper_window
 
 
 def least_squre_error(data1, data2):
@@ -90,7 +92,7 @@ def calculate_misfit(_tr1, _tr2, taper_flag=True, taper_percentage=0.05,
     tr2_cover = trace_length(tr2) / trace_length(_tr2)
 
     # amplitude diff
-    twdiff = [i / sampling_rate for i in range(npts)]
+    twdiff = np.arange(npts) / sampling_rate
     amp_ref = np.sum(np.abs(tr1.data) + np.abs(tr2.data)) / (2 * npts)
     wdiff = (tr1.data - tr2.data) / amp_ref
 
@@ -99,6 +101,199 @@ def calculate_misfit(_tr1, _tr2, taper_flag=True, taper_percentage=0.05,
             "time_array": twdiff, "diff_array": wdiff}
 
 
+# columns of the table returned by compare_streams
+COMPARE_COLUMNS = ("correlation", "error", "tr1_coverage", "tr2_coverage")
+
+
+def _get_common_window(tr1, tr2):
+    # the same common window as in calculate_misfit
+    starttime = max(tr1.stats.starttime, tr2.stats.starttime)
+    endtime = min(tr1.stats.endtime, tr2.stats.endtime)
+    sampling_rate = min(tr1.stats.sampling_rate, tr2.stats.sampling_rate)
+    npts = int((endtime - starttime) * sampling_rate)
+    return starttime, sampling_rate, npts
+
+
+def _grid_offset(tr, starttime):
+    # offset(in samples) of starttime on the time grid of trace, None if
+    # starttime is not on the grid
+    offset = (starttime - tr.stats.starttime) * tr.stats.sampling_rate
+    ioffset = int(round(offset))
+    if abs(offset - ioffset) > 1e-6:
+        return None
+    return ioffset
+
+
+def _aligned_slices(tr1, tr2):
+    """
+    If the two traces share the same time grid, return the (offset1,
+    offset2, npts) of the common window, so the data could be compared
+    directly without interpolation. Otherwise return None.
+    """
+    if tr1.stats.sampling_rate != tr2.stats.sampling_rate:
+        return None
+    starttime, _, npts = _get_common_window(tr1, tr2)
+    if npts < 2:
+        return None
+    offset1 = _grid_offset(tr1, starttime)
+    offset2 = _grid_offset(tr2, starttime)
+    if offset1 is None or offset2 is None:
+        return None
+    return offset1, offset2, npts
+
+
+def compare_arrays(data1, data2, sampling_rate, taper_flag=True,
+                   taper_percentage=0.05):
+    """
+    Correlation coefficient and least square error between rows of two
+    2-D arrays of shape (ntrace, npts), the same as cross_correlation and
+    least_squre_error on each row, but as batched array operations.
+
+    :return: (correlation, error) arrays of shape (ntrace, )
+    """
+    data1 = np.array(data1, dtype=np.float64, ndmin=2)
+    data2 = np.array(data2, dtype=np.float64, ndmin=2)
+    if taper_flag:
+        window = get_taper_window(data1.shape[1], sampling_rate,
+                                  taper_type="hann",
+                                  taper_percentage=taper_percentage)
+        data1 *= window
+        data2 *= window
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        norm1 = np.linalg.norm(data1, axis=1)
+        norm2 = np.linalg.norm(data2, axis=1)
+        error = np.linalg.norm(data1 - data2, axis=1) / \
+            np.sqrt(norm1 * norm2)
+
+        data1 -= data1.mean(axis=1, keepdims=True)
+        data2 -= data2.mean(axis=1, keepdims=True)
+        correlation = np.sum(data1 * data2, axis=1) / np.sqrt(
+            np.sum(data1 ** 2, axis=1) * np.sum(data2 ** 2, axis=1))
+    # the same as the min of np.corrcoef matrix
+    correlation = np.minimum(correlation, 1.0)
+    return correlation, error
+
+
+def _compare_job(job):
+    """
+    Job of compare_streams. It is either a group of trace pairs on the
+    same grid, or one pair of traces which needs interpolation.
+    """
+    if job[0] == "grid":
+        _, sampling_rate, data1, data2, taper_flag, taper_percentage = job
+        correlation, error = compare_arrays(
+            data1, data2, sampling_rate, taper_flag=taper_flag,
+            taper_percentage=taper_percentage)
+        return list(zip(correlation, error))
+
+    _, tr1, tr2, taper_flag, taper_percentage = job
+    try:
+        res = calculate_misfit(tr1, tr2, taper_flag=taper_flag,
+                               taper_percentage=taper_percentage)
+    except Exception as errmsg:
+        print("Error comparing traces(%s, %s): %s" % (tr1.id, tr2.id,
+                                                      errmsg))
+        return [(np.nan, np.nan, np.nan, np.nan)]
+    return [(res["correlation"], res["error"], res["tr1_coverage"],
+             res["tr2_coverage"])]
+
+
+def compare_streams(st1, st2, taper_flag=True, taper_percentage=0.05,
+                    n_workers=1):
+    """
+    Compare the traces of two streams with the same ids, for example the
+    synthetics of two solver runs. The metrics of each pair are the same
+    as calculate_misfit. Pairs already on the same time grid(the same
+    sampling rate and aligned starttime) are compared directly: they are
+    stacked by the length of common window and the correlation and error
+    are computed as batched array operations, without copying and
+    interpolating the traces. Other pairs are compared by
+    calculate_misfit.
+
+    :param st1: stream 1
+    :type st1: obspy.Stream
+    :param st2: stream 2
+    :type st2: obspy.Stream
+    :param taper_flag: taper the seismogram or not
+    :type taper_flag: bool
+    :param taper_percentage: the taper percentage
+    :type taper_percentage: float
+    :param n_workers: number of worker processes. If 1, the comparison
+        is done serially. If None, the number of cpus is used.
+    :type n_workers: int
+    :return: summary table as dict of columns. "id" is the list of trace
+        ids, in the order of st1, and "correlation", "error",
+        "tr1_coverage" and "tr2_coverage" are arrays. "tr1_only" and
+        "tr2_only" are the ids only found in one of the streams.
+    """
+    if not isinstance(st1, Stream):
+        raise TypeError("Input st1(type:%s) must be type of obspy.Stream"
+                        % type(st1))
+    if not isinstance(st2, Stream):
+        raise TypeError("Input st2(type:%s) must be type of obspy.Stream"
+                        % type(st2))
+
+    traces2 = {}
+    for tr in st2:
+        traces2.setdefault(tr.id, tr)
+    # the list keeps the order, and the set is for lookup
+    ids = []
+    matched = set()
+    pairs = []
+    for tr in st1:
+        if tr.id in traces2 and tr.id not in matched:
+            ids.append(tr.id)
+            matched.add(tr.id)
+            pairs.append((tr, traces2[tr.id]))
+    tr1_only = sorted(set(tr.id for tr in st1) - matched)
+    tr2_only = sorted(set(traces2) - matched)
+
+    table = dict((col, np.zeros(len(pairs))) for col in COMPARE_COLUMNS)
+    # group the pairs on the same grid by (npts, sampling_rate)
+    groups = {}
+    jobs = []
+    job_rows = []
+    for idx, (tr1, tr2) in enumerate(pairs):
+        slices = _aligned_slices(tr1, tr2)
+        if slices is None:
+            jobs.append(("interp", tr1, tr2, taper_flag, taper_percentage))
+            job_rows.append([idx])
+            continue
+        offset1, offset2, npts = slices
+        table["tr1_coverage"][idx] = (npts - 1) / (tr1.stats.npts - 1)
+        table["tr2_coverage"][idx] = (npts - 1) / (tr2.stats.npts - 1)
+        groups.setdefault((npts, tr1.stats.sampling_rate), []).append(
+            (idx, tr1.data[offset1:offset1 + npts],
+             tr2.data[offset2:offset2 + npts]))
+
+    for (npts, sampling_rate), items in groups.items():
+        jobs.append(("grid", sampling_rate, [item[1] for item in items],
+                     [item[2] for item in items], taper_flag,
+                     taper_percentage))
+        job_rows.append([item[0] for item in items])
+
+    if n_workers == 1 or len(jobs) <= 1:
+        results = [_compare_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes=n_workers)
+        try:
+            results = pool.map(_compare_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for rows, values in zip(job_rows, results):
+        for idx, value in zip(rows, values):
+            for col, v in zip(COMPARE_COLUMNS, value):
+                table[col][idx] = v
+
+    table["id"] = ids
+    table["tr1_only"] = tr1_only
+    table["tr2_only"] = tr2_only
+    return table
+
+
 def plot_two_trace(tr1, tr2, trace1_tag="trace 1", trace2_tag="trace 2",
                    figname=None):
 
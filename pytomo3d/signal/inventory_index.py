@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Flat index of the channel orientation and station location in an
+inventory. Looking up the inventory by select() walks the whole object
+tree, which is slow when there are thousands of channels and it is done
+for every trace. The index is built once, and then each lookup is a
+dict access.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (division, print_function, absolute_import)
+
+
+def _float_or_none(value):
+    if value is None:
+        return None
+    return float(value)
+
+
+def _find_epoch(entries, time, item_id):
+    # entries are (start_date, end_date, values). Take the epoch
+    # containing time, or the first one(the same as select()[0]) if
+    # time is None.
+    if time is None:
+        return entries[0]
+    for entry in entries:
+        start_date, end_date, _ = entry
+        if (start_date is None or start_date <= time) and \
+                (end_date is None or time <= end_date):
+            return entry
+    raise KeyError("No epoch of %s in the inventory contains %s"
+                   % (item_id, time))
+
+
+class InventoryIndex(object):
+    """
+    Index of inventory, mapping "net.sta.loc.chan" and epoch to
+    (dip, azimuth, latitude, longitude), and "net.sta" and epoch to
+    (latitude, longitude). It could be used in the rotation functions
+    in place of an inventory.
+
+    :param inventory: station inventory information
+    :type inventory: obspy.Inventory
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self._channels = {}
+        self._stations = {}
+        for nw in inventory:
+            for sta in nw:
+                sta_id = "%s.%s" % (nw.code, sta.code)
+                self._stations.setdefault(sta_id, []).append(
+                    (sta.start_date, sta.end_date,
+                     (float(sta.latitude), float(sta.longitude))))
+                for chan in sta:
+                    chan_id = "%s.%s.%s.%s" % (nw.code, sta.code,
+                                               chan.location_code, chan.code)
+                    self._channels.setdefault(chan_id, []).append(
+                        (chan.start_date, chan.end_date,
+                         (_float_or_none(chan.dip),
+                          _float_or_none(chan.azimuth),
+                          _float_or_none(chan.latitude),
+                          _float_or_none(chan.longitude))))
+
+    def __len__(self):
+        return len(self._channels)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._channels
+
+    def _find_channel(self, channel_id, time):
+        try:
+            entries = self._channels[channel_id]
+        except KeyError:
+            raise KeyError("Channel(%s) is not in the inventory" % channel_id)
+        return _find_epoch(entries, time, channel_id)
+
+    def get_channel(self, channel_id, time=None):
+        """
+        Get (dip, azimuth, latitude, longitude) of channel
+
+        :param channel_id: "net.sta.loc.chan"
+        :type channel_id: str
+        :param time: time to choose the channel epoch. If None, the first
+            epoch is used. KeyError is raised if no epoch contains it.
+        :type time: obspy.UTCDateTime
+        :return: (dip, azimuth, latitude, longitude)
+        """
+        return self._find_channel(channel_id, time)[2]
+
+    def get_channel_epoch(self, channel_id, time=None):
+        """ Get (start_date, end_date) of channel epoch """
+        return self._find_channel(channel_id, time)[0:2]
+
+    def get_orientation(self, channel_id, time=None):
+        """ Get (dip, azimuth) of channel """
+        return self.get_channel(channel_id, time=time)[0:2]
+
+    def get_station_location(self, network, station, time=None):
+        """ Get (latitude, longitude) of station """
+        sta_id = "%s.%s" % (network, station)
+        try:
+            entries = self._stations[sta_id]
+        except KeyError:
+            raise KeyError("Station(%s) is not in the inventory" % sta_id)
+        return _find_epoch(entries, time, sta_id)[2]
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bounded, thread-safe LRU caches for the kernels used in processing,
+like the frequency domain taper used in filtering. Those kernels only
+depend on the time grid and filter parameters, so traces sharing the
+same grid could reuse them instead of rebuilding them for every trace.
+Each kind of kernel has its own cache, so large kernels of one kind
+(like the detrend kernel of long traces) do not evict the others.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (division, print_function, absolute_import)
+import threading
+from collections import OrderedDict
+import numpy as np
+from obspy import Trace
+from obspy.signal.invsim import cosine_sac_taper
+from obspy.signal.util import _npts2nfft
+from pytomo3d.utils.fft import rfft, irfft
+
+
+def _nbytes(value):
+    """ Number of bytes of numpy arrays in value(or tuple of values) """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+class KernelCache(object):
+    """
+    Least-recently-used cache with a bounded number of entries, and
+    optionally a bounded number of bytes of numpy arrays in values.
+    Values are computed by a user function on cache miss. Value larger
+    than maxbytes itself is returned but not stored. Hit, miss and
+    eviction counts are kept for profiling.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None):
+        if maxsize <= 0:
+            raise ValueError("maxsize of cache should be positive: %s"
+                             % maxsize)
+        if maxbytes is not None and maxbytes <= 0:
+            raise ValueError("maxbytes of cache should be positive: %s"
+                             % maxbytes)
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def _over_limit(self):
+        if len(self._data) > self.maxsize:
+            return True
+        return self.maxbytes is not None and self.nbytes > self.maxbytes
+
+    def get(self, key, func):
+        """
+        Get the value of key. If key is not in the cache, then func()
+        is called to compute the value and the result is stored.
+
+        :param key: hashable key
+        :param func: function with no argument to compute the value
+        :return: cached value
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        # compute outside of the lock so other threads are not blocked
+        value = func()
+        size = _nbytes(value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return value
+
+        with self._lock:
+            if key in self._data:
+                # computed by another thread in the mean time
+                self._data.move_to_end(key)
+                return self._data[key]
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while self._over_limit():
+                old_key, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """ Remove all entries and reset the statistics """
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    @property
+    def stats(self):
+        """ Statistics of cache as a dict """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "size": len(self._data),
+                    "maxsize": self.maxsize, "nbytes": self.nbytes,
+                    "maxbytes": self.maxbytes}
+
+
+_MB = 1024 * 1024
+
+# one cache for each kind of kernel
+taper_kernel_cache = KernelCache(maxsize=64, maxbytes=64 * _MB)
+detrend_kernel_cache = KernelCache(maxsize=16, maxbytes=128 * _MB)
+taper_window_cache = KernelCache(maxsize=32, maxbytes=64 * _MB)
+overlap_save_kernel_cache = KernelCache(maxsize=32, maxbytes=32 * _MB)
+stf_kernel_cache = KernelCache(maxsize=32, maxbytes=64 * _MB)
+
+kernel_caches = {"taper": taper_kernel_cache,
+                 "detrend": detrend_kernel_cache,
+                 "taper_window": taper_window_cache,
+                 "overlap_save": overlap_save_kernel_cache,
+                 "stf": stf_kernel_cache}
+
+
+def clear_kernel_caches():
+    """ Clear all the kernel caches """
+    for cache in kernel_caches.values():
+        cache.clear()
+
+
+def _make_readonly(array):
+    array.setflags(write=False)
+    return array
+
+
+def get_taper_kernel(npts, delta, pre_filt, nfft=None):
+    """
+    Get the nfft and frequency domain taper used in filtering the
+    trace with npts and delta by pre_filt. The kernel is computed only
+    once for each (npts, delta, pre_filt) and then taken from the cache.
+
+    :param npts: number of points of trace
+    :type npts: int
+    :param delta: sampling interval of trace
+    :type delta: float
+    :param pre_filt: frequency array(Hz) in ascending order, to define
+        the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
+    :type pre_filt: Numpy.array or list
+    :param nfft: number of points of FFT. If None, it is determined
+        from npts, dodging large primes.
+    :type nfft: int
+    :return: (nfft, taper), taper is read-only
+    """
+    key = (int(npts), float(delta), tuple(float(f) for f in pre_filt),
+           nfft)
+
+    def _compute():
+        _nfft = nfft
+        if _nfft is None:
+            # smart calculation of nfft dodging large primes
+            _nfft = _npts2nfft(npts)
+        fy = 1.0 / (delta * 2.0)
+        freqs = np.linspace(0, fy, _nfft // 2 + 1)
+        taper = cosine_sac_taper(freqs, flimit=pre_filt)
+        return _nfft, _make_readonly(taper)
+
+    return taper_kernel_cache.get(key, _compute)
+
+
+def get_detrend_kernel(npts):
+    """
+    Get the kernel of least-squares linear detrend for data with npts.
+    For design matrix A = [x, 1], the coefficients of the linear trend
+    are (A^T A)^-1 A^T d, so (A^T A)^-1 A^T is precomputed from the
+    closed form of the 2x2 normal equations.
+
+    :param npts: number of points of data
+    :type npts: int
+    :return: (x, kernel), x is the normalized sample index with shape
+        (npts,) and kernel has shape (2, npts). Both are read-only.
+    """
+    key = int(npts)
+
+    def _compute():
+        x = np.arange(npts, dtype=np.float64) / npts
+        sx = x.sum()
+        sxx = np.dot(x, x)
+        det = npts * sxx - sx * sx
+        kernel = np.empty((2, npts))
+        # slope and intercept rows of (A^T A)^-1 A^T
+        kernel[0] = (npts * x - sx) / det
+        kernel[1] = (sxx - sx * x) / det
+        return _make_readonly(x), _make_readonly(kernel)
+
+    return detrend_kernel_cache.get(key, _compute)
+
+
+def get_taper_window(npts, sampling_rate, taper_type="hann",
+                     taper_percentage=0.05):
+    """
+    Get the time domain taper window, which is exactly the one used
+    in obspy.Trace.taper(max_percentage=taper_percentage,
+    type=taper_type).
+
+    :param npts: number of points of data
+    :type npts: int
+    :param sampling_rate: sampling rate of data
+    :type sampling_rate: float
+    :return: taper window, read-only
+    """
+    key = (int(npts), float(sampling_rate), taper_type,
+           float(taper_percentage))
+
+    def _compute():
+        tr = Trace(np.ones(npts))
+        tr.stats.sampling_rate = sampling_rate
+        tr.taper(max_percentage=taper_percentage, type=taper_type)
+        return _make_readonly(tr.data)
+
+    return taper_window_cache.get(key, _compute)
+
+
+def get_overlap_save_kernel(block_size, delta, pre_filt, tol=1e-10):
+    """
+    Get the kernel used in overlap-save filtering with FFT of
+    block_size. The impulse response of the frequency domain taper
+    is zero-phase and two-sided. It is truncated at lag K, beyond which
+    the energy of impulse response is less than tol of the total, so
+    each block of input contributes block_size - 2K output points. The
+    truncation error of filtered data is of order sqrt(tol) of its peak.
+
+    :param block_size: number of points of FFT in each block
+    :type block_size: int
+    :param delta: sampling interval of data
+    :type delta: float
+    :param pre_filt: frequency array(Hz) in ascending order, to define
+        the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
+    :type pre_filt: Numpy.array or list
+    :param tol: energy tolerance of the truncated impulse response
+    :type tol: float
+    :return: (K, spectrum of truncated impulse response), the spectrum
+        is read-only
+    """
+    key = (int(block_size), float(delta),
+           tuple(float(f) for f in pre_filt), float(tol))
+
+    def _compute():
+        freqs = np.linspace(0, 1.0 / (delta * 2.0), block_size // 2 + 1)
+        taper = cosine_sac_taper(freqs, flimit=pre_filt)
+        impulse = irfft(taper, n=block_size)
+
+        # energy of impulse response at lags >= k, both sides
+        energy = impulse[0:block_size // 2 + 1] ** 2
+        tail = 2 * np.cumsum(energy[::-1])[::-1]
+        below = np.nonzero(tail < tol * np.dot(impulse, impulse))[0]
+        if len(below) == 0:
+            nlag = block_size // 2
+        else:
+            nlag = int(below[0])
+
+        impulse[nlag:(block_size - nlag + 1)] = 0.0
+        spectrum = rfft(impulse).real
+        return nlag, _make_readonly(spectrum)
+
+    return overlap_save_kernel_cache.get(key, _compute)
+
+
+def get_stf_kernel(npts, delta, half_duration):
+    """
+    Get the nfft and spectrum of Gaussian source time function used in
+    SPECFEM, s(t) = alpha / sqrt(pi) * exp(-(alpha * t)^2), with
+    alpha = 1.628 / half_duration. The spectrum is
+    exp(-(pi * f / alpha)^2), which is real since the STF is centered
+    at t = 0.
+
+    :param npts: number of points of trace
+    :type npts: int
+    :param delta: sampling interval of trace
+    :type delta: float
+    :param half_duration: half duration of source(unit: second)
+    :type half_duration: float
+    :return: (nfft, spectrum), spectrum is read-only
+    """
+    key = (int(npts), float(delta), float(half_duration))
+
+    def _compute():
+        # at least twice of npts, so the convolution does not wrap around
+        nfft = _npts2nfft(npts)
+        alpha = 1.628 / half_duration
+        freqs = np.fft.rfftfreq(nfft, d=delta)
+        spectrum = np.exp(-(np.pi * freqs / alpha) ** 2)
+        return nfft, _make_readonly(spectrum)
+
+    return stf_kernel_cache.get(key, _compute)
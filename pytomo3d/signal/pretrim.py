@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Travel-time-aware pre-trimming of traces. Each trace is cut to a
+window from a bit before the first P arrival to a bit after the slowest
+surface wave, based on the epicentral distance and event depth, so near
+stations do not carry the long coda and far stations do not carry the
+long pre-P noise through processing.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (division, print_function, absolute_import)
+import math
+import numpy as np
+from obspy import Stream
+from obspy.core.util import AttribDict
+from obspy.geodetics import kilometers2degrees
+from obspy.taup import TauPyModel
+from pytomo3d.utils.geodesic import calculate_distance_azimuth
+from .rotate import extract_station_location
+
+
+# loaded taup models, keyed by model name
+_taup_models = {}
+
+
+def get_taup_model(model="ak135"):
+    """ Get the TauPyModel, which is loaded only once for each model """
+    if model not in _taup_models:
+        _taup_models[model] = TauPyModel(model=model)
+    return _taup_models[model]
+
+
+def get_first_arrival(distance_in_degree, event_depth_in_km,
+                      model="ak135"):
+    """
+    Get the travel time of first P-type arrival(unit: second). Return
+    0 if there is no P arrival(which should not happen).
+    """
+    arrivals = get_taup_model(model).get_travel_times(
+        source_depth_in_km=event_depth_in_km,
+        distance_in_degree=distance_in_degree, phase_list=["ttp"])
+    if len(arrivals) == 0:
+        return 0.0
+    return min(arr.time for arr in arrivals)
+
+
+def get_pretrim_window(distance_in_km, event_depth_in_km, pre_padding=300.0,
+                       post_padding=600.0, min_velocity=2.5,
+                       model="ak135"):
+    """
+    Get the time window of useful signal, relative to the event origin
+    time.
+
+    :param distance_in_km: epicentral distance(unit: km)
+    :type distance_in_km: float
+    :param event_depth_in_km: event depth(unit: km)
+    :type event_depth_in_km: float
+    :param pre_padding: time padding before the first P arrival
+    :type pre_padding: float
+    :param post_padding: time padding after the arrival of min_velocity
+    :type post_padding: float
+    :param min_velocity: the slowest group velocity of surface wave
+        (unit: km/s)
+    :type min_velocity: float
+    :param model: taup model name
+    :type model: str
+    :return: (begin, end) in seconds relative to the origin time
+    """
+    if min_velocity <= 0:
+        raise ValueError("min_velocity(%s) should be positive"
+                         % min_velocity)
+    first_arrival = get_first_arrival(kilometers2degrees(distance_in_km),
+                                      event_depth_in_km, model=model)
+    begin = first_arrival - pre_padding
+    end = distance_in_km / min_velocity + post_padding
+    return begin, end
+
+
+def _align_to_grid(t1, t2, starttime, sampling_rate):
+    # cut [t1, t2] to the grid of starttime + k / sampling_rate
+    eps = 1e-6
+    n1 = int(math.ceil((t1 - starttime) * sampling_rate - eps))
+    n2 = int(math.floor((t2 - starttime) * sampling_rate + eps))
+    n1 = max(n1, 0)
+    return n1, n2
+
+
+def pretrim_stream(st, inventory, event_time, event_latitude,
+                   event_longitude, event_depth, starttime=None,
+                   endtime=None, sampling_rate=None, pre_padding=300.0,
+                   post_padding=600.0, min_velocity=2.5, model="ak135",
+                   geometry_table=None, event_id=None):
+    """
+    Cut each trace of stream to the distance dependent window, see
+    get_pretrim_window, in place. The window is also limited within
+    [starttime, endtime], if they are given. If sampling_rate is given,
+    the window is aligned with the time grid of
+    starttime + k / sampling_rate, so traces could be resampled to it.
+    Without starttime, the grid starts at the window starttime, and the
+    offset is 0.
+
+    The window is recorded in tr.stats.pretrim, with keys of:
+        "starttime" and "endtime": the window
+        "reference": starttime of the full time grid(the window
+            starttime if starttime is not given)
+        "offset": window starttime - reference(unit: second)
+        "offset_npts": offset in samples of sampling_rate, so the trace
+            could be put back to the full grid
+        "npts": number of samples of the window in sampling_rate
+    The last three keys, and "reference", are only set if sampling_rate
+    is given.
+    Traces without station location in inventory are not cut.
+
+    :param event_depth: event depth(unit: km)
+    :type event_depth: float
+    :param geometry_table: event-station geometry table. If provided,
+        the distance is taken from it, and the event and stations not in
+        it are added to it, the same as in
+        pytomo3d.signal.rotate.get_station_geometry
+    :type geometry_table: pytomo3d.utils.geodesic.GeometryTable
+    :param event_id: id of the event in geometry_table, required if
+        geometry_table is provided
+    :type event_id: str
+    :return: the stream
+    """
+    if not isinstance(st, Stream):
+        raise TypeError("Input st should be type of Stream")
+    if geometry_table is not None and event_id is None:
+        raise ValueError("event_id is required to use geometry_table")
+
+    windows = {}
+    locations = {}
+    for tr in st:
+        station_id = "%s.%s" % (tr.stats.network, tr.stats.station)
+        if station_id in windows or station_id in locations:
+            continue
+        try:
+            locations[station_id] = extract_station_location(
+                Stream(traces=[tr]), inventory)
+        except Exception as errmsg:
+            print("Error extracting station location of %s, skip "
+                  "pre-trimming: %s" % (tr.id, errmsg))
+            windows[station_id] = None
+
+    station_ids = sorted(locations.keys())
+    dists = []
+    if geometry_table is not None:
+        geometry_table.update(
+            events={event_id: (event_latitude, event_longitude)},
+            stations=locations)
+        dists = [geometry_table.get_distance(event_id, station_id)
+                 for station_id in station_ids]
+    elif len(station_ids) > 0:
+        # distance of all stations in one call
+        dists, _, _ = calculate_distance_azimuth(
+            event_latitude, event_longitude,
+            np.array([locations[k][0] for k in station_ids]),
+            np.array([locations[k][1] for k in station_ids]),
+            method="ellipsoid")
+    for station_id, dist in zip(station_ids, dists):
+        begin, end = get_pretrim_window(
+            float(dist), event_depth, pre_padding=pre_padding,
+            post_padding=post_padding, min_velocity=min_velocity,
+            model=model)
+        windows[station_id] = (event_time + begin, event_time + end)
+
+    for tr in st:
+        station_id = "%s.%s" % (tr.stats.network, tr.stats.station)
+        window = windows[station_id]
+        if window is None:
+            continue
+
+        t1, t2 = window
+        if starttime is not None:
+            t1 = max(t1, starttime)
+        if endtime is not None:
+            t2 = min(t2, endtime)
+        t1 = max(t1, tr.stats.starttime)
+        t2 = min(t2, tr.stats.endtime)
+
+        info = AttribDict()
+        if sampling_rate is not None:
+            # without starttime, the grid starts at the window itself
+            reference = starttime if starttime is not None else t1
+            n1, n2 = _align_to_grid(t1, t2, reference, sampling_rate)
+            t1 = reference + n1 / sampling_rate
+            t2 = reference + n2 / sampling_rate
+            info.reference = reference
+            info.offset = n1 / sampling_rate
+            info.offset_npts = n1
+            info.npts = n2 - n1 + 1
+        if t2 <= t1:
+            print("Pre-trim window of %s is empty, skip pre-trimming"
+                  % tr.id)
+            continue
+        info.starttime = t1
+        info.endtime = t2
+        tr.stats.pretrim = info
+
+        # keep a few samples on both sides for interpolation
+        margin = 10 * tr.stats.delta
+        tr.trim(t1 - margin, t2 + margin)
+
+    return st
@@ -11,11 +11,20 @@ Methods that handles signal data processing for stream(Obspy.Stream)
 """
 
 from __future__ import (division, print_function, absolute_import)
-from obspy.signal.invsim import cosine_sac_taper
-from obspy.signal.util import _npts2nfft
+import multiprocessing
+from fractions import Fraction
 from obspy import Stream, Trace
 import numpy as np
-from .rotate import rotate_stream
+from pytomo3d.utils.fft import rfft, irfft, get_fft_backend, next_fast_len
+from .kernel_cache import (get_taper_kernel, get_detrend_kernel,
+                           get_taper_window, get_overlap_save_kernel)
+from .resample import resample_trace, get_decimated_sampling_rate
+from .pretrim import pretrim_stream
+from .stf import convolve_stf_array
+from .response import (ResponseCache, get_response_removed_spectrum,
+                       remove_response_stream, remove_response_trace)
+from .rotate import (rotate_stream, sort_stream_by_station,
+                     get_station_geometry, select_station_inventory)
 
 
 def check_array_order(array, order="ascending"):
@@ -85,21 +94,199 @@ def flex_cut_stream(st, cut_start, cut_end, dynamic_npts=0):
     return new_st
 
 
-def filter_stream(st, pre_filt):
+def group_traces_by_grid(st):
+    """
+    Group traces that share the same time grid, i.e., the same number
+    of points and sampling interval, so they could be processed together
+    as one 2-D array.
+
+    :param st: input stream
+    :type st: obspy.Stream
+    :return: dict with key of (npts, delta) and value of trace list
+    """
+    groups = {}
+    for tr in st:
+        key = (tr.stats.npts, tr.stats.delta)
+        groups.setdefault(key, []).append(tr)
+    return groups
+
+
+def check_pre_filt(pre_filt):
+    """
+    Check the 4 corner frequencies of filter band
+    """
+    if len(pre_filt) != 4:
+        raise ValueError("Length of filter must be 4(corner frequencies)")
+    if not check_array_order(pre_filt, order="ascending"):
+        raise ValueError("Frequency band should be in ascending order: %s"
+                         % pre_filt)
+
+
+def filter_array(data, delta, pre_filt):
+    """
+    Frequency domain taper on data array. If data is 2-D array, then
+    each row is treated as one trace and all rows are filtered by one
+    vectorized FFT along the last axis.
+
+    :param data: input data array, 1-D or 2-D
+    :type data: numpy.array
+    :param delta: sampling interval of data
+    :type delta: float
+    :param pre_filt: frequency array(Hz) in ascending order, to define
+        the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
+    :type pre_filt: Numpy.array or list
+    :return: filtered data array, with the same shape and dtype as input.
+        For float32 input, the FFT runs in single precision.
+    """
+    origin_len = data.shape[-1]
+    dtype = data.dtype
+
+    # nfft and taper only depend on (npts, delta, pre_filt), so they
+    # are taken from the kernel cache
+    nfft, taper = get_taper_kernel(origin_len, delta, pre_filt)
+
+    # Transform data to Frequency domain
+    data = rfft(data, n=nfft, axis=-1)
+    data *= taper
+    data[..., -1] = np.abs(data[..., -1]) + 0.0j
+    # transform data back into the time domain
+    data = irfft(data, axis=-1)[..., 0:origin_len]
+    return data.astype(dtype, copy=False)
+
+
+def overlap_save_filter_array(data, delta, pre_filt, block_size,
+                              tol=1e-10):
+    """
+    Frequency domain taper on 1-D data array, in overlap-save blocks
+    of block_size points. Each block reads K points of overlap on both
+    sides(K is the length of truncated impulse response of filter, see
+    get_overlap_save_kernel) and outputs block_size - 2K points, so the
+    memory used in FFT is bounded by block_size, no matter how long the
+    data is.
+
+    The result is an approximation of filter_array. The impulse
+    response of the cosine taper only decays as 1/t^3, so it is
+    truncated where the energy of its tail is below tol. The error is
+    of order sqrt(tol) of the peak amplitude of output: with the
+    default tol=1e-10, the max error measured on white noise is about
+    1e-5 of the peak. A smaller tol gives a smaller error, with longer
+    K and so a larger block_size needed.
+
+    :param data: input data array, 1-D
+    :type data: numpy.array
+    :param delta: sampling interval of data
+    :type delta: float
+    :param pre_filt: frequency array(Hz) in ascending order, to define
+        the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
+    :type pre_filt: Numpy.array or list
+    :param block_size: number of points of FFT in each block
+    :type block_size: int
+    :param tol: energy tolerance of the truncated impulse response
+    :type tol: float
+    :return: filtered data array, with the same shape and dtype as input
+    """
+    nlag, spectrum = get_overlap_save_kernel(block_size, delta, pre_filt,
+                                             tol=tol)
+    nvalid = block_size - 2 * nlag
+    if nvalid < 2 * nlag:
+        raise ValueError("block_size(%d) is too small for the filter "
+                         "band %s, it should be at least %d"
+                         % (block_size, list(pre_filt), 6 * nlag))
+
+    npts = len(data)
+    output = np.empty(npts, dtype=data.dtype)
+    block = np.zeros(block_size, dtype=data.dtype)
+    for start in range(0, npts, nvalid):
+        # input segment [start - nlag, start + nvalid + nlag), zero
+        # padded outside of data
+        left = max(start - nlag, 0)
+        right = min(start + nvalid + nlag, npts)
+        block[:] = 0.0
+        offset = left - (start - nlag)
+        block[offset:(offset + right - left)] = data[left:right]
+
+        _data = irfft(rfft(block) * spectrum, n=block_size)
+        nout = min(nvalid, npts - start)
+        output[start:(start + nout)] = _data[nlag:(nlag + nout)]
+    return output
+
+
+def filter_stream(st, pre_filt, batch_flag=False, dtype=np.float64,
+                  block_size=None):
     """
     Filter a stream
 
-    :param st:
-    :param per_filt:
+    :param st: input stream
+    :type st: obspy.Stream
+    :param pre_filt: frequency array(Hz) in ascending order, to define
+        the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
+    :type pre_filt: Numpy.array or list
+    :param batch_flag: if True, traces sharing the same (npts, delta)
+        are stacked into one 2-D array and filtered together with
+        a single FFT. The output is the same as filtering trace by trace.
+    :type batch_flag: bool
+    :param dtype: float type used in filtering, np.float64 or np.float32
+    :type dtype: numpy.dtype
+    :param block_size: if not None, traces longer than block_size are
+        filtered in overlap-save blocks of block_size points, to bound
+        the memory usage on long continuous records. It is an
+        approximation of the one-shot filter, with an error of about
+        1e-5 of the peak amplitude, see overlap_save_filter_array.
+    :type block_size: int
     :return:
     """
     if not isinstance(st, Stream):
         raise TypeError("Input st should be type of Stream")
-    for tr in st:
-        filter_trace(tr, pre_filt)
+
+    if not batch_flag or block_size is not None:
+        for tr in st:
+            filter_trace(tr, pre_filt, dtype=dtype, block_size=block_size)
+        return
+
+    check_pre_filt(pre_filt)
+    for (npts, delta), traces in group_traces_by_grid(st).items():
+        if npts == 0:
+            continue
+        data = np.array([tr.data for tr in traces], dtype=dtype)
+        data = filter_array(data, delta, pre_filt)
+        for tr, _data in zip(traces, data):
+            tr.data = _data
+
+
+def convolve_stf_stream(st, half_duration):
+    """
+    Convolve the stream with Gaussian source time function, in place.
+    Traces sharing the same (npts, delta) are stacked into one 2-D
+    array and convolved together with a single FFT.
+
+    :param st: input stream
+    :type st: obspy.Stream
+    :param half_duration: half duration of source(unit: second), for
+        example, pytomo3d.source.CMTSource.half_duration. Nothing is done
+        if it is zero.
+    :type half_duration: float
+    """
+    if not isinstance(st, Stream):
+        raise TypeError("Input st should be type of Stream")
+    if half_duration < 0:
+        raise ValueError("half_duration(%s) should be non-negative"
+                         % half_duration)
+    if half_duration == 0:
+        return
+
+    for (npts, delta), traces in group_traces_by_grid(st).items():
+        if npts == 0:
+            continue
+        dtype = np.result_type(*[tr.data.dtype for tr in traces])
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+        data = np.array([tr.data for tr in traces], dtype=dtype)
+        data = convolve_stf_array(data, delta, half_duration)
+        for tr, _data in zip(traces, data):
+            tr.data = _data
 
 
-def filter_trace(tr, pre_filt):
+def filter_trace(tr, pre_filt, dtype=np.float64, block_size=None):
     """
     Perform a frequency domain taper mimicing the behavior during the
     response removal, without a actual response removal.
@@ -108,63 +295,403 @@ def filter_trace(tr, pre_filt):
     :param pre_filt: frequency array(Hz) in ascending order, to define
         the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
     :type pre_filt: Numpy.array or list
+    :param dtype: float type used in filtering, np.float64 or np.float32
+    :type dtype: numpy.dtype
+    :param block_size: if not None and the trace is longer than
+        block_size, the trace is filtered in overlap-save blocks of
+        block_size points. The result approximates filtering in one
+        shot, see overlap_save_filter_array for the error.
+    :type block_size: int
     :return: filtered trace
     """
     if not isinstance(tr, Trace):
         raise TypeError("First Argument should be trace: %s" % type(tr))
-    if len(pre_filt) != 4:
-        raise ValueError("Length of filter must be 4(corner frequencies)")
-    if not check_array_order(pre_filt, order="ascending"):
-        raise ValueError("Frequency band should be in ascending order: %s"
-                         % pre_filt)
+    check_pre_filt(pre_filt)
 
-    data = tr.data.astype(np.float64)
-    origin_len = len(data)
-    if origin_len == 0:
+    data = tr.data.astype(dtype)
+    if len(data) == 0:
         return
 
-    # smart calculation of nfft dodging large primes
-    nfft = _npts2nfft(len(data))
-
-    fy = 1.0 / (tr.stats.delta * 2.0)
-    freqs = np.linspace(0, fy, nfft // 2 + 1)
-
-    # Transform data to Frequency domain
-    data = np.fft.rfft(data, n=nfft)
-    data *= cosine_sac_taper(freqs, flimit=pre_filt)
-    data[-1] = abs(data[-1]) + 0.0j
-    # transform data back into the time domain
-    data = np.fft.irfft(data)[0:origin_len]
     # assign processed data and store processing information
-    tr.data = data
+    if block_size is not None and len(data) > block_size:
+        tr.data = overlap_save_filter_array(data, tr.stats.delta, pre_filt,
+                                            block_size)
+    else:
+        tr.data = filter_array(data, tr.stats.delta, pre_filt)
 
 
-def interpolate_stream(stream, sampling_rate, starttime=None, npts=None):
+def interpolate_stream(stream, sampling_rate, starttime=None, npts=None,
+                       method="interpolate"):
     """
     For a fairly large stream, use stream.interpolate() is not a wise
     choice since if there is one trace fails, then the whole interpolation
     will stop. So it is better to operate interpolation on the trace
     level
+
+    :param method: resample method, could be one of:
+        1) "interpolate": use obspy.Trace.interpolate
+        2) "polyphase": use polyphase filtering if the ratio of
+            sampling rates is rational, otherwise interpolation
+    :type method: str
     """
     st_new = Stream()
     if not isinstance(stream, Stream):
         raise TypeError("Input stream must be type of obspy.Stream")
     for tr in stream:
         try:
-            tr.interpolate(sampling_rate, starttime=starttime, npts=npts)
+            resample_trace(tr, sampling_rate, starttime=starttime, npts=npts,
+                           method=method)
             st_new.append(tr)
         except ValueError as err:
             print("Error in interpolation on '%s':%s" % (tr.id, err))
     return st_new
 
 
+def get_spectral_resample_nfft(npts, delta, new_delta, max_denominator=1000):
+    """
+    Get the number of FFT points(nfft, nfft_out) used to resample the
+    data from delta to new_delta in the frequency domain. The FFT length
+    should satisfy nfft * delta == nfft_out * new_delta, so the ratio of
+    two sampling rates should be a rational number. None is returned
+    if it could not be satisfied.
+
+    :param npts: number of points of input data
+    :type npts: int
+    :param delta: sampling interval of input data
+    :type delta: float
+    :param new_delta: sampling interval of output data
+    :type new_delta: float
+    :return: (nfft, nfft_out) or None
+    """
+    ratio = delta / new_delta
+    frac = Fraction(ratio).limit_denominator(max_denominator)
+    if abs(float(frac) - ratio) > 1e-9 * ratio:
+        return None
+    # nfft should be a multiple of 2 * denominator, and the rest
+    # of it should dodge large primes
+    base = 2 * frac.denominator
+    nblock = next_fast_len(int(np.ceil(2 * npts / base)))
+    nfft = nblock * base
+    nfft_out = nfft * frac.numerator // frac.denominator
+    return nfft, nfft_out
+
+
+def spectral_resample_trace(tr, pre_filt, sampling_rate, starttime=None,
+                            npts=None, inventory=None, water_level=60,
+                            response_cache=None, dtype=np.float64):
+    """
+    Filter the trace(and remove the instrument response if inventory is
+    provided) and resample it to the new time grid in one single FFT
+    pass. Since the data is band-limited by the filter, the resampling
+    is done by truncating(or zero padding) the spectrum to the new
+    Nyquist frequency, and the time shift to the new starttime is
+    applied as a phase ramp.
+
+    If the ratio of two sampling rates is not a rational number with
+    small denominator, or the response could only be removed in time
+    domain(polynomial response), it falls back to filtering and then
+    interpolation in time domain.
+
+    :param tr: input trace
+    :type tr: obspy.Trace
+    :param pre_filt: frequency array(Hz) in ascending order, to define
+        the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
+    :type pre_filt: Numpy.array or list
+    :param sampling_rate: new sampling rate(unit: Hz)
+    :type sampling_rate: float
+    :param starttime: starttime of new time grid. If None, the starttime
+        of trace is used.
+    :type starttime: obspy.UTCDateTime
+    :param npts: number of points of new time grid. If None, the new
+        grid runs to the endtime of trace.
+    :type npts: int
+    :param inventory: station inventory information. If provided, the
+        instrument response is removed.
+    :type inventory: obspy.Inventory
+    :param water_level: water level used in inverting the response
+    :type water_level: float
+    :param response_cache: cache of inverted instrument response spectrum
+    :type response_cache: pytomo3d.signal.response.ResponseCache
+    :param dtype: float type used in processing, np.float64 or np.float32
+    :type dtype: numpy.dtype
+    """
+    if not isinstance(tr, Trace):
+        raise TypeError("First Argument should be trace: %s" % type(tr))
+    check_pre_filt(pre_filt)
+
+    delta = tr.stats.delta
+    new_delta = 1.0 / sampling_rate
+    if starttime is None:
+        starttime = tr.stats.starttime
+    if npts is None:
+        npts = int((tr.stats.endtime - starttime) * sampling_rate) + 1
+
+    # the new time grid must be fully contained in the old one
+    eps = 1e-6 * delta
+    time_shift = starttime - tr.stats.starttime
+    if time_shift < -eps or \
+            starttime + (npts - 1) * new_delta > tr.stats.endtime + eps:
+        raise ValueError("The new array must be fully contained in the "
+                         "old array.")
+
+    nffts = get_spectral_resample_nfft(tr.stats.npts, delta, new_delta)
+    spectrum = None
+    if nffts is not None:
+        nfft, nfft_out = nffts
+        if inventory is not None:
+            try:
+                spectrum, _ = get_response_removed_spectrum(
+                    tr, inventory, output="DISP", water_level=water_level,
+                    response_cache=response_cache, nfft=nfft, dtype=dtype)
+            except ValueError:
+                spectrum = None
+        else:
+            spectrum = rfft(tr.data.astype(dtype), n=nfft)
+
+    if spectrum is None:
+        # fall back to time domain
+        if inventory is not None:
+            remove_response_trace(tr, inventory, output="DISP",
+                                  water_level=water_level,
+                                  pre_filt=pre_filt)
+        else:
+            filter_trace(tr, pre_filt, dtype=dtype)
+        tr.interpolate(sampling_rate, starttime=starttime, npts=npts)
+        tr.data = np.require(tr.data, dtype=dtype)
+        return
+
+    spectrum *= get_taper_kernel(tr.stats.npts, delta, pre_filt,
+                                 nfft=nfft)[1]
+    spectrum[-1] = abs(spectrum[-1]) + 0.0j
+
+    # truncate or zero pad the spectrum to the new Nyquist frequency
+    nfreq_out = nfft_out // 2 + 1
+    if nfreq_out <= len(spectrum):
+        spectrum = spectrum[0:nfreq_out]
+    else:
+        spectrum = np.concatenate(
+            [spectrum, np.zeros(nfreq_out - len(spectrum), spectrum.dtype)])
+
+    # phase ramp for the time shift to the new starttime
+    freqs = np.arange(nfreq_out) / (nfft * delta)
+    spectrum *= np.exp(2j * np.pi * freqs * time_shift)
+
+    data = irfft(spectrum, n=nfft_out)[0:npts]
+    data *= nfft_out / nfft
+
+    tr.data = data.astype(dtype, copy=False)
+    tr.stats.starttime = starttime
+    tr.stats.sampling_rate = sampling_rate
+
+
+def spectral_resample_stream(stream, pre_filt, sampling_rate, starttime=None,
+                             npts=None, inventory=None, water_level=60,
+                             response_cache=None, dtype=np.float64):
+    """
+    Filter(and remove response) and resample the stream in a single
+    FFT pass per trace. See spectral_resample_trace. As in
+    interpolate_stream, the trace is thrown away if it fails.
+    """
+    st_new = Stream()
+    if not isinstance(stream, Stream):
+        raise TypeError("Input stream must be type of obspy.Stream")
+    for tr in stream:
+        try:
+            spectral_resample_trace(
+                tr, pre_filt, sampling_rate, starttime=starttime, npts=npts,
+                inventory=inventory, water_level=water_level,
+                response_cache=response_cache, dtype=dtype)
+            st_new.append(tr)
+        except ValueError as err:
+            print("Error in spectral resampling on '%s':%s" % (tr.id, err))
+    return st_new
+
+
+def detrend_array(data):
+    """
+    Least-squares linear detrend on data array, in place. If data is
+    2-D array, each row is treated as one trace.
+
+    :param data: input data array, 1-D or 2-D, of float type
+    :type data: numpy.array
+    """
+    x, kernel = get_detrend_kernel(data.shape[-1])
+    coef = np.dot(data, kernel.T)
+    data -= coef[..., 0:1] * x + coef[..., 1:2]
+
+
+def demean_array(data):
+    """
+    Remove the mean of data array, in place. If data is 2-D array, each
+    row is treated as one trace.
+    """
+    data -= data.mean(axis=-1, keepdims=True)
+
+
+def taper_array(data, sampling_rate, taper_type="hann",
+                taper_percentage=0.05):
+    """
+    Taper the data array in time domain, in place. If data is 2-D array,
+    each row is treated as one trace. The taper window is the same as
+    obspy.Trace.taper.
+    """
+    data *= get_taper_window(data.shape[-1], sampling_rate,
+                             taper_type=taper_type,
+                             taper_percentage=taper_percentage)
+
+
+def detrend_and_taper_stream(st, taper_type="hann", taper_percentage=0.05):
+    """
+    Linear detrend, demean and taper the stream, in place. Traces
+    sharing the same (npts, delta) are stacked into one 2-D array and
+    processed by the vectorized kernels. Other traces are processed
+    by obspy.
+    """
+    for (npts, delta), traces in group_traces_by_grid(st).items():
+        if len(traces) == 1 or npts < 2:
+            for tr in traces:
+                tr.detrend("linear")
+                tr.detrend("demean")
+                tr.taper(max_percentage=taper_percentage, type=taper_type)
+            continue
+
+        dtype = np.result_type(*[tr.data.dtype for tr in traces])
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+        data = np.array([tr.data for tr in traces], dtype=dtype)
+        detrend_array(data)
+        demean_array(data)
+        taper_array(data, 1.0 / delta, taper_type=taper_type,
+                    taper_percentage=taper_percentage)
+        for tr, _data in zip(traces, data):
+            tr.data = _data
+
+
+def resample_or_cut_stream(st, resample_flag=False, sampling_rate=1.0,
+                           starttime=None, endtime=None,
+                           method="interpolate", dtype=None):
+    """
+    Resample the stream to sampling_rate if resample_flag is True.
+    Otherwise, just cut the stream to [starttime, endtime]
+    """
+    if resample_flag:
+        # interpolation
+        if sampling_rate is None:
+            raise ValueError("sampling rate should be provided if you set"
+                             "resample_flag=True")
+
+        if endtime is not None and starttime is not None:
+            npts = int((endtime - starttime) * sampling_rate) + 1
+            st = interpolate_stream(st, sampling_rate, starttime=starttime,
+                                    npts=npts, method=method)
+        else:
+            # it doesn't matter if starttime is None or not, cause
+            # obspy will handle this case
+            st = interpolate_stream(st, sampling_rate, starttime=starttime,
+                                    method=method)
+        if dtype is not None:
+            # interpolation might change the dtype
+            for tr in st:
+                tr.data = np.require(tr.data, dtype=dtype)
+    else:
+        if starttime is not None and endtime is not None:
+            # just cut
+            st.trim(starttime, endtime)
+    return st
+
+
+def resample_or_cut_pretrimmed_stream(st, resample_flag=False,
+                                      sampling_rate=1.0, starttime=None,
+                                      endtime=None, method="interpolate",
+                                      dtype=None):
+    """
+    Same as resample_or_cut_stream, but the traces pre-trimmed by
+    pytomo3d.signal.pretrim.pretrim_stream are resampled(or cut) to
+    their own window recorded in tr.stats.pretrim. The other traces
+    are resampled(or cut) to [starttime, endtime].
+    """
+    st_full = Stream()
+    st_new = Stream()
+    for tr in st:
+        info = tr.stats.get("pretrim", None)
+        if info is None:
+            st_full.append(tr)
+            continue
+        if resample_flag:
+            try:
+                resample_trace(tr, sampling_rate, starttime=info.starttime,
+                               npts=info.npts, method=method)
+            except ValueError as err:
+                print("Error in interpolation on '%s':%s" % (tr.id, err))
+                continue
+        else:
+            tr.trim(info.starttime, info.endtime)
+        if dtype is not None:
+            tr.data = np.require(tr.data, dtype=dtype)
+        st_new.append(tr)
+
+    if len(st_full) > 0:
+        st_new += resample_or_cut_stream(
+            st_full, resample_flag=resample_flag, sampling_rate=sampling_rate,
+            starttime=starttime, endtime=endtime, method=method, dtype=dtype)
+    return st_new
+
+
+def _stream_from_input(st):
+    # check input data type
+    if isinstance(st, Trace):
+        return Stream(traces=[st, ]), True
+    elif isinstance(st, Stream):
+        return st, False
+    else:
+        raise TypeError("Input seismogram should be either obspy.Stream "
+                        "or obspy.Trace")
+
+
+def _finalize_stream(st, _is_trace, rotate_flag=False, inventory=None,
+                     event_latitude=None, event_longitude=None,
+                     sanity_check=False, station_geometry=None,
+                     sanity_registry=None):
+    # rotate
+    if rotate_flag:
+        st = rotate_stream(st, event_latitude, event_longitude,
+                           inventory=inventory, mode="ALL->RT",
+                           sanity_check=sanity_check,
+                           station_geometry=station_geometry,
+                           sanity_registry=sanity_registry)
+
+    # Convert to single precision to save space.
+    for tr in st:
+        tr.data = np.require(tr.data, dtype="float32")
+
+    # transfer back to trace if input type is Trace
+    if _is_trace:
+        st = st[0]
+
+    return st
+
+
+def _record_auto_resample(st, sampling_rate, pre_filt, oversampling_factor):
+    info = "pytomo3d: auto resample(sampling_rate=%r, max_frequency=%r, " \
+        "oversampling_factor=%r)" % (sampling_rate, float(pre_filt[3]),
+                                     float(oversampling_factor))
+    for tr in st:
+        tr.stats.setdefault("processing", []).append(info)
+
+
 def process_stream(st, inventory=None, remove_response_flag=False,
                    water_level=60, filter_flag=False, pre_filt=None,
                    starttime=None, endtime=None,
                    resample_flag=False, sampling_rate=1.0,
                    taper_type="hann", taper_percentage=0.05,
                    rotate_flag=False, event_latitude=None,
-                   event_longitude=None, sanity_check=False):
+                   event_longitude=None, sanity_check=False,
+                   response_cache=None, resample_mode="interpolate",
+                   dtype="float64", station_geometry=None,
+                   auto_resample_flag=False, oversampling_factor=4.0,
+                   pretrim_flag=False, event_time=None, event_depth=None,
+                   pretrim_kwargs=None, stf_half_duration=None,
+                   sanity_registry=None):
     """
     Stream processing function defined for general purpose of tomography.
     The advantage of using Stream, rather than than Trace, is that rotation
@@ -210,27 +737,137 @@ def process_stream(st, inventory=None, remove_response_flag=False,
     :param sanity_check: sanity check the inventory information when
         rotating.
     :type sanity_check: bool
+    :param response_cache: cache of inverted instrument response spectrum.
+        If provided, each distinct response is only evaluated once for
+        each sampling grid, and could be shared among calls. If it is
+        None, the response is removed by obspy, unless dtype is float32
+        or the FFT backend(pytomo3d.utils.fft) is not numpy, in which
+        case a cache only for this call is used. Only used when
+        remove_response_flag is True.
+    :type response_cache: pytomo3d.signal.response.ResponseCache
+    :param resample_mode: resample method, could be one of:
+        1) "interpolate": filter in frequency domain, and then
+            interpolate in time domain
+        2) "spectral": remove response, filter and resample in one FFT
+            pass, with time shift applied as a phase ramp. It requires
+            filter_flag=True since the data has to be band-limited.
+            The second detrend and taper are applied on the new grid.
+        3) "polyphase": polyphase filtering if the ratio of sampling
+            rates is rational, otherwise interpolation
+    :type resample_mode: str
+    :param dtype: float type used through the processing, "float64" or
+        "float32". In "float32" mode, the data is kept in single
+        precision through detrend, taper, response removal and
+        filtering(complex64 spectrum) and is cast back to single
+        precision after resampling, which halves the memory footprint.
+        Compared to "float64" on the data in tests/data/raw(IU.KBL,
+        27-90 s band), the max difference is about 1e-6 of the max
+        amplitude. The output is always float32.
+    :type dtype: str
+    :param station_geometry: precomputed inventory subset and back azimuth
+        of stations used in rotation, see
+        pytomo3d.signal.rotate.get_station_geometry
+    :type station_geometry: dict
+    :param auto_resample_flag: if True, the stream is resampled to the
+        lowest safe sampling rate for the filter band, whose Nyquist
+        frequency is oversampling_factor times the upper corner of
+        pre_filt(see pytomo3d.signal.resample.get_decimated_sampling_rate),
+        instead of sampling_rate. It requires filter_flag=True. The chosen
+        sampling rate is recorded in tr.stats.processing.
+    :type auto_resample_flag: bool
+    :param oversampling_factor: oversampling factor used in choosing the
+        sampling rate, if auto_resample_flag is True
+    :type oversampling_factor: float
+    :param pretrim_flag: if True, each trace is cut to a window from
+        before the first P arrival to after the slowest surface wave,
+        based on the epicentral distance and event depth, before
+        processing. The output traces then have different starttime and
+        npts, and the offsets to the full grid are recorded in
+        tr.stats.pretrim. See pytomo3d.signal.pretrim.pretrim_stream.
+        It requires inventory, event location, event_time and event_depth
+        and could not be used with resample_mode="spectral".
+    :type pretrim_flag: bool
+    :param event_time: event origin time, used in pre-trimming
+    :type event_time: obspy.UTCDateTime
+    :param event_depth: event depth(unit: km), used in pre-trimming
+    :type event_depth: float
+    :param pretrim_kwargs: other arguments of pretrim_stream, like
+        {"pre_padding": 300.0, "post_padding": 600.0, "min_velocity": 2.5}
+    :type pretrim_kwargs: dict
+    :param stf_half_duration: if not None, the stream is convolved with
+        Gaussian source time function of this half duration before
+        processing. It is used for synthetics from SPECFEM, with the
+        half duration from pytomo3d.source.CMTSource.half_duration.
+    :type stf_half_duration: float
+    :param sanity_registry: registry of inventory sanity checks used in
+        rotation, keyed by channel id and epoch, so the checks are not
+        repeated for every event. See
+        pytomo3d.signal.sanity_registry.SanityRegistry
+    :type sanity_registry: pytomo3d.signal.sanity_registry.SanityRegistry
     :return: processed stream
     """
-    # check input data type
-    if isinstance(st, Trace):
-        st = Stream(traces=[st, ])
-        _is_trace = True
-    elif isinstance(st, Stream):
-        _is_trace = False
-    else:
-        raise TypeError("Input seismogram should be either obspy.Stream "
-                        "or obspy.Trace")
+    st, _is_trace = _stream_from_input(st)
+
+    if auto_resample_flag:
+        if not filter_flag or pre_filt is None:
+            raise ValueError("auto_resample_flag=True requires filter_flag="
+                             "True and pre_filt to decide the sampling rate")
+        check_pre_filt(pre_filt)
+        resample_flag = True
+        sampling_rate = get_decimated_sampling_rate(
+            pre_filt[3], oversampling_factor=oversampling_factor)
+
+    if dtype not in ("float64", "float32"):
+        raise ValueError("dtype(%s) should be either 'float64' or 'float32'"
+                         % dtype)
+    dtype = np.dtype(dtype)
+    if remove_response_flag and response_cache is None and \
+            (dtype == np.float32 or get_fft_backend()[0] != "numpy"):
+        # obspy removes response in double precision, and with numpy FFT.
+        # Otherwise, it is removed through pytomo3d.utils.fft, with a
+        # cache only for this call
+        response_cache = ResponseCache()
+
+    if resample_mode not in ("interpolate", "spectral", "polyphase"):
+        raise ValueError("resample_mode(%s) should be within ['interpolate', "
+                         "'spectral', 'polyphase']" % resample_mode)
+    spectral_flag = resample_flag and resample_mode == "spectral"
+    if spectral_flag and not filter_flag:
+        raise ValueError("resample_mode='spectral' requires filter_flag=True "
+                         "to band-limit the data")
+
+    if pretrim_flag:
+        if inventory is None or event_latitude is None or \
+                event_longitude is None or event_time is None or \
+                event_depth is None:
+            raise ValueError("pretrim_flag=True requires inventory, "
+                             "event_latitude, event_longitude, event_time "
+                             "and event_depth")
+        if spectral_flag:
+            raise ValueError("pretrim_flag=True could not be used with "
+                             "resample_mode='spectral'")
 
     # cut the stream out before processing to reduce computation
     if starttime is not None and endtime is not None:
         st = flex_cut_stream(st, starttime, endtime, dynamic_npts=10)
 
+    if pretrim_flag:
+        _sampling_rate = sampling_rate if resample_flag else None
+        pretrim_stream(st, inventory, event_time, event_latitude,
+                       event_longitude, event_depth, starttime=starttime,
+                       endtime=endtime, sampling_rate=_sampling_rate,
+                       **(pretrim_kwargs or {}))
+
+    for tr in st:
+        tr.data = np.require(tr.data, dtype=dtype)
+
+    if stf_half_duration is not None:
+        convolve_stf_stream(st, stf_half_duration)
+
     if filter_flag or remove_response_flag:
         # detrend ,demean, taper
-        st.detrend("linear")
-        st.detrend("demean")
-        st.taper(max_percentage=taper_percentage, type=taper_type)
+        detrend_and_taper_stream(st, taper_type=taper_type,
+                                 taper_percentage=taper_percentage)
 
     # remove response or filter
     if filter_flag:
@@ -241,61 +878,479 @@ def process_stream(st, inventory=None, remove_response_flag=False,
             raise ValueError("Input pre_filt must be in ascending order: %s"
                              % pre_filt)
 
+    if remove_response_flag and inventory is None:
+        raise ValueError("Station information(inv) should be provided if"
+                         "you want to remove instrument response")
+
+    if spectral_flag:
+        # remove response, filter and resample in one pass
+        if sampling_rate is None:
+            raise ValueError("sampling rate should be provided if you set"
+                             "resample_flag=True")
+        npts = None
+        if starttime is not None and endtime is not None:
+            npts = int((endtime - starttime) * sampling_rate) + 1
+        _inventory = inventory if remove_response_flag else None
+        st = spectral_resample_stream(
+            st, pre_filt, sampling_rate, starttime=starttime, npts=npts,
+            inventory=_inventory, water_level=water_level,
+            response_cache=response_cache, dtype=dtype)
+        detrend_and_taper_stream(st, taper_type=taper_type,
+                                 taper_percentage=taper_percentage)
+        if auto_resample_flag:
+            _record_auto_resample(st, sampling_rate, pre_filt,
+                                  oversampling_factor)
+        return _finalize_stream(st, _is_trace, rotate_flag=rotate_flag,
+                                inventory=inventory,
+                                event_latitude=event_latitude,
+                                event_longitude=event_longitude,
+                                sanity_check=sanity_check,
+                                station_geometry=station_geometry,
+                                sanity_registry=sanity_registry)
+
     if remove_response_flag:
         # remove response
-        if inventory is None:
-            raise ValueError("Station information(inv) should be provided if"
-                             "you want to remove instrument response")
-        st.attach_response(inventory)
-        if filter_flag:
-            st.remove_response(output="DISP", pre_filt=pre_filt,
-                               zero_mean=False, taper=False,
-                               water_level=water_level)
+        if response_cache is not None:
+            # the inverted response spectrum is taken from cache
+            _pre_filt = pre_filt if filter_flag else None
+            remove_response_stream(st, inventory, output="DISP",
+                                   water_level=water_level,
+                                   pre_filt=_pre_filt,
+                                   response_cache=response_cache,
+                                   dtype=dtype)
         else:
-            st.remove_response(output="DISP", zero_mean=False, taper=False)
+            st.attach_response(inventory)
+            if filter_flag:
+                st.remove_response(output="DISP", pre_filt=pre_filt,
+                                   zero_mean=False, taper=False,
+                                   water_level=water_level)
+            else:
+                st.remove_response(output="DISP", zero_mean=False,
+                                   taper=False)
     elif filter_flag:
         # Perform a frequency domain taper like during the response removal
         # just without an actual response...
-        filter_stream(st, pre_filt)
+        filter_stream(st, pre_filt, batch_flag=True, dtype=dtype)
 
     if filter_flag or remove_response_flag:
         # detrend, demean or taper
-        st.detrend("linear")
-        st.detrend("demean")
-        st.taper(max_percentage=taper_percentage, type=taper_type)
+        detrend_and_taper_stream(st, taper_type=taper_type,
+                                 taper_percentage=taper_percentage)
 
     # resample
-    if resample_flag:
-        # interpolation
-        if sampling_rate is None:
-            raise ValueError("sampling rate should be provided if you set"
-                             "resample_flag=True")
+    if pretrim_flag:
+        st = resample_or_cut_pretrimmed_stream(
+            st, resample_flag=resample_flag, sampling_rate=sampling_rate,
+            starttime=starttime, endtime=endtime, method=resample_mode,
+            dtype=dtype)
+    else:
+        st = resample_or_cut_stream(st, resample_flag=resample_flag,
+                                    sampling_rate=sampling_rate,
+                                    starttime=starttime, endtime=endtime,
+                                    method=resample_mode, dtype=dtype)
+    if auto_resample_flag:
+        _record_auto_resample(st, sampling_rate, pre_filt,
+                              oversampling_factor)
 
-        if endtime is not None and starttime is not None:
-            npts = int((endtime - starttime) * sampling_rate) + 1
-            st = interpolate_stream(st, sampling_rate, starttime=starttime,
-                                    npts=npts)
-        else:
-            # it doesn't matter if starttime is None or not, cause
-            # obspy will handle this case
-            st = interpolate_stream(st, sampling_rate, starttime=starttime)
+    return _finalize_stream(st, _is_trace, rotate_flag=rotate_flag,
+                            inventory=inventory,
+                            event_latitude=event_latitude,
+                            event_longitude=event_longitude,
+                            sanity_check=sanity_check,
+                            station_geometry=station_geometry,
+                            sanity_registry=sanity_registry)
+
+
+def process_stream_multiband(st, pre_filt_list, inventory=None,
+                             remove_response_flag=False, water_level=60,
+                             starttime=None, endtime=None,
+                             resample_flag=False, sampling_rate=1.0,
+                             taper_type="hann", taper_percentage=0.05,
+                             rotate_flag=False, event_latitude=None,
+                             event_longitude=None, sanity_check=False,
+                             response_cache=None, resample_mode="interpolate",
+                             dtype="float64", station_geometry=None,
+                             auto_resample_flag=False,
+                             oversampling_factor=4.0, pretrim_flag=False,
+                             event_time=None, event_depth=None,
+                             pretrim_kwargs=None, stf_half_duration=None,
+                             sanity_registry=None):
+    """
+    Process the stream for multiple period bands. The cut, pre-trim,
+    source time function convolution, detrend, taper, response removal
+    and forward FFT are shared by all bands, so they are done only once.
+    Then each band's taper is applied to the response removed spectrum
+    in the frequency domain, and the post processing(detrend, taper,
+    resample and rotate) is done per band. The output of each band is
+    the same as calling process_stream with filter_flag=True and
+    pre_filt set to that band.
+
+    With resample_mode="spectral", or with pre-trimming when
+    auto_resample_flag gives different sampling rates for the bands,
+    nothing could be shared, and process_stream is called for each band.
+
+    :param st: input stream
+    :type st: obspy.Stream
+    :param pre_filt_list: list of pre_filt, each one is 4 corner
+        frequencies in ascending order(unit: Hz), for example,
+        [[1/90., 1/60., 1/27., 1/22.5], [1/150., 1/120., 1/60., 1/50.]]
+    :type pre_filt_list: list
+    :param response_cache: cache of inverted instrument response
+        spectrum. The response is always removed in frequency domain
+        here, so a cache only for this call is used if it is None.
+    :type response_cache: pytomo3d.signal.response.ResponseCache
+
+    The rest of arguments are the same as process_stream.
+
+    :return: list of processed streams, in the same order as
+        pre_filt_list
+    """
+    st, _is_trace = _stream_from_input(st)
+
+    if len(pre_filt_list) == 0:
+        raise ValueError("pre_filt_list should contain at least one band")
+    for pre_filt in pre_filt_list:
+        check_pre_filt(pre_filt)
+    if remove_response_flag and inventory is None:
+        raise ValueError("Station information(inv) should be provided if"
+                         "you want to remove instrument response")
+    if dtype not in ("float64", "float32"):
+        raise ValueError("dtype(%s) should be either 'float64' or 'float32'"
+                         % dtype)
+    if resample_mode not in ("interpolate", "spectral", "polyphase"):
+        raise ValueError("resample_mode(%s) should be within ['interpolate', "
+                         "'spectral', 'polyphase']" % resample_mode)
+    if remove_response_flag and response_cache is None:
+        response_cache = ResponseCache()
+
+    if auto_resample_flag:
+        resample_flag = True
+        sampling_rates = [
+            get_decimated_sampling_rate(
+                pre_filt[3], oversampling_factor=oversampling_factor)
+            for pre_filt in pre_filt_list]
     else:
-        if starttime is not None and endtime is not None:
-            # just cut
-            st.trim(starttime, endtime)
+        sampling_rates = [sampling_rate] * len(pre_filt_list)
 
-    # rotate
-    if rotate_flag:
-        st = rotate_stream(st, event_latitude, event_longitude,
-                           inventory=inventory, mode="ALL->RT",
-                           sanity_check=sanity_check)
+    if (resample_flag and resample_mode == "spectral") or \
+            (pretrim_flag and resample_flag and
+             len(set(sampling_rates)) > 1):
+        kwargs = dict(
+            inventory=inventory, remove_response_flag=remove_response_flag,
+            water_level=water_level, starttime=starttime, endtime=endtime,
+            resample_flag=resample_flag, sampling_rate=sampling_rate,
+            taper_type=taper_type, taper_percentage=taper_percentage,
+            rotate_flag=rotate_flag, event_latitude=event_latitude,
+            event_longitude=event_longitude, sanity_check=sanity_check,
+            response_cache=response_cache, resample_mode=resample_mode,
+            dtype=dtype, station_geometry=station_geometry,
+            auto_resample_flag=auto_resample_flag,
+            oversampling_factor=oversampling_factor,
+            pretrim_flag=pretrim_flag, event_time=event_time,
+            event_depth=event_depth, pretrim_kwargs=pretrim_kwargs,
+            stf_half_duration=stf_half_duration,
+            sanity_registry=sanity_registry)
+        return [process_stream(st.copy(), filter_flag=True,
+                               pre_filt=pre_filt, **kwargs)
+                for pre_filt in pre_filt_list]
+
+    dtype = np.dtype(dtype)
+    if pretrim_flag:
+        if inventory is None or event_latitude is None or \
+                event_longitude is None or event_time is None or \
+                event_depth is None:
+            raise ValueError("pretrim_flag=True requires inventory, "
+                             "event_latitude, event_longitude, event_time "
+                             "and event_depth")
+
+    # cut the stream out before processing to reduce computation
+    if starttime is not None and endtime is not None:
+        st = flex_cut_stream(st, starttime, endtime, dynamic_npts=10)
+
+    if pretrim_flag:
+        _sampling_rate = sampling_rates[0] if resample_flag else None
+        pretrim_stream(st, inventory, event_time, event_latitude,
+                       event_longitude, event_depth, starttime=starttime,
+                       endtime=endtime, sampling_rate=_sampling_rate,
+                       **(pretrim_kwargs or {}))
 
-    # Convert to single precision to save space.
     for tr in st:
-        tr.data = np.require(tr.data, dtype="float32")
+        tr.data = np.require(tr.data, dtype=dtype)
 
-    # transfer back to trace if input type is Trace
-    if _is_trace:
-        st = st[0]
+    if stf_half_duration is not None:
+        convolve_stf_stream(st, stf_half_duration)
 
-    return st
+    # detrend ,demean, taper
+    detrend_and_taper_stream(st, taper_type=taper_type,
+                             taper_percentage=taper_percentage)
+
+    # spectrum of each trace, with response removed if required. None
+    # if response could not be removed in frequency domain, like the
+    # polynomial response.
+    spectra = []
+    for tr in st:
+        spectrum = None
+        if remove_response_flag:
+            try:
+                spectrum, _ = get_response_removed_spectrum(
+                    tr, inventory, output="DISP", water_level=water_level,
+                    response_cache=response_cache, dtype=dtype)
+            except ValueError:
+                pass
+        else:
+            nfft = get_taper_kernel(tr.stats.npts, tr.stats.delta,
+                                    pre_filt_list[0])[0]
+            spectrum = rfft(tr.data, n=nfft)
+        spectra.append(spectrum)
+
+    results = []
+    for pre_filt, _sampling_rate in zip(pre_filt_list, sampling_rates):
+        st_band = Stream()
+        for tr, spectrum in zip(st, spectra):
+            if spectrum is None:
+                tr_band = tr.copy()
+                remove_response_trace(tr_band, inventory, output="DISP",
+                                      water_level=water_level,
+                                      pre_filt=pre_filt, dtype=dtype)
+            else:
+                npts = tr.stats.npts
+                data = spectrum.copy()
+                data *= get_taper_kernel(npts, tr.stats.delta, pre_filt)[1]
+                data[-1] = abs(data[-1]) + 0.0j
+                tr_band = Trace(
+                    data=irfft(data)[0:npts].astype(dtype, copy=False),
+                    header=tr.stats.copy())
+            st_band.append(tr_band)
+
+        detrend_and_taper_stream(st_band, taper_type=taper_type,
+                                 taper_percentage=taper_percentage)
+        if pretrim_flag:
+            st_band = resample_or_cut_pretrimmed_stream(
+                st_band, resample_flag=resample_flag,
+                sampling_rate=_sampling_rate, starttime=starttime,
+                endtime=endtime, method=resample_mode, dtype=dtype)
+        else:
+            st_band = resample_or_cut_stream(
+                st_band, resample_flag=resample_flag,
+                sampling_rate=_sampling_rate, starttime=starttime,
+                endtime=endtime, method=resample_mode, dtype=dtype)
+        if auto_resample_flag:
+            _record_auto_resample(st_band, _sampling_rate, pre_filt,
+                                  oversampling_factor)
+        results.append(_finalize_stream(
+            st_band, _is_trace, rotate_flag=rotate_flag,
+            inventory=inventory, event_latitude=event_latitude,
+            event_longitude=event_longitude, sanity_check=sanity_check,
+            station_geometry=station_geometry,
+            sanity_registry=sanity_registry))
+
+    return results
+
+
+# arguments of process_stream shared by all the stations, set in each
+# worker process by the pool initializer
+_worker_context = {}
+
+
+def _init_process_worker(context):
+    _worker_context.clear()
+    _worker_context.update(context)
+
+
+def _process_station_job(job, context):
+    """
+    Job of process_stream_parallel on one station. The arguments of
+    process_stream, like response_cache and station_geometry, are taken
+    from context.
+    """
+    _, sta_stream, sta_inventory = job
+    return process_stream(sta_stream, inventory=sta_inventory,
+                          **context["kwargs"])
+
+
+def _process_station_worker(job, context=None):
+    # worker function of process_stream_parallel. It returns
+    # (station_id, stream, error message). The error is only caught if
+    # the caller collects them, otherwise it is raised.
+    if context is None:
+        context = _worker_context
+    station_id = job[0]
+    if not context["collect_errors"]:
+        return station_id, _process_station_job(job, context), None
+    try:
+        return station_id, _process_station_job(job, context), None
+    except Exception as err:
+        return station_id, None, "%s" % err
+
+
+def process_stream_parallel(st, inventory=None, n_workers=None, errors=None,
+                            **kwargs):
+    """
+    Process the stream in parallel over stations. The stream is split by
+    station(using the same grouping as in rotation, i.e., network,
+    station, location and channel[0:2]). Each station stream and its
+    inventory subset are sent to a process pool and processed by
+    process_stream. The other arguments, like response_cache and
+    station_geometry, are passed once to each worker process by the
+    pool initializer, instead of with every station. Results are merged
+    in the sorted order of station ids, so the output does not depend on
+    the scheduling.
+
+    :param st: input stream
+    :type st: obspy.Stream
+    :param inventory: station inventory information
+    :type inventory: obspy.Inventory
+    :param n_workers: number of worker processes. If None, the number of
+        cpus is used. If 1, stations are processed serially.
+    :type n_workers: int
+    :param errors: if None, an error in any station is raised. If a list
+        is provided, the failed stations are skipped and
+        (station_id, error message) of each one is appended to it.
+    :type errors: list
+    :param kwargs: other arguments passed to process_stream. The
+        response_cache is copied into each worker process, so the
+        responses evaluated there are not added to it.
+    :return: processed stream
+    """
+    if not isinstance(st, Stream):
+        raise TypeError("Input st should be type of Stream")
+
+    sorted_st_dict = sort_stream_by_station(st, sort_keys=True)
+    jobs = []
+    for station_id, sta_stream in sorted_st_dict.items():
+        if inventory is not None:
+            sta_inventory = select_station_inventory(
+                inventory, sta_stream[0].stats.network,
+                sta_stream[0].stats.station)
+        else:
+            sta_inventory = None
+        jobs.append((station_id, sta_stream, sta_inventory))
+
+    context = {"kwargs": kwargs, "collect_errors": errors is not None}
+    if n_workers == 1 or len(jobs) <= 1:
+        results = [_process_station_worker(job, context) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes=n_workers,
+                                    initializer=_init_process_worker,
+                                    initargs=(context, ))
+        try:
+            results = pool.map(_process_station_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    new_st = Stream()
+    for station_id, sta_stream, error in results:
+        if error is not None:
+            print("Error processing station '%s': %s" % (station_id, error))
+            errors.append((station_id, error))
+            continue
+        new_st += sta_stream
+    return new_st
+
+
+def cached_process_stream(st, result_cache, **kwargs):
+    """
+    Same as process_stream, but the result is taken from result_cache
+    if the stream and processing parameters are unchanged. Otherwise
+    process_stream is called and the result is saved in the cache.
+
+    :param st: input stream
+    :type st: obspy.Stream or obspy.Trace
+    :param result_cache: on-disk result cache
+    :type result_cache: pytomo3d.utils.cache.ResultCache
+    :param kwargs: arguments of process_stream
+    :return: processed stream
+    """
+    return result_cache.call("process_stream", process_stream, args=(st, ),
+                             kwargs=kwargs,
+                             ignored_keys=("response_cache",
+                                           "sanity_registry"))
+
+
+def _check_same_grid(obsd_st, synt_st):
+    # index synthetics once by (network, station, component)
+    synt_index = {}
+    for syn_tr in synt_st:
+        key = (syn_tr.stats.network, syn_tr.stats.station,
+               syn_tr.stats.channel[-1:])
+        synt_index.setdefault(key, []).append(syn_tr)
+
+    for obs_tr in obsd_st:
+        key = (obs_tr.stats.network, obs_tr.stats.station,
+               obs_tr.stats.channel[-1:])
+        for syn_tr in synt_index.get(key, []):
+            if syn_tr.stats.starttime != obs_tr.stats.starttime or \
+                    syn_tr.stats.npts != obs_tr.stats.npts or \
+                    syn_tr.stats.delta != obs_tr.stats.delta:
+                raise ValueError("Time grid of observed(%s) and synthetic"
+                                 "(%s) are different" % (obs_tr.id,
+                                                         syn_tr.id))
+
+
+def process_pair(obsd_st, synt_st, inventory=None, starttime=None,
+                 endtime=None, sampling_rate=1.0, rotate_flag=False,
+                 event_latitude=None, event_longitude=None,
+                 obsd_kwargs=None, synt_kwargs=None, geometry_table=None,
+                 event_id=None, **kwargs):
+    """
+    Process the observed and synthetic streams of the same event. The
+    inventory subset and back azimuth of each station are computed once
+    and shared by the two streams. Both streams are resampled to the same
+    time grid, defined by starttime, endtime and sampling_rate, so the
+    output traces of the same component could be compared sample by
+    sample without further alignment.
+
+    :param obsd_st: observed stream
+    :type obsd_st: obspy.Stream
+    :param synt_st: synthetic stream
+    :type synt_st: obspy.Stream
+    :param starttime: starttime of output traces
+    :type starttime: obspy.UTCDateTime
+    :param endtime: endtime of output traces
+    :type endtime: obspy.UTCDateTime
+    :param sampling_rate: sampling rate of output traces
+    :type sampling_rate: float
+    :param obsd_kwargs: arguments of process_stream only for observed,
+        for example, {"remove_response_flag": True, "sanity_check": True}
+    :type obsd_kwargs: dict
+    :param synt_kwargs: arguments of process_stream only for synthetic
+    :type synt_kwargs: dict
+    :param geometry_table: event-station geometry table to take the back
+        azimuth from, see get_station_geometry
+    :type geometry_table: pytomo3d.utils.geodesic.GeometryTable
+    :param event_id: id of the event in geometry_table
+    :type event_id: str
+    :param kwargs: the rest arguments of process_stream, shared by
+        observed and synthetic
+    :return: (processed observed stream, processed synthetic stream)
+    """
+    if not isinstance(obsd_st, Stream) or not isinstance(synt_st, Stream):
+        raise TypeError("Input obsd_st and synt_st should be obspy.Stream")
+    if starttime is None or endtime is None:
+        raise ValueError("starttime and endtime should be provided to "
+                         "define the shared time grid")
+    if not kwargs.pop("resample_flag", True):
+        raise ValueError("resample_flag could not be False in process_pair")
+    if "station_geometry" in kwargs:
+        raise ValueError("station_geometry is computed in process_pair")
+
+    station_geometry = None
+    if rotate_flag and inventory is not None:
+        station_geometry = get_station_geometry(
+            [obsd_st, synt_st], event_latitude, event_longitude, inventory,
+            geometry_table=geometry_table, event_id=event_id)
+
+    results = []
+    for st, st_kwargs in [(obsd_st, obsd_kwargs), (synt_st, synt_kwargs)]:
+        _kwargs = dict(kwargs)
+        _kwargs.update(st_kwargs or {})
+        results.append(process_stream(
+            st, inventory=inventory, starttime=starttime, endtime=endtime,
+            resample_flag=True, sampling_rate=sampling_rate,
+            rotate_flag=rotate_flag, event_latitude=event_latitude,
+            event_longitude=event_longitude,
+            station_geometry=station_geometry, **_kwargs))
+
+    _check_same_grid(results[0], results[1])
+    return results[0], results[1]
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Resampling engine for traces. If the new sampling rate is a rational
+fraction of the original one(for example, 20 Hz to 1 Hz), polyphase
+filtering is used, which is cheaper than interpolation and has
+anti-alias filtering built in. Otherwise, it falls back to the
+interpolation in obspy.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (division, print_function, absolute_import)
+import math
+from fractions import Fraction
+import numpy as np
+from scipy.signal import resample_poly
+from obspy import Trace
+
+
+def get_resample_ratio(sampling_rate, new_sampling_rate,
+                       max_denominator=1000):
+    """
+    Get the (up, down) factors so that
+        new_sampling_rate = sampling_rate * up / down
+
+    :param sampling_rate: original sampling rate
+    :type sampling_rate: float
+    :param new_sampling_rate: new sampling rate
+    :type new_sampling_rate: float
+    :param max_denominator: maximum value of up and down factors
+    :type max_denominator: int
+    :return: (up, down), or None if the ratio is not a rational number
+        with up and down less than max_denominator
+    """
+    ratio = new_sampling_rate / sampling_rate
+    frac = Fraction(ratio).limit_denominator(max_denominator)
+    if frac.numerator == 0 or frac.numerator > max_denominator:
+        return None
+    if abs(float(frac) - ratio) > 1e-9 * ratio:
+        return None
+    return frac.numerator, frac.denominator
+
+
+def get_decimated_sampling_rate(max_frequency, oversampling_factor=4.0):
+    """
+    Get the lowest safe sampling rate for data band-limited below
+    max_frequency(for example, the upper corner of pre_filt). The
+    Nyquist frequency of new sampling rate is at least oversampling_factor
+    times max_frequency, and the sampling interval is rounded down to
+    1, 2, 2.5 or 5 times a power of 10, so traces from different
+    instruments are likely to be on a rational ratio of sampling rate.
+
+    :param max_frequency: maximum frequency of the data(unit: Hz)
+    :type max_frequency: float
+    :param oversampling_factor: ratio between the new Nyquist frequency
+        and max_frequency, should be no less than 1. A larger factor
+        keeps more samples per period, which gives better time
+        resolution in the measurement, like cross-correlation time shift.
+    :type oversampling_factor: float
+    :return: new sampling rate(unit: Hz)
+    """
+    if max_frequency <= 0:
+        raise ValueError("max_frequency(%s) should be positive"
+                         % max_frequency)
+    if oversampling_factor < 1:
+        raise ValueError("oversampling_factor(%s) should be no less than 1"
+                         % oversampling_factor)
+
+    max_delta = 1.0 / (2.0 * oversampling_factor * max_frequency)
+    exponent = int(math.floor(math.log10(max_delta)))
+    for mantissa in (5.0, 2.5, 2.0, 1.0):
+        delta = mantissa * 10.0 ** exponent
+        if delta <= max_delta * (1 + 1e-9):
+            break
+    return 1.0 / delta
+
+
+def polyphase_resample_trace(tr, sampling_rate, starttime=None, npts=None,
+                             max_denominator=1000):
+    """
+    Resample the trace using polyphase filtering. The trace is first
+    resampled to sampling_rate on the grid starting at its own
+    starttime. If the new starttime is on that grid, the data is just
+    cut. Otherwise the shift is done by interpolation on the resampled
+    trace, which is cheap since the rate is already reduced.
+
+    :param tr: input trace
+    :type tr: obspy.Trace
+    :param sampling_rate: new sampling rate(unit: Hz)
+    :type sampling_rate: float
+    :param starttime: new starttime. If None, the starttime of trace
+        is used
+    :type starttime: obspy.UTCDateTime
+    :param npts: new number of points. If None, the new trace runs to
+        the endtime of trace
+    :type npts: int
+    :return: True if polyphase filtering is used, False if the ratio of
+        sampling rates is not rational and the trace is not changed
+    """
+    if not isinstance(tr, Trace):
+        raise TypeError("First Argument should be trace: %s" % type(tr))
+
+    ratio = get_resample_ratio(tr.stats.sampling_rate, sampling_rate,
+                               max_denominator=max_denominator)
+    if ratio is None:
+        return False
+    up, down = ratio
+
+    old_starttime = tr.stats.starttime
+    old_endtime = tr.stats.endtime
+    new_delta = 1.0 / sampling_rate
+    if starttime is None:
+        starttime = old_starttime
+    if npts is None:
+        npts = int((old_endtime - starttime) * sampling_rate) + 1
+
+    # same check as obspy.Trace.interpolate
+    eps = 1e-6 * tr.stats.delta
+    if starttime - old_starttime < -eps or \
+            starttime + (npts - 1) * new_delta > old_endtime + eps:
+        raise ValueError("The new array must be fully contained in the "
+                         "old array.")
+
+    # keep single precision data in single precision
+    data = tr.data
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float64)
+    if up != 1 or down != 1:
+        data = resample_poly(data, up, down)
+
+    tr.data = data
+    tr.stats.sampling_rate = sampling_rate
+
+    shift = (starttime - old_starttime) / new_delta
+    ishift = int(round(shift))
+    if abs(shift - ishift) < 1e-6 and ishift + npts <= len(data):
+        tr.data = data[ishift:(ishift + npts)]
+        tr.stats.starttime = starttime
+    else:
+        tr.interpolate(sampling_rate, starttime=starttime, npts=npts)
+    return True
+
+
+def resample_trace(tr, sampling_rate, starttime=None, npts=None,
+                   method="polyphase"):
+    """
+    Resample the trace to the new sampling rate, starttime and npts.
+
+    :param method: resample method, could be one of:
+        1) "polyphase": use polyphase filtering if the ratio of
+            sampling rates is rational, otherwise interpolation
+        2) "interpolate": use obspy.Trace.interpolate
+    :type method: str
+    """
+    if method not in ("polyphase", "interpolate"):
+        raise ValueError("Resample method(%s) should be either "
+                         "'polyphase' or 'interpolate'" % method)
+    if method == "polyphase":
+        if polyphase_resample_trace(tr, sampling_rate, starttime=starttime,
+                                    npts=npts):
+            return
+    tr.interpolate(sampling_rate, starttime=starttime, npts=npts)
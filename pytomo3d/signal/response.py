@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Instrument response removal with a cache of the inverted response
+spectrum. Many channels share the same sensor and datalogger stages,
+so the response spectrum is evaluated once for each distinct response
+and sampling grid, and could be saved to disk between runs.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (division, print_function, absolute_import)
+import os
+import hashlib
+import numpy as np
+from obspy import Stream, Trace
+from obspy.core.inventory.response import (
+    PolesZerosResponseStage, CoefficientsTypeResponseStage, FIRResponseStage,
+    ResponseListResponseStage, PolynomialResponseStage)
+from obspy.signal.invsim import invert_spectrum
+from obspy.signal.util import _npts2nfft
+from pytomo3d.utils.fft import rfft, irfft
+from .kernel_cache import get_taper_kernel
+
+
+# numeric fields shared by all types of response stage
+_STAGE_NUMBERS = ("stage_gain", "stage_gain_frequency",
+                  "decimation_input_sample_rate", "decimation_factor",
+                  "decimation_offset", "decimation_delay",
+                  "decimation_correction")
+
+
+def _hash_text(hasher, name, value):
+    hasher.update(("%s=%s;" % (name, value)).encode("utf-8"))
+
+
+def _hash_numbers(hasher, name, values, dtype=np.float64):
+    # numbers are hashed by their binary value, not the text format
+    hasher.update(("%s:" % name).encode("utf-8"))
+    if values is None:
+        hasher.update(b"None;")
+        return
+    values = np.array([np.nan if v is None else v for v in values],
+                      dtype=dtype)
+    hasher.update(("%d;" % values.size).encode("utf-8"))
+    hasher.update(values.tobytes())
+
+
+def _hash_stage(hasher, stage):
+    _hash_text(hasher, "type", type(stage).__name__)
+    _hash_text(hasher, "input_units", stage.input_units)
+    _hash_text(hasher, "output_units", stage.output_units)
+    _hash_numbers(hasher, "common",
+                  [getattr(stage, key) for key in _STAGE_NUMBERS])
+
+    if isinstance(stage, PolesZerosResponseStage):
+        _hash_text(hasher, "pz_type", stage.pz_transfer_function_type)
+        _hash_numbers(hasher, "normalization",
+                      [stage.normalization_frequency,
+                       stage.normalization_factor])
+        _hash_numbers(hasher, "zeros", stage.zeros, dtype=np.complex128)
+        _hash_numbers(hasher, "poles", stage.poles, dtype=np.complex128)
+    elif isinstance(stage, CoefficientsTypeResponseStage):
+        _hash_text(hasher, "cf_type", stage.cf_transfer_function_type)
+        _hash_numbers(hasher, "numerator", stage.numerator)
+        _hash_numbers(hasher, "denominator", stage.denominator)
+    elif isinstance(stage, FIRResponseStage):
+        _hash_text(hasher, "symmetry", stage.symmetry)
+        _hash_numbers(hasher, "coefficients", stage.coefficients)
+    elif isinstance(stage, ResponseListResponseStage):
+        elements = stage.response_list_elements or []
+        for key in ("frequency", "amplitude", "phase"):
+            _hash_numbers(hasher, key,
+                          [getattr(elem, key) for elem in elements])
+    elif isinstance(stage, PolynomialResponseStage):
+        _hash_text(hasher, "approximation_type", stage.approximation_type)
+        _hash_numbers(hasher, "bounds",
+                      [stage.frequency_lower_bound,
+                       stage.frequency_upper_bound,
+                       stage.approximation_lower_bound,
+                       stage.approximation_upper_bound,
+                       stage.maximum_error])
+        _hash_numbers(hasher, "coefficients", stage.coefficients)
+
+
+def response_fingerprint(response):
+    """
+    Fingerprint of response, based on the numeric values of all response
+    stages(gains, decimation, poles and zeros, coefficients and etc) and
+    the overall sensitivity. Descriptive fields, like names and resource
+    ids, are not included, so channels with identical sensor and
+    datalogger stages share the same fingerprint.
+
+    :param response: instrument response
+    :type response: obspy.core.inventory.response.Response
+    :return: hex digest string
+    """
+    hasher = hashlib.sha1()
+    for stage in response.response_stages:
+        _hash_stage(hasher, stage)
+    sensitivity = response.instrument_sensitivity
+    if sensitivity is None:
+        _hash_text(hasher, "sensitivity", None)
+    else:
+        _hash_text(hasher, "input_units", sensitivity.input_units)
+        _hash_text(hasher, "output_units", sensitivity.output_units)
+        _hash_numbers(hasher, "sensitivity",
+                      [sensitivity.value, sensitivity.frequency])
+    return hasher.hexdigest()
+
+
+class ResponseCache(object):
+    """
+    Cache of the inverted instrument response spectrum, keyed by the
+    response fingerprint and (nfft, delta, output, water_level).
+
+    :param filename: cache file(.npz) to load from, if it exists
+    :type filename: str
+    """
+
+    def __init__(self, filename=None):
+        self._spectra = {}
+        self.hits = 0
+        self.misses = 0
+        if filename is not None and os.path.exists(filename):
+            self.load(filename)
+
+    def __len__(self):
+        return len(self._spectra)
+
+    @staticmethod
+    def get_key(fingerprint, nfft, delta, output, water_level):
+        return "%s_%d_%r_%s_%r" % (fingerprint, nfft, float(delta),
+                                   output.upper(), water_level)
+
+    def get_inverse_response(self, response, delta, nfft, output="DISP",
+                             water_level=60):
+        """
+        Get inverted response spectrum(water level applied) on the
+        frequency grid of (delta, nfft). Evalresp is only called if
+        the spectrum is not in the cache.
+
+        :return: inverted response spectrum, read-only
+        """
+        key = self.get_key(response_fingerprint(response), nfft, delta,
+                           output, water_level)
+        if key in self._spectra:
+            self.hits += 1
+            return self._spectra[key]
+
+        self.misses += 1
+        spectrum = invert_response_spectrum(response, delta, nfft,
+                                            output=output,
+                                            water_level=water_level)
+        spectrum.setflags(write=False)
+        self._spectra[key] = spectrum
+        return spectrum
+
+    def clear(self):
+        self._spectra.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, filename):
+        """ Save the cached spectra to numpy .npz file """
+        with open(filename, "wb") as fh:
+            np.savez(fh, **self._spectra)
+
+    def load(self, filename):
+        """ Load spectra from numpy .npz file into the cache """
+        with np.load(filename) as fh:
+            for key in fh.files:
+                spectrum = fh[key]
+                spectrum.setflags(write=False)
+                self._spectra[key] = spectrum
+
+
+def invert_response_spectrum(response, delta, nfft, output="DISP",
+                             water_level=60):
+    """
+    Evaluate the response spectrum and invert it, the same way as
+    obspy.Trace.remove_response.
+    """
+    freq_response, _ = response.get_evalresp_response(delta, nfft,
+                                                      output=output)
+    if water_level is None:
+        freq_response[0] = 0.0
+        freq_response[1:] = 1.0 / freq_response[1:]
+    else:
+        invert_spectrum(freq_response, water_level)
+    return freq_response
+
+
+def _is_evalresp_response(response):
+    if not response.response_stages:
+        return False
+    if isinstance(response.response_stages[0], PolynomialResponseStage):
+        return False
+    return True
+
+
+def get_response_removed_spectrum(tr, inventory, output="DISP",
+                                  water_level=60, response_cache=None,
+                                  nfft=None, dtype=np.float64):
+    """
+    Get the spectrum of trace, with instrument response removed. The
+    spectrum could be tapered in frequency domain afterwards and then
+    transformed back to time domain, which is what remove_response_trace
+    does. Only evalresp response is supported.
+
+    :param nfft: number of points of FFT. If None, it is determined
+        from npts, dodging large primes.
+    :param dtype: float type of data used in FFT
+    :return: (spectrum, nfft)
+    """
+    response = inventory.get_response(tr.id, tr.stats.starttime)
+    if not _is_evalresp_response(response):
+        raise ValueError("Polynomial response is not supported for "
+                         "trace(%s)" % tr.id)
+    if response_cache is None:
+        response_cache = ResponseCache()
+
+    delta = tr.stats.delta
+    if nfft is None:
+        nfft = _npts2nfft(tr.stats.npts)
+
+    data = rfft(tr.data.astype(dtype), n=nfft)
+    data *= response_cache.get_inverse_response(
+        response, delta, nfft, output=output, water_level=water_level)
+    return data, nfft
+
+
+def remove_response_trace(tr, inventory, output="DISP", water_level=60,
+                          pre_filt=None, response_cache=None,
+                          dtype=np.float64):
+    """
+    Remove instrument response of trace, without zero mean and taper
+    in time domain. It gives the same result as:
+        tr.remove_response(inventory, output, water_level, pre_filt,
+                           zero_mean=False, taper=False)
+    but the inverted response spectrum is taken from response_cache.
+
+    :param tr: input trace
+    :type tr: obspy.Trace
+    :param inventory: station inventory information
+    :type inventory: obspy.Inventory
+    :param output: output unit, "DISP", "VEL" or "ACC"
+    :type output: str
+    :param water_level: water level used in inverting the response
+    :type water_level: float
+    :param pre_filt: frequency array(Hz) in ascending order, to define
+        the four corners of filter, for example, [0.01, 0.1, 0.2, 0.5].
+    :type pre_filt: Numpy.array or list
+    :param response_cache: response spectrum cache
+    :type response_cache: pytomo3d.signal.response.ResponseCache
+    :param dtype: float type used in processing, np.float64 or np.float32.
+        Only used when response_cache is provided.
+    :type dtype: numpy.dtype
+    """
+    if not isinstance(tr, Trace):
+        raise TypeError("First Argument should be trace: %s" % type(tr))
+
+    response = inventory.get_response(tr.id, tr.stats.starttime)
+    if response_cache is None or not _is_evalresp_response(response):
+        # polynomial response is handled by obspy
+        tr.remove_response(inventory=inventory, output=output,
+                           water_level=water_level, pre_filt=pre_filt,
+                           zero_mean=False, taper=False)
+        return
+
+    npts = tr.stats.npts
+    data, _ = get_response_removed_spectrum(
+        tr, inventory, output=output, water_level=water_level,
+        response_cache=response_cache, dtype=dtype)
+    if pre_filt is not None:
+        data *= get_taper_kernel(npts, tr.stats.delta, pre_filt)[1]
+    data[-1] = abs(data[-1]) + 0.0j
+    tr.data = irfft(data)[0:npts].astype(dtype, copy=False)
+
+
+def remove_response_stream(st, inventory, output="DISP", water_level=60,
+                           pre_filt=None, response_cache=None,
+                           dtype=np.float64):
+    """
+    Remove instrument response of stream, trace by trace. See
+    remove_response_trace.
+    """
+    if not isinstance(st, Stream):
+        raise TypeError("Input st should be type of Stream")
+    for tr in st:
+        remove_response_trace(tr, inventory, output=output,
+                              water_level=water_level, pre_filt=pre_filt,
+                              response_cache=response_cache, dtype=dtype)
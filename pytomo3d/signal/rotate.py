@@ -11,15 +11,21 @@ It can rotate `12`, `EN` and `RT`, forward and backward.
     (http://www.gnu.org/licenses/lgpl-3.0.en.html)
 """
 
+from collections import OrderedDict
 import numpy as np
-from obspy.geodetics import gps2dist_azimuth
 from obspy import Stream
-from .rotate_utils import check_orthogonality, rotate_12_rt
+from pytomo3d.utils.geodesic import calculate_distance_azimuth
+from .rotate_utils import (rotate_12_rt_inplace, rotate_12_rt_batch,
+                           rotate_rt_ne_batch)
+from .inventory_index import InventoryIndex
+from .sanity_registry import (is_vertical_orientation_sane,
+                              is_horizontal_orientation_sane, intersect_epochs)
 
 
 def calculate_baz(elat, elon, slat, slon):
-    _, _, baz = gps2dist_azimuth(elat, elon, slat, slon)
-    return baz
+    _, _, baz = calculate_distance_azimuth(elat, elon, slat, slon,
+                                           method="ellipsoid")
+    return float(baz)
 
 
 def ensemble_synthetic_channel_orientation(chan):
@@ -38,11 +44,27 @@ def ensemble_synthetic_channel_orientation(chan):
     return dip, azi
 
 
+def select_channel_epoch(tr, inv):
+    """
+    Select the channel of trace from obspy.Inventory, in the epoch
+    which contains the starttime of trace.
+    """
+    _inv = inv.select(network=tr.stats.network, station=tr.stats.station,
+                      location=tr.stats.location, channel=tr.stats.channel,
+                      time=tr.stats.starttime)
+    try:
+        return _inv[0][0][0]
+    except IndexError:
+        raise ValueError("Channel(%s) is not in the inventory at %s"
+                         % (tr.id, tr.stats.starttime))
+
+
 def extract_channel_orientation(tr, inv):
-    """ Extract the dip and azimuth from inventory, given the trace """
+    """
+    Extract the dip and azimuth from inventory, given the trace. The
+    inv could be either obspy.Inventory or InventoryIndex.
+    """
     try:
-        nw = tr.stats.network
-        sta = tr.stats.station
         loc = tr.stats.location
         chan = tr.stats.channel
 
@@ -50,9 +72,10 @@ def extract_channel_orientation(tr, inv):
             # If channel is synthetic(from specfem), return default value
             # for dip and azimuth.
             dip, azi = ensemble_synthetic_channel_orientation(chan)
+        elif isinstance(inv, InventoryIndex):
+            dip, azi = inv.get_orientation(tr.id, time=tr.stats.starttime)
         else:
-            chan_inv = inv.select(network=nw, station=sta, location=loc,
-                                  channel=chan)[0][0][0]
+            chan_inv = select_channel_epoch(tr, inv)
             dip, azi = chan_inv.dip, chan_inv.azimuth
     except Exception as errmsg:
         print("Unable to extract channel orientation information [%s]"
@@ -65,36 +88,84 @@ def extract_channel_orientation(tr, inv):
 def extract_station_location(st, inventory):
     """
     Extract the station latitude and longitude from inventory, given
-    stream.
+    stream. The inventory could be either obspy.Inventory or
+    InventoryIndex.
     """
     nw = st[0].stats.network
     station = st[0].stats.station
+    if isinstance(inventory, InventoryIndex):
+        return inventory.get_station_location(
+            nw, station, time=st[0].stats.starttime)
     _inv = inventory.select(network=nw, station=station)
     sta_lat = float(_inv[0][0].latitude)
     sta_lon = float(_inv[0][0].longitude)
     return sta_lat, sta_lon
 
 
-def check_vertical_inventory_sanity(tr, inventory):
+def select_station_inventory(inventory, network, station, location=None):
+    """
+    Select the inventory of station(and location, if given). The
+    InventoryIndex is looked up by full channel id, so it is returned
+    as it is.
+    """
+    if isinstance(inventory, InventoryIndex):
+        return inventory
+    if location is None:
+        return inventory.select(network=network, station=station)
+    return inventory.select(network=network, station=station,
+                            location=location)
+
+
+def extract_channel_epoch(tr, inv):
+    """
+    Extract the (start_date, end_date) of the channel epoch containing
+    the starttime of trace, which is the epoch used in
+    extract_channel_orientation. (None, None) is returned for
+    synthetics, whose orientation is the same for all times, and None
+    if the channel epoch is not found.
+    """
+    if tr.stats.location == "S3":
+        return None, None
+    try:
+        if isinstance(inv, InventoryIndex):
+            return inv.get_channel_epoch(tr.id, time=tr.stats.starttime)
+        chan_inv = select_channel_epoch(tr, inv)
+        return chan_inv.start_date, chan_inv.end_date
+    except (KeyError, ValueError):
+        return None
+
+
+def check_vertical_inventory_sanity(tr, inventory, sanity_registry=None):
     """
     Check the inventory of vertical(Z) component, check
     if the abs(dip) is 90 and azimuth is 0.
+
+    :param sanity_registry: registry of check results. If the channel
+        epoch is in it, the result is taken from it. Otherwise, the
+        result is computed and added to it.
+    :type sanity_registry: pytomo3d.signal.sanity_registry.SanityRegistry
     """
     if tr.stats.channel[-1] != "Z":
         raise ValueError("Function only checks vertical(Z) component(%s)"
                          % tr.stats.channel)
+    if sanity_registry is not None:
+        result = sanity_registry.get_vertical(tr.id, tr.stats.starttime)
+        if result is not None:
+            return result
+
     dip, azi = extract_channel_orientation(tr, inventory)
+    result = is_vertical_orientation_sane(dip, azi)
 
-    if dip is None or azi is None:
-        return False
+    if sanity_registry is not None:
+        # no verdict is kept for unknown epochs
+        epoch = extract_channel_epoch(tr, inventory)
+        if epoch is not None:
+            sanity_registry.set_vertical(tr.id, epoch, result)
+    return result
 
-    if np.isclose(abs(dip), 90.0) and np.isclose(abs(azi), 0.0):
-        return True
-    else:
-        return False
 
-
-def check_horizontal_inventory_sanity(tr1, tr2, inventory):
+def check_horizontal_inventory_sanity(tr1, tr2, inventory,
+                                      sanity_registry=None):
     """
     Check two horizontal components and see if their dip is 0
     and azimuth is orthogonal to each other.
@@ -102,6 +173,7 @@ def check_horizontal_inventory_sanity(tr1, tr2, inventory):
     :param tr1:
     :param tr2:
     :param inventory:
+    :param sanity_registry: see check_vertical_inventory_sanity
     :return:
     """
     if tr1.id[:-1] != tr2.id[:-1]:
@@ -112,24 +184,27 @@ def check_horizontal_inventory_sanity(tr1, tr2, inventory):
     if tr1.stats.channel[-1] == "Z" or tr2.stats.channel[-1] == "Z":
         raise ValueError("Functions should check two horizontal component:"
                          "%s, %s" % (tr1.id, tr2.id))
+    if sanity_registry is not None:
+        result = sanity_registry.get_horizontal(tr1.id, tr2.id,
+                                                tr1.stats.starttime)
+        if result is not None:
+            return result
+
     dip1, azi1 = extract_channel_orientation(tr1, inventory)
     dip2, azi2 = extract_channel_orientation(tr2, inventory)
+    result = is_horizontal_orientation_sane(dip1, azi1, dip2, azi2)
 
-    if dip1 is None or azi1 is None or dip2 is None or azi2 is None:
-        return False
-
-    # check dip
-    if not np.isclose(dip1, 0.0) or not np.isclose(dip2, 0.0):
-        return False
-
-    # check azimuth
-    if not check_orthogonality(azi1, azi2):
-        return False
-
-    return True
+    if sanity_registry is not None:
+        epoch1 = extract_channel_epoch(tr1, inventory)
+        epoch2 = extract_channel_epoch(tr2, inventory)
+        if epoch1 is not None and epoch2 is not None:
+            sanity_registry.set_horizontal(
+                tr1.id, tr2.id, intersect_epochs(epoch1, epoch2), result)
+    return result
 
 
-def check_information_before_rotation(i_1, i_2, inv, sanity_check=False):
+def check_information_before_rotation(i_1, i_2, inv, sanity_check=False,
+                                      sanity_registry=None):
     # check starttime, sampling rate
     dt = 0.5 * i_1.stats.delta
     if (len(i_1) != len(i_2)) or \
@@ -140,14 +215,25 @@ def check_information_before_rotation(i_1, i_2, inv, sanity_check=False):
 
     # check inventory sanity if required by user
     if sanity_check:
-        if not check_horizontal_inventory_sanity(i_1, i_2, inv):
+        if not check_horizontal_inventory_sanity(
+                i_1, i_2, inv, sanity_registry=sanity_registry):
             msg = "Horizontal component are not orthogonal to " \
                   "each other: %s, %s" % (i_1.id, i_2.id)
             raise ValueError(msg)
 
 
+def _writable_float_data(data, dtype):
+    # only rotate in place arrays owned by the trace, not views (like
+    # Trace.slice) sharing memory with other arrays
+    if data.dtype == dtype and data.flags.writeable and \
+            data.flags.owndata:
+        return data
+    return data.astype(dtype)
+
+
 def rotate_12_rt_func(st, inv, back_azimuth, method="12->RT",
-                      sanity_check=False):
+                      sanity_check=False, rotation_pairs=None,
+                      sanity_registry=None):
     """
     Rotate horizontal component to RT. This function works generally
     for two horizontal and orthogonal components. This function
@@ -157,12 +243,20 @@ def rotate_12_rt_func(st, inv, back_azimuth, method="12->RT",
         2) "NE->RT": which rotates "NE" component to "RT", for example,
             "BHN" and "BHE" to "BHR" and "BHT"
     The reason why we use our own rotation function is because in obspy
-    the inventory information is not checked.
+    the inventory information is not checked. Float data owned by the
+    traces are rotated in place, without allocating new arrays. Views,
+    like the data of Trace.slice, are copied first.
 
     :param st: input stream
     :param inv: station inventory information
     :param method: rotation method
     :param back_azimuth: back azimuth(station to event azimuth)
+    :param rotation_pairs: if provided, the pairs of horizontal
+        components are appended to it instead of being rotated, so
+        they could be rotated in batch later by rotate_pairs.
+    :type rotation_pairs: list
+    :param sanity_registry: registry of inventory sanity checks, see
+        check_vertical_inventory_sanity
     :return: rotated stream
     """
     if method not in ["12->RT", "NE->RT"]:
@@ -170,6 +264,8 @@ def rotate_12_rt_func(st, inv, back_azimuth, method="12->RT",
                          "['12->RT', 'NE->RT']")
 
     bad_ids = []
+    # work arrays of rotation, keyed by (npts, dtype)
+    scratches = {}
     input_components, output_components = method.split("->")
     if len(input_components) == 2:
         input_1 = st.select(component=input_components[0])
@@ -177,7 +273,8 @@ def rotate_12_rt_func(st, inv, back_azimuth, method="12->RT",
         for i_1, i_2 in zip(input_1, input_2):
             try:
                 check_information_before_rotation(
-                    i_1, i_2, inv, sanity_check=sanity_check)
+                    i_1, i_2, inv, sanity_check=sanity_check,
+                    sanity_registry=sanity_registry)
             except Exception as err:
                 bad_ids.extend([i_1.id, i_2.id])
                 print("Unable to rotate [%s, %s] due to: %s"
@@ -187,8 +284,24 @@ def rotate_12_rt_func(st, inv, back_azimuth, method="12->RT",
             inc2, azi2 = extract_channel_orientation(i_2, inv)
             if azi1 is None or azi2 is None:
                 continue
-            output_1, output_2 = rotate_12_rt(i_1.data, i_2.data, back_azimuth,
-                                              azi1, azi2)
+            if rotation_pairs is not None:
+                if back_azimuth < 0 or back_azimuth > 360:
+                    raise ValueError("Back Azimuth should be between 0 "
+                                     "and 360 degree")
+                rotation_pairs.append((method, i_1, i_2, back_azimuth,
+                                       azi1, azi2))
+                continue
+            dtype = np.result_type(i_1.data, i_2.data)
+            if not np.issubdtype(dtype, np.floating):
+                dtype = np.dtype(np.float64)
+            data_1 = _writable_float_data(i_1.data, dtype)
+            data_2 = _writable_float_data(i_2.data, dtype)
+            key = (len(data_1), dtype.str)
+            if key not in scratches:
+                scratches[key] = np.empty_like(data_1)
+            output_1, output_2 = rotate_12_rt_inplace(
+                data_1, data_2, back_azimuth, azi1, azi2,
+                scratch=scratches[key])
             if output_1 is None or output_2 is None:
                 continue
             i_1.data = output_1
@@ -209,20 +322,97 @@ def rotate_12_rt_func(st, inv, back_azimuth, method="12->RT",
     return st
 
 
-def rotate_rt_to_ne(st, baz):
-    """ Use obspy rotate function to rotate from RT to NE """
-    st.rotate(method="RT->NE", back_azimuth=baz)
+def rotate_rt_to_ne(st, baz, rotation_pairs=None):
+    """
+    Use obspy rotate function to rotate from RT to NE. If rotation_pairs
+    is provided, the pairs of RT components are checked the same way
+    as obspy and appended to it, to be rotated in batch later.
+    """
+    if rotation_pairs is None:
+        st.rotate(method="RT->NE", back_azimuth=baz)
+        return
+
+    input_1 = st.select(component="R")
+    input_2 = st.select(component="T")
+    for i_1, i_2 in zip(input_1, input_2):
+        dt = 0.5 * i_1.stats.delta
+        if (len(i_1) != len(i_2)) or \
+                (abs(i_1.stats.starttime - i_2.stats.starttime) > dt) \
+                or (i_1.stats.sampling_rate != i_2.stats.sampling_rate):
+            raise ValueError("All components need to have the same "
+                             "time span.")
+    if baz < 0 or baz > 360:
+        raise ValueError("Back Azimuth should be between 0 and 360 degree")
+    for i_1, i_2 in zip(input_1, input_2):
+        rotation_pairs.append(("RT->NE", i_1, i_2, baz, None, None))
+
+
+def rotate_pairs(rotation_pairs):
+    """
+    Rotate the pairs of horizontal components collected by
+    rotate_one_station_stream(with rotation_pairs). Pairs which share
+    the same time grid and float type are stacked into 2-D arrays and
+    rotated together, with the batched kernels in rotate_utils.
+
+    :param rotation_pairs: list of (method, tr1, tr2, back_azimuth,
+        azimuth1, azimuth2), method is one of "12->RT", "NE->RT" and
+        "RT->NE". The azimuths are not used for "RT->NE".
+    :type rotation_pairs: list
+    """
+    groups = {}
+    scratches = {}
+    for pair in rotation_pairs:
+        method, tr1, tr2 = pair[0:3]
+        key = (method == "RT->NE", tr1.stats.npts, tr1.stats.delta,
+               tr1.data.dtype.str, tr2.data.dtype.str)
+        groups.setdefault(key, []).append(pair)
+
+    for key, pairs in groups.items():
+        dtype = np.result_type(pairs[0][1].data, pairs[0][2].data)
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+        # the stacked arrays are new, so they are rotated in place
+        d1 = np.array([p[1].data for p in pairs], dtype=dtype)
+        d2 = np.array([p[2].data for p in pairs], dtype=dtype)
+        baz = np.array([p[3] for p in pairs])
+        if d1.shape not in scratches or \
+                scratches[d1.shape].dtype != d1.dtype:
+            scratches[d1.shape] = np.empty_like(d1)
+        if key[0]:
+            output_1, output_2 = rotate_rt_ne_batch(
+                d1, d2, baz, out=(d1, d2), scratch=scratches[d1.shape])
+            valid = np.ones(len(pairs), dtype=bool)
+        else:
+            output_1, output_2, valid = rotate_12_rt_batch(
+                d1, d2, baz, [p[4] for p in pairs], [p[5] for p in pairs],
+                out=(d1, d2), scratch=scratches[d1.shape])
+
+        for idx, (method, i_1, i_2, back_azimuth, _, _) in \
+                enumerate(pairs):
+            if not valid[idx]:
+                continue
+            output_components = method.split("->")[1]
+            i_1.data = output_1[idx]
+            i_2.data = output_2[idx]
+            # Rename the components
+            i_1.stats.channel = i_1.stats.channel[:-1] + output_components[0]
+            i_2.stats.channel = i_2.stats.channel[:-1] + output_components[1]
+            # Add the azimuth back to stats object
+            for comp in (i_1, i_2):
+                comp.stats.back_azimuth = back_azimuth
 
 
-def remove_bad_z_component(st, inventory):
+def remove_bad_z_component(st, inventory, sanity_registry=None):
     """ remove Z component if its inventory does not meet requirements """
     for tr in st:
         if tr.stats.channel[-1] == "Z":
-            if not check_vertical_inventory_sanity(tr, inventory):
+            if not check_vertical_inventory_sanity(
+                    tr, inventory, sanity_registry=sanity_registry):
                 st.remove(tr)
 
 
-def rotate_to_rt(st, baz, inventory, mode, sanity_check=False):
+def rotate_to_rt(st, baz, inventory, mode, sanity_check=False,
+                 rotation_pairs=None, sanity_registry=None):
     """
     Rotate horizontal components(12 or NE) to RT directions.
 
@@ -231,19 +421,23 @@ def rotate_to_rt(st, baz, inventory, mode, sanity_check=False):
     :param inventory:
     :param mode:
     :param sanity_check:
+    :param rotation_pairs: see rotate_12_rt_func
+    :param sanity_registry: see rotate_12_rt_func
     :return:
     """
     components = [tr.stats.channel[-1] for tr in st]
 
     if sanity_check:
         # remove bad Z component
-        remove_bad_z_component(st, inventory)
+        remove_bad_z_component(st, inventory,
+                               sanity_registry=sanity_registry)
 
     if mode in ["12->RT", "ALL->RT"]:
         if "1" in components and "2" in components:
             try:
                 rotate_12_rt_func(st, inventory, method="12->RT",
-                                  back_azimuth=baz)
+                                  back_azimuth=baz,
+                                  rotation_pairs=rotation_pairs)
             except Exception as errmsg:
                 print("Error rotating 12->RT:%s" % errmsg)
 
@@ -251,7 +445,9 @@ def rotate_to_rt(st, baz, inventory, mode, sanity_check=False):
         if "N" in components and "E" in components:
             try:
                 rotate_12_rt_func(st, inventory, baz, method="NE->RT",
-                                  sanity_check=sanity_check)
+                                  sanity_check=sanity_check,
+                                  rotation_pairs=rotation_pairs,
+                                  sanity_registry=sanity_registry)
             except Exception as e:
                 print("Error rotating NE->RT:%s" % e)
 
@@ -259,11 +455,23 @@ def rotate_to_rt(st, baz, inventory, mode, sanity_check=False):
 def rotate_one_station_stream(st, event_latitude, event_longitude,
                               station_latitude=None, station_longitude=None,
                               inventory=None, mode="NE->RT",
-                              sanity_check=False):
+                              sanity_check=False, back_azimuth=None,
+                              rotation_pairs=None, sanity_registry=None):
     """
     Rotate the stream from the same network, station, location and channel
     code, for example the stream should only contains traces whose ids are
     "II.AAK.00.BH*"
+
+    :param back_azimuth: precomputed back azimuth of station. If provided,
+        the station location is not needed.
+    :type back_azimuth: float
+    :param rotation_pairs: if provided, the horizontal components are
+        checked but not rotated. They are appended to this list, to be
+        rotated in batch with other stations by rotate_pairs.
+    :type rotation_pairs: list
+    :param sanity_registry: registry of inventory sanity checks, see
+        check_vertical_inventory_sanity
+    :type sanity_registry: pytomo3d.signal.sanity_registry.SanityRegistry
     """
 
     mode = mode.upper()
@@ -275,7 +483,7 @@ def rotate_one_station_stream(st, event_latitude, event_longitude,
         raise ValueError("if rotating from RT to NE, then set "
                          "sanity_check to False")
 
-    if inventory is None and \
+    if inventory is None and back_azimuth is None and \
             (station_latitude is None and station_longitude is None):
         raise ValueError("You need either specify station inventory "
                          "or station location information")
@@ -288,57 +496,190 @@ def rotate_one_station_stream(st, event_latitude, event_longitude,
         raise ValueError("This method only accepts stream that contains "
                          "one station")
 
-    if station_latitude is None or station_longitude is None:
-        try:
-            station_latitude, station_longitude = \
-                extract_station_location(st, inventory)
-        except Exception as errmsg:
-            # station_latitude and station_longitude is unknown
-            # so the stream should be skipped
-            print("Error extracting staiton latitude and longitude from "
-                  "staiton inventory: %s" % errmsg)
-            return
+    if back_azimuth is not None:
+        baz = back_azimuth
+    else:
+        if station_latitude is None or station_longitude is None:
+            try:
+                station_latitude, station_longitude = \
+                    extract_station_location(st, inventory)
+            except Exception as errmsg:
+                # station_latitude and station_longitude is unknown
+                # so the stream should be skipped
+                print("Error extracting staiton latitude and longitude from "
+                      "staiton inventory: %s" % errmsg)
+                return
 
-    baz = calculate_baz(event_latitude, event_longitude,
-                        station_latitude, station_longitude)
+        baz = calculate_baz(event_latitude, event_longitude,
+                            station_latitude, station_longitude)
 
     if mode in ["NE->RT", "12->RT", "ALL->RT"]:
-        rotate_to_rt(st, baz, inventory, mode, sanity_check=sanity_check)
+        rotate_to_rt(st, baz, inventory, mode, sanity_check=sanity_check,
+                     rotation_pairs=rotation_pairs,
+                     sanity_registry=sanity_registry)
 
     if mode in ["RT->NE"]:
-        rotate_rt_to_ne(st, baz)
+        rotate_rt_to_ne(st, baz, rotation_pairs=rotation_pairs)
 
     return st
 
 
-def sort_stream_by_station(st):
+def _station_key(tr, by_channel):
+    station_id = "%s.%s.%s" % (tr.stats.network, tr.stats.station,
+                               tr.stats.location)
+    if by_channel:
+        station_id = "%s.%s" % (station_id, tr.stats.channel[0:2])
+    return station_id
+
+
+def build_station_index(st, by_channel=True):
+    """
+    Build the index of traces in stream by station, in one pass. The
+    index could be passed to sort_stream_by_station to group the same
+    stream(or a stream with the same trace layout) again without
+    computing the keys.
+
+    :param st: input stream
+    :type st: obspy.Stream
+    :param by_channel: see sort_stream_by_station
+    :type by_channel: bool
+    :return: OrderedDict with sorted key of station id and value of the
+        list of trace positions in stream
+    """
+    index = {}
+    for idx, tr in enumerate(st):
+        index.setdefault(_station_key(tr, by_channel), []).append(idx)
+    return OrderedDict((key, index[key]) for key in sorted(index))
+
+
+def sort_stream_by_station(st, by_channel=True, sort_keys=False,
+                           index=None):
     """
     Sort the traces in stream. Group the traces from same network,
-    station, location, and channel code together
+    station, location, and channel code together. It is done in one
+    pass over the stream, so it is linear in the number of traces.
+
+    :param st: input stream
+    :type st: obspy.Stream
+    :param by_channel: if True, traces are grouped by
+        "network.station.location.channel[0:2]", like "II.AAK.00.BH".
+        Otherwise, by "network.station.location".
+    :type by_channel: bool
+    :param sort_keys: if True, keys of the returned dict are in sorted
+        order. Otherwise, in the order of first appearance in stream.
+    :type sort_keys: bool
+    :param index: pre-sorted index from build_station_index. If given,
+        the groups are taken from it, with keys in its(sorted) order.
+    :type index: dict
+    :return: dict with key of station id and value of obspy.Stream.
+        Traces in each group keep their order in the input stream.
     """
     ntotal = len(st)
-    sta_dict = {}
-    n_added = 0
-    for tr in st:
-        nw = tr.stats.network
-        station = tr.stats.station
-        loc = tr.stats.location
-        chan = tr.stats.channel[0:2]
-        station_id = "%s.%s.%s.%s" % (nw, station, loc, chan)
-        if station_id not in sta_dict:
-            sta_dict[station_id] = \
-                st.select(network=nw, station=station,
-                          location=loc, channel="%s*" % chan)
-            n_added += len(sta_dict[station_id])
-
+    if index is None:
+        sta_dict = {}
+        for tr in st:
+            station_id = _station_key(tr, by_channel)
+            if station_id not in sta_dict:
+                sta_dict[station_id] = Stream()
+            sta_dict[station_id].append(tr)
+    else:
+        sta_dict = OrderedDict()
+        positions_used = set()
+        for station_id, positions in index.items():
+            positions_used.update(positions)
+            try:
+                sta_dict[station_id] = Stream(
+                    traces=[st[idx] for idx in positions])
+            except IndexError:
+                raise ValueError("Sort stream by station errors: index "
+                                 "does not match the stream")
+        if len(positions_used) != ntotal:
+            raise ValueError("Sort stream by station errors: index "
+                             "does not match the stream")
+
+    # every trace should be in exactly one group
+    n_added = sum(len(sta_st) for sta_st in sta_dict.values())
     if n_added != ntotal:
         raise ValueError("Sort stream by station errors: number of traces "
                          "is inconsistent")
+    if sort_keys and index is None:
+        sta_dict = OrderedDict(
+            (key, sta_dict[key]) for key in sorted(sta_dict))
     return sta_dict
 
 
+def get_station_geometry(streams, event_latitude, event_longitude,
+                         inventory, geometry_table=None, event_id=None):
+    """
+    Get the inventory subset and back azimuth of every station in the
+    streams, so they could be shared in rotating several streams of the
+    same stations, like the observed and synthetic.
+
+    :param streams: list of streams
+    :type streams: list
+    :param inventory: station inventory information
+    :type inventory: obspy.Inventory
+    :param geometry_table: event-station geometry table. If provided,
+        the back azimuth is taken from it. The event and stations not
+        in the table(or with changed locations) are added to it, so the
+        table could be shared by other stages and saved afterwards.
+    :type geometry_table: pytomo3d.utils.geodesic.GeometryTable
+    :param event_id: id of the event in geometry_table, required if
+        geometry_table is provided
+    :type event_id: str
+    :return: dict keyed by "network.station", with value of dict
+        {"inventory": station inventory, "back_azimuth": baz}. Stations
+        without location information in inventory are not included.
+    """
+    geometry = {}
+    locations = []
+    for st in streams:
+        for tr in st:
+            nw = tr.stats.network
+            station = tr.stats.station
+            key = "%s.%s" % (nw, station)
+            if key in geometry:
+                continue
+            station_inv = select_station_inventory(inventory, nw, station)
+            try:
+                sta_lat, sta_lon = extract_station_location(
+                    Stream(traces=[tr]), station_inv)
+            except Exception as errmsg:
+                print("Error extracting staiton latitude and longitude from "
+                      "staiton inventory: %s" % errmsg)
+                continue
+            geometry[key] = {"inventory": station_inv}
+            locations.append((key, sta_lat, sta_lon))
+
+    if len(locations) == 0:
+        return geometry
+
+    keys, sta_lats, sta_lons = zip(*locations)
+    if geometry_table is not None:
+        if event_id is None:
+            raise ValueError("event_id is required to use geometry_table")
+        geometry_table.update(
+            events={event_id: (event_latitude, event_longitude)},
+            stations=dict((key, (lat, lon)) for key, lat, lon
+                          in locations))
+        for key in keys:
+            geometry[key]["back_azimuth"] = \
+                geometry_table.get_back_azimuth(event_id, key)
+        return geometry
+
+    # back azimuth of all stations in one call
+    _, _, bazs = calculate_distance_azimuth(
+        event_latitude, event_longitude, np.array(sta_lats),
+        np.array(sta_lons), method="ellipsoid")
+    for key, baz in zip(keys, bazs):
+        geometry[key]["back_azimuth"] = float(baz)
+    return geometry
+
+
 def rotate_stream(st, event_latitude, event_longitude,
-                  inventory, mode="ALL->RT", sanity_check=False):
+                  inventory, mode="ALL->RT", sanity_check=False,
+                  station_geometry=None, batch_flag=True,
+                  sanity_registry=None):
     """
     Rotate a stream to radial and transverse components based on the
     station information and event information
@@ -351,8 +692,9 @@ def rotate_stream(st, event_latitude, event_longitude,
     :type event_longitude: float
     :param inventory: station inventory information. If you want to rotate
     "12" components, you need to provide inventory since only station
-    and station_longitude is not enough.
-    :type inventory: obspy.Inventory
+    and station_longitude is not enough. For streams of many stations,
+    an InventoryIndex built from the inventory makes the lookup faster.
+    :type inventory: obspy.Inventory or InventoryIndex
     :param mode: rotation mode, could be one of:
         1) "NE->RT": rotate only North and East channel to RT
         2) "12->RT": rotate only 1 and 2 channel, like "BH1" and "BH2" to RT
@@ -369,10 +711,27 @@ def rotate_stream(st, event_latitude, event_longitude,
         2) If rotating synthetic data, you could set it to False since
             I assume for synthetic data, there should not be problem
             associated with orientation.
+    :param station_geometry: precomputed inventory subset and back
+        azimuth of stations, from get_station_geometry. If provided,
+        the selection of inventory and calculation of back azimuth are
+        skipped for the stations in it.
+    :type station_geometry: dict
+    :param batch_flag: if True, the horizontal components of all stations
+        are collected first, and those sharing the same time grid are
+        rotated together as 2-D arrays. Otherwise, stations are rotated
+        one by one. The results are the same.
+    :type batch_flag: bool
+    :param sanity_registry: registry of inventory sanity checks, keyed by
+        channel id and epoch. The checks of channels in it are skipped,
+        and new results are added to it, so it could be shared among
+        events. It could be precomputed with
+        SanityRegistry.from_inventory and saved to json file.
+    :type sanity_registry: pytomo3d.signal.sanity_registry.SanityRegistry
     :return: rotated stream(obspy.Stream)
     """
 
     rotated_stream = Stream()
+    rotation_pairs = [] if batch_flag else None
 
     mode = mode.upper()
     mode_options = ["NE->RT", "ALL->RT", "12->RT", "RT->NE"]
@@ -400,20 +759,34 @@ def rotate_stream(st, event_latitude, event_longitude,
         loc = sta_stream[0].stats.location
         chan = sta_stream[0].stats.channel
 
-        if loc == "S3" or chan[0:2] == "MX":
+        baz = None
+        if station_geometry is not None and \
+                "%s.%s" % (nw, station) in station_geometry:
+            # the inventory is already selected for the station, and
+            # channels are looked up by full id in it
+            _geometry = station_geometry["%s.%s" % (nw, station)]
+            baz = _geometry["back_azimuth"]
+            station_inv = _geometry["inventory"]
+        elif loc == "S3" or chan[0:2] == "MX":
             # SPECFEM HACK: if the synthetic is generated by SPECFEM
             # and the stationxml is from read data, then the location
             # won't match between synt and staxml
-            station_inv = inventory.select(network=nw, station=station)
+            station_inv = select_station_inventory(inventory, nw, station)
         else:
-            station_inv = inventory.select(network=nw, station=station,
-                                           location=loc)
+            station_inv = select_station_inventory(inventory, nw, station,
+                                                   location=loc)
 
         _st = \
             rotate_one_station_stream(sta_stream, event_latitude,
                                       event_longitude, inventory=station_inv,
-                                      mode=mode, sanity_check=sanity_check)
+                                      mode=mode, sanity_check=sanity_check,
+                                      back_azimuth=baz,
+                                      rotation_pairs=rotation_pairs,
+                                      sanity_registry=sanity_registry)
         if _st is not None:
             rotated_stream += _st
 
+    if batch_flag:
+        rotate_pairs(rotation_pairs)
+
     return rotated_stream
@@ -13,11 +13,17 @@ forward and backward.
 """
 
 from math import cos, sin
+import numpy as np
 from numpy import deg2rad
 
 
 SMALL_DEGREE = 0.01
 
+# status of check_orthogonality_batch
+NOT_ORTHOGONAL = 0
+LEFT_HAND = 1
+RIGHT_HAND = -1
+
 
 def check_orthogonality(azim1, azim2):
     """
@@ -223,3 +229,358 @@ def rotate_ne_12(n, e, azim1, azim2):
         return d2, d1
     elif "left" in status:
         return d1, d2
+
+
+def check_orthogonality_batch(azim1, azim2):
+    """
+    Vectorized version of check_orthogonality, for arrays of azimuth
+    pairs. Unit is degree.
+
+    :type azim1: :class:`~numpy.ndarray`
+    :param azim1: azimuth of the first components
+    :type azim2: :class:`~numpy.ndarray`
+    :param azim2: azimuth of the second components
+    :return: integer array of status, LEFT_HAND(1), RIGHT_HAND(-1) or
+        NOT_ORTHOGONAL(0)
+    """
+    azim1 = (np.asarray(azim1, dtype=np.float64) + 360) % 360
+    azim2 = (np.asarray(azim2, dtype=np.float64) + 360) % 360
+    diff = azim1 - azim2
+
+    status = np.zeros(diff.shape, dtype=int)
+    # the same as check_orthogonality, including the case which
+    # crosses 360 degree
+    status[(np.abs(diff - 90.0) < SMALL_DEGREE) |
+           (np.abs(diff + 270.0) < SMALL_DEGREE)] = RIGHT_HAND
+    status[(np.abs(diff + 90.0) < SMALL_DEGREE) |
+           (np.abs(diff - 270.0) < SMALL_DEGREE)] = LEFT_HAND
+    return status
+
+
+def _check_batch_input(d1, d2, *angles):
+    d1 = np.asarray(d1)
+    d2 = np.asarray(d2)
+    if d1.ndim != 2 or d1.shape != d2.shape:
+        raise ValueError("d1%s and d2%s should be 2-D arrays of the same "
+                         "shape(nsta, npts)" % (d1.shape, d2.shape))
+    nsta = d1.shape[0]
+    angles = [np.broadcast_to(np.asarray(a, dtype=np.float64), (nsta, ))
+              for a in angles]
+    return [d1, d2] + angles
+
+
+def _check_batch_baz(baz):
+    if np.any((baz < 0) | (baz > 360)):
+        raise ValueError("Back Azimuth should be between 0 and 360 degree")
+
+
+def _batch_output(d1, d2, out):
+    # float arrays to hold the result, copied from input if out is None
+    if out is not None:
+        o1, o2 = out
+        if o1 is not d1:
+            np.copyto(o1, d1)
+        if o2 is not d2:
+            np.copyto(o2, d2)
+        return o1, o2
+    dtype = np.result_type(d1, d2)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    return np.array(d1, dtype=dtype), np.array(d2, dtype=dtype)
+
+
+def rotate_certain_angle_batch(d1, d2, angle, unit="degree", out=None,
+                               scratch=None):
+    """
+    Vectorized version of rotate_certain_angle. Row i of d1 and d2 is
+    rotated by angle[i]. The float type of data is kept.
+
+    :type d1: :class:`~numpy.ndarray`
+    :param d1: Data of one of the two horizontal components, in shape
+        of (nsta, npts)
+    :type d2: :class:`~numpy.ndarray`
+    :param d2: Data of the other horizontal components, in shape of
+        (nsta, npts)
+    :type angle: :class:`~numpy.ndarray`
+    :param angle: rotation angle of each row, in shape of (nsta, )
+    :param out: (out1, out2) arrays to hold the result. If None, new
+        arrays are returned and the input is not changed. It could be
+        (d1, d2) to rotate in place.
+    :type out: tuple
+    :param scratch: work array, see rotate_certain_angle_inplace
+    :return: two new components after rotation
+    """
+    d1, d2, angle = _check_batch_input(d1, d2, angle)
+    o1, o2 = _batch_output(d1, d2, out)
+    return rotate_certain_angle_inplace(o1, o2, angle, unit=unit,
+                                        scratch=scratch)
+
+
+def rotate_12_rt_batch(d1, d2, baz, azim1, azim2, out=None, scratch=None):
+    """
+    Vectorized version of rotate_12_rt, which rotates the horizontal
+    components of many stations to RT at once. The orthogonality check
+    and the flip of right-handed components are done on the whole
+    arrays.
+
+    :type d1: :class:`~numpy.ndarray`
+    :param d1: Data of one of the two horizontal components, in shape
+        of (nsta, npts)
+    :type d2: :class:`~numpy.ndarray`
+    :param d2: Data of the other horizontal components, in shape of
+        (nsta, npts)
+    :type baz: :class:`~numpy.ndarray`
+    :param baz: the back azimuth of each station in degrees
+    :type azim1: :class:`~numpy.ndarray`
+    :param azim1: component azimuth of d1
+    :type azim2: :class:`~numpy.ndarray`
+    :param azim2: component azimuth of d2
+    :param out: (out_r, out_t), see rotate_certain_angle_batch
+    :param scratch: work array, see rotate_certain_angle_inplace
+    :return: (r, t, valid). valid is a boolean array which is False for
+        stations whose two components are not orthogonal. Those rows of
+        r and t are not meaningful and should be discarded.
+    """
+    d1, d2, baz, azim1, azim2 = _check_batch_input(d1, d2, baz, azim1,
+                                                   azim2)
+    _check_batch_baz(baz)
+
+    status = check_orthogonality_batch(azim1, azim2)
+    valid = status != NOT_ORTHOGONAL
+
+    o1, o2 = _batch_output(d1, d2, out)
+    # flip the right-handed ones to left-hand
+    right = (status == RIGHT_HAND)
+    if np.any(right):
+        flipped = o1[right]
+        o1[right] = o2[right]
+        o2[right] = flipped
+    azim = np.where(right, azim2, azim1)
+
+    r, t = rotate_certain_angle_inplace(o1, o2, baz + 180.0 - azim,
+                                        scratch=scratch)
+    return r, t, valid
+
+
+def rotate_rt_ne_batch(r, t, baz, out=None, scratch=None):
+    """
+    Rotate the RT components of many stations back to NE at once. It
+    gives the same result as obspy.signal.rotate.rotate_rt_ne.
+
+    :type r: :class:`~numpy.ndarray`
+    :param r: Data of radial components, in shape of (nsta, npts)
+    :type t: :class:`~numpy.ndarray`
+    :param t: Data of transverse components, in shape of (nsta, npts)
+    :type baz: :class:`~numpy.ndarray`
+    :param baz: the back azimuth of each station in degrees
+    :param out: (out_n, out_e), see rotate_certain_angle_batch
+    :param scratch: work array, see rotate_certain_angle_inplace
+    :return: North and East components
+    """
+    r, t, baz = _check_batch_input(r, t, baz)
+    _check_batch_baz(baz)
+    return rotate_certain_angle_batch(r, t, -(baz + 180.0), out=out,
+                                      scratch=scratch)
+
+
+def _prepare_inplace(d1, d2, out, scratch):
+    if out is None:
+        o1, o2 = d1, d2
+    else:
+        o1, o2 = out
+        if o1 is not d1:
+            np.copyto(o1, d1)
+        if o2 is not d2:
+            np.copyto(o2, d2)
+
+    if o1.shape != o2.shape or o1.dtype != o2.dtype:
+        raise ValueError("Two components should have the same shape and "
+                         "dtype: %s(%s), %s(%s)" % (o1.shape, o1.dtype,
+                                                    o2.shape, o2.dtype))
+    if not np.issubdtype(o1.dtype, np.floating):
+        raise TypeError("In-place rotation only supports float arrays: %s"
+                        % o1.dtype)
+
+    if scratch is None:
+        scratch = np.empty_like(o1)
+    elif scratch.shape != o1.shape or scratch.dtype != o1.dtype:
+        raise ValueError("scratch(%s, %s) should have the same shape and "
+                         "dtype as data(%s, %s)" % (scratch.shape,
+                                                    scratch.dtype,
+                                                    o1.shape, o1.dtype))
+    return o1, o2, scratch
+
+
+def rotate_certain_angle_inplace(d1, d2, angle, unit="degree", out=None,
+                                 scratch=None):
+    """
+    In-place version of rotate_certain_angle. It computes the same
+    d1 * cos(angle) + d2 * sin(angle) and -d1 * sin(angle) +
+    d2 * cos(angle), so the result is the same as rotate_certain_angle
+    for float64 data. The two halves of the scratch buffer hold the
+    products d1 * sin(angle) and d2 * sin(angle), and the data is
+    rotated block by block, so no temporary array is allocated if scratch
+    is given. The float type of data is kept.
+
+    Data could also be 2-D arrays of (nsta, npts), with angle of shape
+    (nsta, ).
+
+    :type d1: :class:`~numpy.ndarray`
+    :param d1: Data of one of the two horizontal components
+    :type d2: :class:`~numpy.ndarray`
+    :param d2: Data of the other horizontal components
+    :type angle: float
+    :param angle: rotation angle, see rotate_certain_angle
+    :param out: (out1, out2) arrays to hold the result. If None, the
+        result is written into d1 and d2.
+    :type out: tuple
+    :param scratch: work array with the same shape and dtype as data.
+        If None, it is allocated.
+    :type scratch: :class:`~numpy.ndarray`
+    :return: (out1, out2), two new components after rotation
+    """
+    if unit == "degree":
+        angle = deg2rad(angle)
+    elif unit != "radian":
+        raise ValueError("Unregonized unit(%s): 1) degree; 2) radian"
+                         % unit)
+
+    o1, o2, scratch = _prepare_inplace(d1, d2, out, scratch)
+
+    angle = np.asarray(angle, dtype=np.float64)
+    c = np.cos(angle).astype(o1.dtype)
+    s = np.sin(angle).astype(o1.dtype)
+    if o1.ndim == 2 and angle.ndim == 1:
+        c = c[:, np.newaxis]
+        s = s[:, np.newaxis]
+
+    npts = o1.shape[-1]
+    if npts < 2:
+        d1_s = o1 * s
+        o1 *= c
+        o1 += o2 * s
+        o2 *= c
+        o2 -= d1_s
+        return o1, o2
+
+    step = npts // 2
+    for start in range(0, npts, step):
+        size = min(step, npts - start)
+        b1 = o1[..., start:start + size]
+        b2 = o2[..., start:start + size]
+        d1_s = scratch[..., :size]
+        d2_s = scratch[..., step:step + size]
+        np.multiply(b1, s, out=d1_s)
+        np.multiply(b2, s, out=d2_s)
+        b1 *= c
+        b1 += d2_s
+        b2 *= c
+        b2 -= d1_s
+    return o1, o2
+
+
+def _swap_out(out):
+    if out is None:
+        return None
+    return out[1], out[0]
+
+
+def rotate_12_rt_inplace(d1, d2, baz, azim1, azim2, out=None,
+                         scratch=None):
+    """
+    In-place version of rotate_12_rt. See rotate_certain_angle_inplace
+    for out and scratch. If out is given, r and t are written into
+    out[0] and out[1]. Otherwise they are written into the input arrays,
+    and if the two components are right-handed, r goes into d2 and t
+    into d1.
+
+    :return: (r, t), or (None, None) if input two components are not
+        orthogonal
+    """
+    status = check_orthogonality(azim1, azim2)
+    if not status:
+        return None, None
+    if baz < 0 or baz > 360:
+        raise ValueError("Back Azimuth should be between 0 and 360 degree")
+    if "right" in status:
+        # flip to left-hand
+        d1, d2 = d2, d1
+        azim1, azim2 = azim2, azim1
+
+    return rotate_certain_angle_inplace(d1, d2, baz + 180.0 - azim1,
+                                        out=out, scratch=scratch)
+
+
+def rotate_rt_12_inplace(r, t, baz, azim1, azim2, out=None, scratch=None):
+    """
+    In-place version of rotate_rt_12. See rotate_12_rt_inplace for out
+    and scratch. Without out, for right-handed components, d1 goes
+    into t and d2 into r.
+
+    :return: (d1, d2)
+    """
+    status = check_orthogonality(azim1, azim2)
+    if not status:
+        raise ValueError("azim1 and azim2 not orthogonal")
+    if baz < 0 or baz > 360:
+        raise ValueError("Back Azimuth should be between 0 and 360 degree")
+
+    if "right" in status:
+        d2, d1 = rotate_certain_angle_inplace(
+            r, t, -(baz + 180.0 - azim2), out=_swap_out(out),
+            scratch=scratch)
+        return d1, d2
+    return rotate_certain_angle_inplace(r, t, -(baz + 180.0 - azim1),
+                                        out=out, scratch=scratch)
+
+
+def rotate_12_ne_inplace(d1, d2, azim1, azim2, out=None, scratch=None):
+    """
+    In-place version of rotate_12_ne. See rotate_12_rt_inplace for out
+    and scratch.
+
+    :return: (n, e)
+    """
+    status = check_orthogonality(azim1, azim2)
+    if not status:
+        raise ValueError("azim1 and azim2 not orthogonal")
+    if "right" in status:
+        # flip to left-hand
+        d1, d2 = d2, d1
+        azim1, azim2 = azim2, azim1
+
+    return rotate_certain_angle_inplace(d1, d2, -azim1, out=out,
+                                        scratch=scratch)
+
+
+def rotate_ne_12_inplace(n, e, azim1, azim2, out=None, scratch=None):
+    """
+    In-place version of rotate_ne_12. See rotate_rt_12_inplace for out
+    and scratch.
+
+    :return: (d1, d2)
+    """
+    status = check_orthogonality(azim1, azim2)
+    if not status:
+        raise ValueError("azim1 and azim2 not orthogonal")
+
+    if "right" in status:
+        d2, d1 = rotate_certain_angle_inplace(n, e, azim2,
+                                              out=_swap_out(out),
+                                              scratch=scratch)
+        return d1, d2
+    return rotate_certain_angle_inplace(n, e, azim1, out=out,
+                                        scratch=scratch)
+
+
+def rotate_rt_ne_inplace(r, t, baz, out=None, scratch=None):
+    """
+    In-place version of obspy.signal.rotate.rotate_rt_ne. See
+    rotate_certain_angle_inplace for out and scratch.
+
+    :return: (n, e)
+    """
+    if baz < 0 or baz > 360:
+        raise ValueError("Back Azimuth should be between 0 and 360 degree")
+    return rotate_certain_angle_inplace(r, t, -(baz + 180.0), out=out,
+                                        scratch=scratch)
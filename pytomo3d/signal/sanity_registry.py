@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Registry of the inventory sanity checks used in rotation, i.e., whether
+the vertical component is vertical and the two horizontal components
+are horizontal and orthogonal. The orientation of channels only changes
+at epoch boundaries, so the result of a check is kept for the channel
+epoch and reused for all the events in it. The registry could be saved
+to json file, so it is computed once for an inventory and loaded in
+every processing job.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (division, print_function, absolute_import)
+import numpy as np
+from obspy import UTCDateTime
+from pytomo3d.utils.io import load_json, dump_json
+from .rotate_utils import check_orthogonality
+
+
+# the pairs of horizontal components checked in rotation
+HORIZONTAL_PAIRS = (("1", "2"), ("N", "E"))
+
+
+def is_vertical_orientation_sane(dip, azi):
+    """ Check if abs(dip) is 90 and azimuth is 0 """
+    if dip is None or azi is None:
+        return False
+    return bool(np.isclose(abs(dip), 90.0) and np.isclose(abs(azi), 0.0))
+
+
+def is_horizontal_orientation_sane(dip1, azi1, dip2, azi2):
+    """ Check if both dips are 0 and the two azimuths are orthogonal """
+    if dip1 is None or azi1 is None or dip2 is None or azi2 is None:
+        return False
+    if not np.isclose(dip1, 0.0) or not np.isclose(dip2, 0.0):
+        return False
+    if not check_orthogonality(azi1, azi2):
+        return False
+    return True
+
+
+def intersect_epochs(epoch1, epoch2):
+    """ Intersection of two (start, end) epochs, None for open ends """
+    starts = [t for t in (epoch1[0], epoch2[0]) if t is not None]
+    ends = [t for t in (epoch1[1], epoch2[1]) if t is not None]
+    start = max(starts) if len(starts) > 0 else None
+    end = min(ends) if len(ends) > 0 else None
+    return start, end
+
+
+def _time_to_str(time):
+    if time is None:
+        return None
+    return str(time)
+
+
+def _str_to_time(value):
+    if value is None:
+        return None
+    return UTCDateTime(value)
+
+
+class SanityRegistry(object):
+    """
+    Results of the vertical and horizontal sanity checks, keyed by
+    channel id(or the pair of channel ids) and the channel epoch. A
+    result is valid for all the times in its epoch. The registry is
+    tied to the inventory it is computed from, so it should be rebuilt
+    if the inventory changes.
+    """
+
+    def __init__(self):
+        # key to list of [start, end, result]
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def vertical_key(channel_id):
+        return "Z:%s" % channel_id
+
+    @staticmethod
+    def horizontal_key(channel_id1, channel_id2):
+        return "H:%s,%s" % (channel_id1, channel_id2)
+
+    def __len__(self):
+        return sum(len(v) for v in self._entries.values())
+
+    def _get(self, key, time):
+        for start, end, result in self._entries.get(key, []):
+            if (start is None or time is None or start <= time) and \
+                    (end is None or time is None or time <= end):
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def _set(self, key, epoch, result):
+        start, end = epoch
+        entries = self._entries.setdefault(key, [])
+        for entry in entries:
+            if entry[0] == start and entry[1] == end:
+                entry[2] = bool(result)
+                return
+        entries.append([start, end, bool(result)])
+
+    def get_vertical(self, channel_id, time=None):
+        """
+        Result of vertical check of channel at time. None if it is not
+        in the registry.
+        """
+        return self._get(self.vertical_key(channel_id), time)
+
+    def set_vertical(self, channel_id, epoch, result):
+        """
+        :param epoch: (start_date, end_date) of channel, None for
+            open ends
+        :type epoch: tuple
+        """
+        self._set(self.vertical_key(channel_id), epoch, result)
+
+    def get_horizontal(self, channel_id1, channel_id2, time=None):
+        """
+        Result of horizontal check of the two channels at time. None if
+        it is not in the registry.
+        """
+        return self._get(self.horizontal_key(channel_id1, channel_id2),
+                         time)
+
+    def set_horizontal(self, channel_id1, channel_id2, epoch, result):
+        self._set(self.horizontal_key(channel_id1, channel_id2), epoch,
+                  result)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def to_dict(self):
+        return dict((key, [[_time_to_str(start), _time_to_str(end), result]
+                           for start, end, result in entries])
+                    for key, entries in self._entries.items())
+
+    def save(self, filename):
+        """ Save the registry to json file """
+        dump_json(self.to_dict(), filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load the registry from json file """
+        registry = cls()
+        for key, entries in load_json(filename).items():
+            registry._entries[key] = [
+                [_str_to_time(start), _str_to_time(end), bool(result)]
+                for start, end, result in entries]
+        return registry
+
+    @classmethod
+    def from_inventory(cls, inventory):
+        """
+        Run the sanity checks of all the vertical channels and horizontal
+        pairs in inventory, for every channel epoch.
+
+        :param inventory: station inventory information
+        :type inventory: obspy.Inventory
+        """
+        registry = cls()
+        for nw in inventory:
+            for sta in nw:
+                channels = {}
+                for chan in sta:
+                    chan_id = "%s.%s.%s.%s" % (nw.code, sta.code,
+                                               chan.location_code, chan.code)
+                    channels.setdefault(chan_id, []).append(chan)
+
+                for chan_id, epochs in channels.items():
+                    if chan_id[-1] == "Z":
+                        for chan in epochs:
+                            registry.set_vertical(
+                                chan_id, (chan.start_date, chan.end_date),
+                                is_vertical_orientation_sane(chan.dip,
+                                                             chan.azimuth))
+                        continue
+                    for comp1, comp2 in HORIZONTAL_PAIRS:
+                        if chan_id[-1] != comp1:
+                            continue
+                        chan_id2 = chan_id[:-1] + comp2
+                        for chan1 in epochs:
+                            for chan2 in channels.get(chan_id2, []):
+                                epoch = intersect_epochs(
+                                    (chan1.start_date, chan1.end_date),
+                                    (chan2.start_date, chan2.end_date))
+                                if epoch[0] is not None and \
+                                        epoch[1] is not None and \
+                                        epoch[1] < epoch[0]:
+                                    # epochs do not overlap
+                                    continue
+                                registry.set_horizontal(
+                                    chan_id, chan_id2, epoch,
+                                    is_horizontal_orientation_sane(
+                                        chan1.dip, chan1.azimuth,
+                                        chan2.dip, chan2.azimuth))
+        return registry
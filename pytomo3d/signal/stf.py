@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Convolution of synthetics with the Gaussian source time function(STF).
+Synthetics from SPECFEM(location "S3", channel "MX*") are usually
+computed with a step source, so they need to be convolved with the STF
+whose half duration is given in the CMTSOLUTION file. The spectrum of
+STF is taken from the kernel cache, so it is built only once for each
+(npts, delta, half_duration).
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (division, print_function, absolute_import)
+import numpy as np
+from pytomo3d.utils.fft import rfft, irfft
+from .kernel_cache import get_stf_kernel
+
+
+def gaussian_stf(times, half_duration):
+    """
+    Gaussian source time function used in SPECFEM, with unit area:
+        s(t) = alpha / sqrt(pi) * exp(-(alpha * t)^2)
+    where alpha = 1.628 / half_duration.
+
+    :param times: time array(unit: second)
+    :type times: numpy.array
+    :param half_duration: half duration of source(unit: second)
+    :type half_duration: float
+    """
+    alpha = 1.628 / half_duration
+    return alpha / np.sqrt(np.pi) * np.exp(-(alpha * np.asarray(times)) ** 2)
+
+
+def convolve_stf_array(data, delta, half_duration):
+    """
+    Convolve the data array with Gaussian STF. If data is 2-D array,
+    then each row is treated as one trace.
+
+    :param data: input data array, 1-D or 2-D
+    :type data: numpy.array
+    :param delta: sampling interval of data
+    :type delta: float
+    :param half_duration: half duration of source(unit: second)
+    :type half_duration: float
+    :return: convolved data array, with the same shape and dtype as input
+    """
+    npts = data.shape[-1]
+    dtype = data.dtype
+    nfft, spectrum = get_stf_kernel(npts, delta, half_duration)
+    data = rfft(data, n=nfft, axis=-1)
+    data *= spectrum
+    data = irfft(data, n=nfft, axis=-1)[..., 0:npts]
+    return data.astype(dtype, copy=False)
@@ -115,3 +115,44 @@ def test_plot_two_traces_raise(tmpdir):
 
     with pytest.raises(TypeError):
         ct.plot_two_trace(smallobs[0], smallobs.copy(), figname=figname)
+
+
+def test_compare_arrays():
+    np.random.seed(0)
+    d1 = np.random.randn(3, 100)
+    d2 = d1 + 0.1 * np.random.randn(3, 100)
+    corr, err = ct.compare_arrays(d1, d2, 1.0, taper_flag=False)
+    for i in range(3):
+        npt.assert_allclose(corr[i], ct.cross_correlation(d1[i], d2[i]))
+        npt.assert_allclose(err[i], ct.least_squre_error(d1[i], d2[i]))
+
+
+def test_compare_streams():
+    st1 = syn.copy()
+    st2 = syn.copy()
+    np.random.seed(1)
+    for tr in st2:
+        tr.data = tr.data * 1.01 + \
+            1e-3 * np.abs(tr.data).max() * np.random.randn(tr.stats.npts)
+    # on the same grid, but shorter
+    st2[1].trim(st2[1].stats.starttime + 100, st2[1].stats.endtime - 50)
+    # not on the same grid
+    st2[2].stats.starttime += 0.3 * st2[2].stats.delta
+    st1 += obs[0].copy()
+
+    table = ct.compare_streams(st1, st2)
+    assert table["id"] == [tr.id for tr in syn]
+    assert table["tr1_only"] == [obs[0].id]
+    assert table["tr2_only"] == []
+    for idx, tr in enumerate(syn):
+        res = ct.calculate_misfit(tr, st2.select(id=tr.id)[0])
+        for col in ct.COMPARE_COLUMNS:
+            npt.assert_allclose(table[col][idx], res[col], rtol=1e-6)
+
+    table2 = ct.compare_streams(st1, st2, n_workers=2)
+    assert table2["id"] == table["id"]
+    for col in ct.COMPARE_COLUMNS:
+        npt.assert_allclose(table2[col], table[col])
+
+    with pytest.raises(TypeError):
+        ct.compare_streams(st1[0], st2)
@@ -0,0 +1,73 @@
+import os
+import inspect
+import pytest
+import obspy
+from pytomo3d.signal.inventory_index import InventoryIndex
+from pytomo3d.signal.rotate import select_station_inventory
+
+
+def _upper_level(path, nlevel=4):
+    """
+    Go the nlevel dir up
+    """
+    for i in range(nlevel):
+        path = os.path.dirname(path)
+    return path
+
+
+# Most generic way to get the data folder path.
+TESTBASE_DIR = _upper_level(os.path.abspath(
+    inspect.getfile(inspect.currentframe())), 4)
+DATA_DIR = os.path.join(TESTBASE_DIR, "tests", "data")
+
+staxmlfile = os.path.join(DATA_DIR, "stationxml", "IU.KBL.xml")
+teststaxml = obspy.read_inventory(staxmlfile)
+
+
+def test_inventory_index():
+    index = InventoryIndex(teststaxml)
+    assert len(index) == 3
+    assert "IU.KBL..BHZ" in index
+    assert "IU.KBL..BH1" not in index
+
+    assert index.get_orientation("IU.KBL..BHZ") == (-90.0, 0.0)
+    assert index.get_orientation("IU.KBL..BHE") == (0.0, 90.0)
+    dip, azi, lat, lon = index.get_channel("IU.KBL..BHN")
+    assert (dip, azi) == (0.0, 0.0)
+    assert lat == pytest.approx(34.5408)
+    assert lon == pytest.approx(69.0432)
+
+    assert index.get_station_location("IU", "KBL") == \
+        pytest.approx((34.5408, 69.0432))
+    assert select_station_inventory(index, "IU", "KBL") is index
+
+    with pytest.raises(KeyError):
+        index.get_orientation("IU.FAKE..BHZ")
+    with pytest.raises(KeyError):
+        index.get_station_location("IU", "FAKE")
+
+
+def test_inventory_index_epoch():
+    inv = teststaxml.copy()
+    sta = inv[0][0]
+    chan = sta[0].copy()
+    # a newer epoch with different azimuth
+    sta[0].end_date = obspy.UTCDateTime(2015, 1, 1)
+    chan.start_date = obspy.UTCDateTime(2015, 1, 1)
+    chan.azimuth = 45.0
+    sta.channels.append(chan)
+
+    index = InventoryIndex(inv)
+    chan_id = "IU.KBL.%s.%s" % (chan.location_code, chan.code)
+    assert index.get_orientation(chan_id)[1] == sta[0].azimuth
+    assert index.get_orientation(
+        chan_id, time=obspy.UTCDateTime(2010, 1, 1))[1] == sta[0].azimuth
+    assert index.get_orientation(
+        chan_id, time=obspy.UTCDateTime(2016, 1, 1))[1] == 45.0
+
+    # no epoch contains the time
+    with pytest.raises(KeyError):
+        index.get_orientation(chan_id, time=obspy.UTCDateTime(2000, 1, 1))
+    with pytest.raises(KeyError):
+        index.get_station_location(
+            "IU", "KBL", time=obspy.UTCDateTime(2000, 1, 1))
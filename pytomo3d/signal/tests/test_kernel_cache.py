@@ -0,0 +1,127 @@
+import threading
+import numpy as np
+import numpy.testing as npt
+import pytest
+from obspy.signal.invsim import cosine_sac_taper
+from obspy.signal.util import _npts2nfft
+import pytomo3d.signal.kernel_cache as kc
+
+
+def test_kernel_cache_lru():
+    cache = kc.KernelCache(maxsize=2)
+    assert cache.get("a", lambda: 1) == 1
+    assert cache.get("b", lambda: 2) == 2
+    # hit, and "a" becomes the most recently used one
+    assert cache.get("a", lambda: 10) == 1
+    assert cache.get("c", lambda: 3) == 3
+    assert "b" not in cache
+    assert "a" in cache
+    assert cache.stats == {"hits": 1, "misses": 3, "evictions": 1,
+                           "size": 2, "maxsize": 2, "nbytes": 0,
+                           "maxbytes": None}
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats["misses"] == 0
+
+    with pytest.raises(ValueError):
+        kc.KernelCache(maxsize=0)
+
+
+def test_kernel_cache_maxbytes():
+    cache = kc.KernelCache(maxsize=10, maxbytes=2000)
+    cache.get("a", lambda: np.zeros(100))
+    cache.get("b", lambda: (np.zeros(50), np.zeros(50)))
+    assert cache.nbytes == 1600
+    # exceeds maxbytes, so the least recently used one is evicted
+    cache.get("c", lambda: np.zeros(100))
+    assert "a" not in cache
+    assert cache.nbytes == 1600
+    assert cache.stats["evictions"] == 1
+
+    # value larger than maxbytes is returned but not stored
+    value = cache.get("d", lambda: np.zeros(1000))
+    assert len(value) == 1000
+    assert "d" not in cache
+    assert len(cache) == 2
+
+    cache.clear()
+    assert cache.nbytes == 0
+
+    with pytest.raises(ValueError):
+        kc.KernelCache(maxbytes=0)
+
+
+def test_kernel_caches_separated():
+    kc.clear_kernel_caches()
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kc.get_taper_kernel(1000, 0.5, pre_filt)
+    for npts in range(100, 200):
+        kc.get_detrend_kernel(npts)
+    # detrend kernels do not evict the taper kernel
+    assert len(kc.taper_kernel_cache) == 1
+    assert len(kc.detrend_kernel_cache) == \
+        kc.detrend_kernel_cache.maxsize
+    kc.get_taper_kernel(1000, 0.5, pre_filt)
+    assert kc.taper_kernel_cache.stats["hits"] == 1
+
+    kc.clear_kernel_caches()
+    assert all(len(cache) == 0 for cache in kc.kernel_caches.values())
+
+
+def test_kernel_cache_threads():
+    cache = kc.KernelCache(maxsize=4)
+    results = []
+
+    def _worker():
+        for i in range(100):
+            results.append(cache.get(i % 8, lambda: i % 8))
+
+    threads = [threading.Thread(target=_worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 400
+    stats = cache.stats
+    assert stats["hits"] + stats["misses"] == 400
+    assert stats["size"] <= 4
+
+
+def test_get_taper_kernel():
+    kc.taper_kernel_cache.clear()
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    npts = 1000
+    delta = 0.5
+    nfft, taper = kc.get_taper_kernel(npts, delta, pre_filt)
+
+    assert nfft == _npts2nfft(npts)
+    freqs = np.linspace(0, 1.0 / (2 * delta), nfft // 2 + 1)
+    npt.assert_allclose(taper, cosine_sac_taper(freqs, flimit=pre_filt))
+    assert not taper.flags.writeable
+
+    nfft2, taper2 = kc.get_taper_kernel(npts, delta, np.array(pre_filt))
+    assert taper2 is taper
+    assert kc.taper_kernel_cache.stats["hits"] == 1
+    assert kc.taper_kernel_cache.stats["misses"] == 1
+
+
+def test_get_detrend_kernel():
+    npts = 500
+    x, kernel = kc.get_detrend_kernel(npts)
+    assert kernel.shape == (2, npts)
+    assert not kernel.flags.writeable
+
+    data = 3.0 * x - 2.0
+    npt.assert_allclose(np.dot(kernel, data), [3.0, -2.0], atol=1e-10)
+    assert kc.get_detrend_kernel(npts)[1] is kernel
+
+
+def test_get_taper_window():
+    window = kc.get_taper_window(1000, 2.0, taper_type="hann",
+                                 taper_percentage=0.05)
+    assert len(window) == 1000
+    assert window[0] == 0.0
+    npt.assert_allclose(window[50:950], 1.0)
+    assert not window.flags.writeable
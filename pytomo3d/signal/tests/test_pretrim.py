@@ -0,0 +1,148 @@
+import os
+import inspect
+import numpy as np
+import numpy.testing as npt
+import pytest
+import obspy
+import pytomo3d.signal.pretrim as pt
+import pytomo3d.signal.process as proc
+from pytomo3d.utils.geodesic import GeometryTable
+
+
+def _upper_level(path, nlevel=4):
+    """
+    Go the nlevel dir up
+    """
+    for i in range(nlevel):
+        path = os.path.dirname(path)
+    return path
+
+
+# Most generic way to get the data folder path.
+TESTBASE_DIR = _upper_level(os.path.abspath(
+    inspect.getfile(inspect.currentframe())), 4)
+DATA_DIR = os.path.join(TESTBASE_DIR, "tests", "data")
+
+staxmlfile = os.path.join(DATA_DIR, "stationxml", "IU.KBL.xml")
+teststaxml = obspy.read_inventory(staxmlfile)
+testquakeml = os.path.join(DATA_DIR, "quakeml", "C201009031635A.xml")
+obsfile = os.path.join(DATA_DIR, "raw", "IU.KBL.obs.mseed")
+testobs = obspy.read(obsfile)
+
+
+def test_get_pretrim_window():
+    begin1, end1 = pt.get_pretrim_window(1000.0, 10.0, pre_padding=100.0,
+                                         post_padding=200.0)
+    begin2, end2 = pt.get_pretrim_window(5000.0, 10.0, pre_padding=100.0,
+                                         post_padding=200.0)
+    assert begin1 < begin2
+    npt.assert_allclose(end1, 1000.0 / 2.5 + 200.0)
+    npt.assert_allclose(end2, 5000.0 / 2.5 + 200.0)
+    # first P arrival at 1000 km is about 2 min
+    assert 0 < begin1 + 100.0 < 200.0
+
+    with pytest.raises(ValueError):
+        pt.get_pretrim_window(1000.0, 10.0, min_velocity=0.0)
+
+
+def test_pretrim_stream():
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+    t1 = origin.time
+    t2 = origin.time + 6000.0
+
+    st = pt.pretrim_stream(
+        testobs.copy(), teststaxml, origin.time, origin.latitude,
+        origin.longitude, origin.depth / 1000.0, starttime=t1, endtime=t2,
+        sampling_rate=2.0, post_padding=0.0)
+    for tr in st:
+        info = tr.stats.pretrim
+        assert info.starttime > t1
+        assert info.endtime < t2
+        assert info.starttime == t1 + info.offset_npts / 2.0
+        assert tr.stats.starttime <= info.starttime
+        assert tr.stats.endtime >= info.endtime
+
+    # the distance is taken from the geometry table
+    table = GeometryTable({}, {})
+    st_table = pt.pretrim_stream(
+        testobs.copy(), teststaxml, origin.time, origin.latitude,
+        origin.longitude, origin.depth / 1000.0, starttime=t1, endtime=t2,
+        sampling_rate=2.0, post_padding=0.0, geometry_table=table,
+        event_id="E1")
+    assert ("E1", "IU.KBL") in table
+    for tr, tr_table in zip(st, st_table):
+        assert tr_table.stats.pretrim == tr.stats.pretrim
+
+    with pytest.raises(ValueError):
+        pt.pretrim_stream(
+            testobs.copy(), teststaxml, origin.time, origin.latitude,
+            origin.longitude, origin.depth / 1000.0, geometry_table=table)
+
+
+def test_process_stream_pretrim():
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(
+        inventory=teststaxml, filter_flag=True, pre_filt=pre_filt,
+        remove_response_flag=True, starttime=origin.time,
+        endtime=origin.time + 6000.0, resample_flag=True,
+        sampling_rate=2.0, rotate_flag=True,
+        event_latitude=origin.latitude, event_longitude=origin.longitude)
+
+    st_ref = proc.process_stream(testobs.copy(), **kwargs)
+    st_new = proc.process_stream(
+        testobs.copy(), pretrim_flag=True, event_time=origin.time,
+        event_depth=origin.depth / 1000.0, **kwargs)
+    assert len(st_new) == len(st_ref)
+    for tr in st_new:
+        tr_ref = st_ref.select(id=tr.id)[0]
+        offset = tr.stats.pretrim.offset_npts
+        assert tr.stats.npts < tr_ref.stats.npts
+        assert tr.stats.starttime == \
+            tr_ref.stats.starttime + offset * tr.stats.delta
+        # away from the taper on both ends
+        data_ref = tr_ref.data[offset:(offset + tr.stats.npts)]
+        middle = slice(tr.stats.npts // 4, 3 * tr.stats.npts // 4)
+        npt.assert_allclose(tr.data[middle], data_ref[middle],
+                            atol=1e-4 * np.abs(tr_ref.data).max())
+
+    with pytest.raises(ValueError):
+        proc.process_stream(testobs.copy(), pretrim_flag=True, **kwargs)
+
+
+def test_process_stream_pretrim_no_starttime():
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    st = proc.process_stream(
+        testobs.copy(), inventory=teststaxml, resample_flag=True,
+        sampling_rate=2.0, pretrim_flag=True, event_time=origin.time,
+        event_depth=origin.depth / 1000.0, event_latitude=origin.latitude,
+        event_longitude=origin.longitude)
+    assert len(st) == len(testobs)
+    for tr in st:
+        info = tr.stats.pretrim
+        assert info.offset_npts == 0
+        assert info.reference == info.starttime
+        assert tr.stats.sampling_rate == 2.0
+        assert tr.stats.starttime == info.starttime
+        assert tr.stats.npts == info.npts
+
+
+def test_resample_pretrimmed_stream_drops_bad_trace():
+    st = testobs.copy()
+    for tr in st:
+        info = obspy.core.util.AttribDict()
+        info.starttime = tr.stats.starttime
+        info.npts = 100
+        tr.stats.pretrim = info
+    # window after the end of trace, which could not be interpolated
+    st[0].stats.pretrim.starttime = st[0].stats.endtime + 100.0
+
+    st_new = proc.resample_or_cut_pretrimmed_stream(
+        st, resample_flag=True, sampling_rate=1.0)
+    assert len(st_new) == len(testobs) - 1
+    assert testobs[0].id not in [tr.id for tr in st_new]
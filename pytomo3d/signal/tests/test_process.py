@@ -1,9 +1,12 @@
 import os
 import inspect
 import numpy as np
+import numpy.testing as npt
 import pytest
 import obspy
 import pytomo3d.signal.process as proc
+from pytomo3d.utils.fft import fft_backend
+from pytomo3d.signal.sanity_registry import SanityRegistry
 from copy import deepcopy
 
 
@@ -101,6 +104,84 @@ def test_filter_trace():
     assert len(tr.data) == len(st[0].data)
 
 
+def test_group_traces_by_grid():
+    st = testsyn.copy()
+    st[0].data = st[0].data[:100]
+    groups = proc.group_traces_by_grid(st)
+    assert len(groups) == 2
+    npts = testsyn[1].stats.npts
+    delta = testsyn[1].stats.delta
+    assert len(groups[(npts, delta)]) == len(st) - 1
+    assert len(groups[(100, delta)]) == 1
+
+
+def test_filter_stream_batch():
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    st = testsyn.copy()
+    st += testobs.copy()
+
+    st_trace = st.copy()
+    proc.filter_stream(st_trace, pre_filt)
+    st_batch = st.copy()
+    proc.filter_stream(st_batch, pre_filt, batch_flag=True)
+
+    for tr1, tr2 in zip(st_trace, st_batch):
+        assert tr1.id == tr2.id
+        npt.assert_allclose(tr1.data, tr2.data, rtol=1e-10,
+                            atol=1e-10 * np.abs(tr1.data).max())
+
+    with pytest.raises(ValueError):
+        proc.filter_stream(st, pre_filt[:3], batch_flag=True)
+
+
+def test_filter_trace_overlap_save():
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    np.random.seed(0)
+    tr = obspy.Trace(np.random.randn(100000))
+    tr.stats.delta = 1.0
+
+    tr_ref = tr.copy()
+    proc.filter_trace(tr_ref, pre_filt)
+    tr_new = tr.copy()
+    proc.filter_trace(tr_new, pre_filt, block_size=2**14)
+    assert tr_new.stats.npts == tr_ref.stats.npts
+    # truncated impulse response, error of order sqrt(tol) of peak
+    npt.assert_allclose(tr_new.data, tr_ref.data,
+                        atol=2e-5 * np.abs(tr_ref.data).max())
+    data = proc.overlap_save_filter_array(tr.data, 1.0, pre_filt, 2**16,
+                                          tol=1e-12)
+    npt.assert_allclose(data, tr_ref.data,
+                        atol=2e-6 * np.abs(tr_ref.data).max())
+
+    # short trace is filtered in one shot
+    st = obspy.Stream(traces=[tr.copy()])
+    proc.filter_stream(st, pre_filt, block_size=2**20)
+    npt.assert_allclose(st[0].data, tr_ref.data)
+
+    with pytest.raises(ValueError):
+        proc.filter_trace(tr.copy(), pre_filt, block_size=2**10)
+
+
+def test_detrend_and_taper_stream():
+    st = testsyn.copy()
+    st += testobs.copy()
+    # one trace on its own grid, processed by obspy
+    st[0].data = st[0].data[:1000]
+
+    st_ref = st.copy()
+    st_ref.detrend("linear")
+    st_ref.detrend("demean")
+    st_ref.taper(max_percentage=0.05, type="hann")
+
+    proc.detrend_and_taper_stream(st, taper_type="hann",
+                                  taper_percentage=0.05)
+    for tr, tr_ref in zip(st, st_ref):
+        assert tr.id == tr_ref.id
+        assert tr.data.dtype == tr_ref.data.dtype
+        npt.assert_allclose(tr.data, tr_ref.data, rtol=1e-7,
+                            atol=1e-7 * np.abs(tr_ref.data).max())
+
+
 def compare_stream_kernel(st1, st2):
     if len(st1) != len(st2):
         return False
@@ -204,3 +285,324 @@ def test_process_synt():
     bmfile = os.path.join(DATA_DIR, "proc", "IU.KBL.syn.proc.mseed")
     st_compare = obspy.read(bmfile)
     assert compare_stream_kernel(st_new, st_compare)
+
+
+def test_process_stream_multiband():
+    inv = deepcopy(teststaxml)
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    pre_filt_list = [[1/90., 1/60., 1/27.0, 1/22.5],
+                     [1/150., 1/120., 1/60., 1/50.]]
+    kwargs = dict(
+        inventory=inv, water_level=60, starttime=origin.time,
+        endtime=origin.time + 6000.0, resample_flag=True,
+        sampling_rate=2.0, taper_type="hann", taper_percentage=0.05,
+        rotate_flag=True, event_latitude=origin.latitude,
+        event_longitude=origin.longitude)
+
+    for st, remove_response_flag in [(testobs, True), (testsyn, False)]:
+        results = proc.process_stream_multiband(
+            st.copy(), pre_filt_list,
+            remove_response_flag=remove_response_flag, **kwargs)
+        assert len(results) == len(pre_filt_list)
+        for pre_filt, st_band in zip(pre_filt_list, results):
+            st_ref = proc.process_stream(
+                st.copy(), filter_flag=True, pre_filt=pre_filt,
+                remove_response_flag=remove_response_flag, **kwargs)
+            assert len(st_band) == len(st_ref)
+            for tr_ref in st_ref:
+                tr = st_band.select(id=tr_ref.id)[0]
+                assert tr.stats.starttime == tr_ref.stats.starttime
+                assert tr.stats.npts == tr_ref.stats.npts
+                npt.assert_allclose(tr.data, tr_ref.data, rtol=1e-10,
+                                    atol=1e-10 * np.abs(tr_ref.data).max())
+
+    # non-default options are forwarded to the shared steps
+    registry = SanityRegistry()
+    for options in [dict(dtype="float32", resample_mode="polyphase",
+                         sanity_check=True, sanity_registry=registry),
+                    dict(auto_resample_flag=True, oversampling_factor=2.0)]:
+        _kwargs = dict(kwargs, **options)
+        results = proc.process_stream_multiband(
+            testobs.copy(), pre_filt_list, remove_response_flag=True,
+            **_kwargs)
+        for pre_filt, st_band in zip(pre_filt_list, results):
+            st_ref = proc.process_stream(
+                testobs.copy(), filter_flag=True, pre_filt=pre_filt,
+                remove_response_flag=True, **_kwargs)
+            assert len(st_band) == len(st_ref) == 3
+            for tr_ref in st_ref:
+                tr = st_band.select(id=tr_ref.id)[0]
+                assert tr.data.dtype == tr_ref.data.dtype
+                assert tr.stats.sampling_rate == tr_ref.stats.sampling_rate
+                assert tr.stats.processing[-1] == \
+                    tr_ref.stats.processing[-1]
+                npt.assert_allclose(tr.data, tr_ref.data,
+                                    atol=1e-6 * np.abs(tr_ref.data).max())
+    assert registry.hits > 0
+
+    # spectral resampling is done band by band
+    kwargs.update(dict(resample_mode="spectral"))
+    results = proc.process_stream_multiband(
+        testsyn.copy(), pre_filt_list, **kwargs)
+    for pre_filt, st_band in zip(pre_filt_list, results):
+        st_ref = proc.process_stream(
+            testsyn.copy(), filter_flag=True, pre_filt=pre_filt, **kwargs)
+        for tr_ref in st_ref:
+            tr = st_band.select(id=tr_ref.id)[0]
+            npt.assert_array_equal(tr.data, tr_ref.data)
+
+    with pytest.raises(ValueError):
+        proc.process_stream_multiband(testsyn.copy(), [])
+    with pytest.raises(ValueError):
+        proc.process_stream_multiband(testobs.copy(), pre_filt_list,
+                                      remove_response_flag=True)
+
+
+def test_get_spectral_resample_nfft():
+    nfft, nfft_out = proc.get_spectral_resample_nfft(1000, 0.025, 0.5)
+    assert nfft >= 2000
+    assert nfft % 40 == 0
+    assert nfft_out * 20 == nfft
+
+    # upsampling
+    nfft, nfft_out = proc.get_spectral_resample_nfft(1000, 1.0, 0.5)
+    assert nfft_out == 2 * nfft
+
+    assert proc.get_spectral_resample_nfft(1000, 1.0, np.pi) is None
+
+
+def test_process_stream_spectral_resample():
+    inv = deepcopy(teststaxml)
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(
+        inventory=inv, filter_flag=True, pre_filt=pre_filt,
+        starttime=origin.time, endtime=origin.time + 6000.0,
+        resample_flag=True, sampling_rate=2.0, rotate_flag=True,
+        event_latitude=origin.latitude, event_longitude=origin.longitude)
+
+    for st, remove_response_flag in [(testobs, True), (testsyn, False)]:
+        st_ref = proc.process_stream(
+            st.copy(), remove_response_flag=remove_response_flag, **kwargs)
+        st_new = proc.process_stream(
+            st.copy(), remove_response_flag=remove_response_flag,
+            resample_mode="spectral", **kwargs)
+        assert len(st_new) == len(st_ref)
+        for tr_ref in st_ref:
+            tr = st_new.select(id=tr_ref.id)[0]
+            assert tr.stats.starttime == tr_ref.stats.starttime
+            assert tr.stats.sampling_rate == tr_ref.stats.sampling_rate
+            assert tr.stats.npts == tr_ref.stats.npts
+            npt.assert_allclose(tr.data, tr_ref.data,
+                                atol=1e-3 * np.abs(tr_ref.data).max())
+
+    with pytest.raises(ValueError):
+        proc.process_stream(testsyn.copy(), resample_flag=True,
+                            resample_mode="spectral")
+    with pytest.raises(ValueError):
+        proc.process_stream(testsyn.copy(), resample_mode="fourier")
+
+
+def test_process_stream_parallel():
+    inv = deepcopy(teststaxml)
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    # add another station with the same data and a copied inventory
+    inv_2 = deepcopy(teststaxml)
+    inv_2[0][0].code = "KBL2"
+    inv += inv_2
+    st = testobs.copy()
+    st_2 = testobs.copy()
+    for tr in st_2:
+        tr.stats.station = "KBL2"
+    st += st_2
+    # a station without inventory, which fails
+    st_bad = testobs.copy()
+    for tr in st_bad:
+        tr.stats.station = "BAD"
+    st += st_bad
+
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(
+        remove_response_flag=True, water_level=60, filter_flag=True,
+        pre_filt=pre_filt, starttime=origin.time,
+        endtime=origin.time + 6000.0, resample_flag=True,
+        sampling_rate=2.0, rotate_flag=True,
+        event_latitude=origin.latitude, event_longitude=origin.longitude)
+
+    errors = []
+    st_new = proc.process_stream_parallel(st, inventory=inv, n_workers=2,
+                                          errors=errors, **kwargs)
+    assert [tr.stats.station for tr in st_new] == ["KBL"] * 3 + ["KBL2"] * 3
+    assert [e[0] for e in errors] == ["IU.BAD..BH"]
+
+    errors_serial = []
+    st_serial = proc.process_stream_parallel(st, inventory=inv,
+                                             n_workers=1,
+                                             errors=errors_serial, **kwargs)
+    assert [tr.id for tr in st_serial] == [tr.id for tr in st_new]
+    assert errors_serial == errors
+
+    # without errors list, the failure is raised
+    for n_workers in [1, 2]:
+        with pytest.raises(ValueError):
+            proc.process_stream_parallel(st, inventory=inv,
+                                         n_workers=n_workers, **kwargs)
+
+    bmfile = os.path.join(DATA_DIR, "proc", "IU.KBL.obs.proc.mseed")
+    st_compare = obspy.read(bmfile)
+    assert compare_stream_kernel(st_new.select(station="KBL"), st_compare)
+    for tr in st_new.select(station="KBL2"):
+        tr.stats.station = "KBL"
+        assert compare_trace_kernel(tr, st_compare.select(id=tr.id)[0])
+
+
+def test_process_stream_float32():
+    inv = deepcopy(teststaxml)
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(
+        inventory=inv, filter_flag=True, pre_filt=pre_filt,
+        remove_response_flag=True, starttime=origin.time,
+        endtime=origin.time + 6000.0, resample_flag=True,
+        sampling_rate=2.0, rotate_flag=True,
+        event_latitude=origin.latitude, event_longitude=origin.longitude)
+
+    for mode in ["interpolate", "spectral", "polyphase"]:
+        st_ref = proc.process_stream(testobs.copy(), resample_mode=mode,
+                                     **kwargs)
+        st_new = proc.process_stream(testobs.copy(), dtype="float32",
+                                     resample_mode=mode, **kwargs)
+        assert len(st_new) == len(st_ref)
+        for tr_ref in st_ref:
+            tr = st_new.select(id=tr_ref.id)[0]
+            assert tr.data.dtype == np.float32
+            npt.assert_allclose(tr.data, tr_ref.data,
+                                atol=1e-5 * np.abs(tr_ref.data).max())
+
+    with pytest.raises(ValueError):
+        proc.process_stream(testobs.copy(), dtype="float16")
+
+
+def test_filter_stream_float32():
+    st = testsyn.copy()
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    st_ref = st.copy()
+    proc.filter_stream(st_ref, pre_filt, batch_flag=True)
+    proc.filter_stream(st, pre_filt, batch_flag=True, dtype=np.float32)
+    for tr, tr_ref in zip(st, st_ref):
+        assert tr.data.dtype == np.float32
+        npt.assert_allclose(tr.data, tr_ref.data,
+                            atol=1e-4 * np.abs(tr_ref.data).max())
+
+
+def test_cached_process_stream(tmpdir):
+    from pytomo3d.utils.cache import ResultCache
+    cache = ResultCache(str(tmpdir))
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(filter_flag=True, pre_filt=pre_filt)
+
+    st_ref = proc.process_stream(testsyn.copy(), **kwargs)
+    st1 = proc.cached_process_stream(testsyn.copy(), cache, **kwargs)
+    st2 = proc.cached_process_stream(testsyn.copy(), cache, **kwargs)
+    assert cache.misses == 1
+    assert cache.hits == 1
+    for tr1, tr2, tr_ref in zip(st1, st2, st_ref):
+        npt.assert_allclose(tr1.data, tr_ref.data)
+        npt.assert_allclose(tr2.data, tr_ref.data)
+
+
+def test_process_stream_remove_response_fft_backend():
+    pytest.importorskip("scipy.fft")
+    inv = deepcopy(teststaxml)
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(inventory=inv, remove_response_flag=True,
+                  filter_flag=True, pre_filt=pre_filt)
+
+    st_ref = proc.process_stream(testobs.copy(), **kwargs)
+    with fft_backend("scipy", workers=2):
+        st = proc.process_stream(testobs.copy(), **kwargs)
+    assert len(st) == len(st_ref)
+    for tr, tr_ref in zip(st, st_ref):
+        npt.assert_allclose(tr.data, tr_ref.data,
+                            atol=1e-10 * np.abs(tr_ref.data).max())
+
+
+def test_process_pair():
+    inv = deepcopy(teststaxml)
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(
+        inventory=inv, filter_flag=True, pre_filt=pre_filt,
+        starttime=origin.time, endtime=origin.time + 6000.0,
+        sampling_rate=2.0, rotate_flag=True,
+        event_latitude=origin.latitude, event_longitude=origin.longitude)
+    obsd_kwargs = {"remove_response_flag": True, "sanity_check": True}
+
+    obsd_ref = proc.process_stream(testobs.copy(), resample_flag=True,
+                                   **dict(kwargs, **obsd_kwargs))
+    synt_ref = proc.process_stream(testsyn.copy(), resample_flag=True,
+                                   **kwargs)
+
+    obsd, synt = proc.process_pair(testobs.copy(), testsyn.copy(),
+                                   obsd_kwargs=obsd_kwargs, **kwargs)
+    assert compare_stream_kernel(obsd, obsd_ref)
+    assert compare_stream_kernel(synt, synt_ref)
+    for obs_tr in obsd:
+        syn_tr = synt.select(component=obs_tr.stats.channel[-1])[0]
+        assert syn_tr.stats.starttime == obs_tr.stats.starttime
+        assert syn_tr.stats.npts == obs_tr.stats.npts
+
+    synt[0].stats.starttime += 1.0
+    with pytest.raises(ValueError):
+        proc._check_same_grid(obsd, synt)
+
+    with pytest.raises(ValueError):
+        proc.process_pair(testobs.copy(), testsyn.copy(), inventory=inv)
+    with pytest.raises(ValueError):
+        proc.process_pair(testobs.copy(), testsyn.copy(),
+                          resample_flag=False, **kwargs)
+
+
+def test_process_stream_auto_resample():
+    inv = deepcopy(teststaxml)
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    st_new = proc.process_stream(
+        testsyn.copy(), inventory=inv, filter_flag=True, pre_filt=pre_filt,
+        starttime=origin.time, endtime=origin.time + 6000.0,
+        rotate_flag=True, event_latitude=origin.latitude,
+        event_longitude=origin.longitude, auto_resample_flag=True,
+        oversampling_factor=4.0)
+    assert len(st_new) == 3
+    for tr in st_new:
+        assert tr.stats.sampling_rate == 0.4
+        assert tr.stats.npts == 2401
+        assert "auto resample" in tr.stats.processing[-1]
+
+    with pytest.raises(ValueError):
+        proc.process_stream(testsyn.copy(), auto_resample_flag=True)
+
+
+def test_process_stream_stf():
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    st_ref = testsyn.copy()
+    proc.convolve_stf_stream(st_ref, 10.0)
+    st_ref = proc.process_stream(st_ref, filter_flag=True,
+                                 pre_filt=pre_filt)
+    st_new = proc.process_stream(testsyn.copy(), filter_flag=True,
+                                 pre_filt=pre_filt, stf_half_duration=10.0)
+    for tr, tr_ref in zip(st_new, st_ref):
+        npt.assert_allclose(tr.data, tr_ref.data,
+                            atol=1e-5 * np.abs(tr_ref.data).max())
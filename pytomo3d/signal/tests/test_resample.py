@@ -0,0 +1,128 @@
+import os
+import inspect
+import numpy as np
+import numpy.testing as npt
+import pytest
+import obspy
+import pytomo3d.signal.resample as rs
+import pytomo3d.signal.process as proc
+
+
+def _upper_level(path, nlevel=4):
+    """
+    Go the nlevel dir up
+    """
+    for i in range(nlevel):
+        path = os.path.dirname(path)
+    return path
+
+
+# Most generic way to get the data folder path.
+TESTBASE_DIR = _upper_level(os.path.abspath(
+    inspect.getfile(inspect.currentframe())), 4)
+DATA_DIR = os.path.join(TESTBASE_DIR, "tests", "data")
+
+obsfile = os.path.join(DATA_DIR, "raw", "IU.KBL.obs.mseed")
+testobs = obspy.read(obsfile)
+
+
+def _sine_trace(sampling_rate=20.0, npts=4000, freq=0.05):
+    times = np.arange(npts) / sampling_rate
+    data = np.sin(2 * np.pi * freq * times)
+    return obspy.Trace(data=data, header={
+        "sampling_rate": sampling_rate,
+        "starttime": obspy.UTCDateTime(2000, 1, 1)})
+
+
+def test_get_resample_ratio():
+    assert rs.get_resample_ratio(20.0, 1.0) == (1, 20)
+    assert rs.get_resample_ratio(40.0, 2.0) == (1, 20)
+    assert rs.get_resample_ratio(1.0, 2.0) == (2, 1)
+    assert rs.get_resample_ratio(6.0, 4.0) == (2, 3)
+    assert rs.get_resample_ratio(1.0, np.pi) is None
+
+
+def test_polyphase_resample_trace():
+    tr = _sine_trace()
+    t0 = tr.stats.starttime
+    starttime = t0 + 10.0
+    assert rs.polyphase_resample_trace(tr, 1.0, starttime=starttime,
+                                       npts=150)
+    assert tr.stats.sampling_rate == 1.0
+    assert tr.stats.starttime == starttime
+    assert tr.stats.npts == 150
+    times = 10.0 + np.arange(150)
+    npt.assert_allclose(tr.data, np.sin(2 * np.pi * 0.05 * times),
+                        atol=5e-3)
+
+    # starttime not on the new grid
+    tr = _sine_trace()
+    starttime = t0 + 10.3
+    rs.polyphase_resample_trace(tr, 1.0, starttime=starttime, npts=150)
+    assert tr.stats.starttime == starttime
+    times = 10.3 + np.arange(150)
+    npt.assert_allclose(tr.data, np.sin(2 * np.pi * 0.05 * times),
+                        atol=5e-3)
+
+    # irrational ratio, trace not changed
+    tr = _sine_trace()
+    assert not rs.polyphase_resample_trace(tr, np.pi)
+    assert tr.stats.sampling_rate == 20.0
+
+    tr = _sine_trace()
+    with pytest.raises(ValueError):
+        rs.polyphase_resample_trace(tr, 1.0, starttime=t0 - 10.0)
+
+
+def test_resample_trace():
+    tr = _sine_trace()
+    rs.resample_trace(tr, np.pi, npts=100)
+    assert tr.stats.sampling_rate == np.pi
+    assert tr.stats.npts == 100
+
+    with pytest.raises(ValueError):
+        rs.resample_trace(tr, 1.0, method="linear")
+
+
+def test_interpolate_stream_polyphase():
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    st = testobs.copy()
+    proc.filter_stream(st, pre_filt)
+    starttime = st[0].stats.starttime + 100.0
+    npts = 3000
+
+    st_ref = proc.interpolate_stream(st.copy(), 2.0, starttime=starttime,
+                                     npts=npts)
+    st_new = proc.interpolate_stream(st.copy(), 2.0, starttime=starttime,
+                                     npts=npts, method="polyphase")
+    assert len(st_new) == len(st_ref)
+    for tr, tr_ref in zip(st_new, st_ref):
+        assert tr.id == tr_ref.id
+        assert tr.stats.starttime == tr_ref.stats.starttime
+        assert tr.stats.npts == tr_ref.stats.npts
+        npt.assert_allclose(tr.data, tr_ref.data,
+                            atol=1e-3 * np.abs(tr_ref.data).max())
+
+    # trace failed is thrown away
+    st = testobs.copy()
+    st[0].stats.starttime += 1000.0
+    st_new = proc.interpolate_stream(st, 2.0, starttime=starttime,
+                                     npts=npts, method="polyphase")
+    assert len(st_new) == 2
+
+
+def test_get_decimated_sampling_rate():
+    # Nyquist 0.18 Hz, delta 2.8125 s -> 2.5 s
+    npt.assert_allclose(
+        rs.get_decimated_sampling_rate(1/22.5, oversampling_factor=4.0),
+        0.4)
+    # 90-250 s band, delta 20 s
+    npt.assert_allclose(
+        rs.get_decimated_sampling_rate(1/80., oversampling_factor=2.0),
+        0.05)
+    npt.assert_allclose(rs.get_decimated_sampling_rate(1.0, 5.0), 10.0)
+
+    with pytest.raises(ValueError):
+        rs.get_decimated_sampling_rate(0.0)
+    with pytest.raises(ValueError):
+        rs.get_decimated_sampling_rate(0.1, oversampling_factor=0.5)
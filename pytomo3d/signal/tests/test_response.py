@@ -0,0 +1,137 @@
+import os
+import inspect
+from copy import deepcopy
+import numpy as np
+import numpy.testing as npt
+import obspy
+import pytomo3d.signal.response as resp
+import pytomo3d.signal.process as proc
+
+
+def _upper_level(path, nlevel=4):
+    """
+    Go the nlevel dir up
+    """
+    for i in range(nlevel):
+        path = os.path.dirname(path)
+    return path
+
+
+# Most generic way to get the data folder path.
+TESTBASE_DIR = _upper_level(os.path.abspath(
+    inspect.getfile(inspect.currentframe())), 4)
+DATA_DIR = os.path.join(TESTBASE_DIR, "tests", "data")
+
+staxmlfile = os.path.join(DATA_DIR, "stationxml", "IU.KBL.xml")
+teststaxml = obspy.read_inventory(staxmlfile)
+testquakeml = os.path.join(DATA_DIR, "quakeml", "C201009031635A.xml")
+obsfile = os.path.join(DATA_DIR, "raw", "IU.KBL.obs.mseed")
+testobs = obspy.read(obsfile)
+
+
+def test_response_fingerprint():
+    inv = deepcopy(teststaxml)
+    chan_z = inv.select(channel="BHZ")[0][0][0]
+    chan_e = inv.select(channel="BHE")[0][0][0]
+
+    fp_z = resp.response_fingerprint(chan_z.response)
+    assert fp_z == resp.response_fingerprint(deepcopy(chan_z.response))
+
+    # resource id does not change the fingerprint
+    response = deepcopy(chan_e.response)
+    response.response_stages[0].resource_id = "smi:local/test"
+    assert resp.response_fingerprint(response) == \
+        resp.response_fingerprint(chan_e.response)
+
+    # neither do names and descriptions
+    response.response_stages[0].name = "test"
+    response.response_stages[1].description = "test"
+    assert resp.response_fingerprint(response) == \
+        resp.response_fingerprint(chan_e.response)
+
+    response.response_stages[0].stage_gain *= 2
+    assert resp.response_fingerprint(response) != \
+        resp.response_fingerprint(chan_e.response)
+
+    # numeric values of stages
+    response = deepcopy(chan_e.response)
+    response.response_stages[0].poles[0] *= 1.0001
+    assert resp.response_fingerprint(response) != \
+        resp.response_fingerprint(chan_e.response)
+    response = deepcopy(chan_e.response)
+    response.response_stages[-1].decimation_factor = 2
+    assert resp.response_fingerprint(response) != \
+        resp.response_fingerprint(chan_e.response)
+
+
+def test_remove_response_stream():
+    inv = deepcopy(teststaxml)
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+
+    st_obspy = testobs.copy()
+    st_obspy.attach_response(inv)
+    st_obspy.remove_response(output="DISP", pre_filt=pre_filt,
+                             zero_mean=False, taper=False,
+                             water_level=60)
+
+    cache = resp.ResponseCache()
+    st = testobs.copy()
+    resp.remove_response_stream(st, inv, pre_filt=pre_filt,
+                                response_cache=cache)
+    # three channels share the same response stages
+    assert cache.misses == 1
+    assert cache.hits == len(st) - 1
+    for tr1, tr2 in zip(st, st_obspy):
+        npt.assert_allclose(tr1.data, tr2.data,
+                            atol=1e-10 * np.abs(tr2.data).max())
+
+    # second run only takes the spectrum from cache
+    st = testobs.copy()
+    resp.remove_response_stream(st, inv, pre_filt=pre_filt,
+                                response_cache=cache)
+    assert cache.misses == 1
+    assert cache.hits == 2 * len(st) - 1
+
+
+def test_response_cache_save_and_load(tmpdir):
+    inv = deepcopy(teststaxml)
+    cache = resp.ResponseCache()
+    st = testobs.copy()
+    resp.remove_response_stream(st, inv, response_cache=cache)
+
+    filename = os.path.join(str(tmpdir), "response_cache.npz")
+    cache.save(filename)
+
+    new_cache = resp.ResponseCache(filename)
+    assert len(new_cache) == len(cache)
+    st_new = testobs.copy()
+    resp.remove_response_stream(st_new, inv, response_cache=new_cache)
+    assert new_cache.misses == 0
+    assert new_cache.hits == len(st_new)
+    for tr1, tr2 in zip(st, st_new):
+        npt.assert_allclose(tr1.data, tr2.data)
+
+
+def test_process_stream_with_response_cache():
+    inv = deepcopy(teststaxml)
+    event = obspy.read_events(testquakeml)[0]
+    origin = event.preferred_origin() or event.origins[0]
+
+    pre_filt = [1/90., 1/60., 1/27.0, 1/22.5]
+    kwargs = dict(
+        remove_response_flag=True, water_level=60, inventory=inv,
+        filter_flag=True, pre_filt=pre_filt, starttime=origin.time,
+        endtime=origin.time + 6000.0, resample_flag=True,
+        sampling_rate=2.0, rotate_flag=True,
+        event_latitude=origin.latitude, event_longitude=origin.longitude)
+
+    cache = resp.ResponseCache()
+    st_new = proc.process_stream(testobs.copy(), response_cache=cache,
+                                 **kwargs)
+    bmfile = os.path.join(DATA_DIR, "proc", "IU.KBL.obs.proc.mseed")
+    st_compare = obspy.read(bmfile)
+    assert len(cache) == 1
+    assert len(st_new) == len(st_compare)
+    for tr in st_compare:
+        npt.assert_allclose(st_new.select(id=tr.id)[0].data, tr.data,
+                            rtol=1e-4, atol=1e-4 * np.abs(tr.data).max())
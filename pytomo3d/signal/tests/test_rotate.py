@@ -4,6 +4,7 @@ import pytest
 import numpy as np
 import numpy.testing as npt
 import pytomo3d.signal.rotate as rotate
+from pytomo3d.utils.geodesic import GeometryTable
 from obspy import read, read_inventory, Stream
 from copy import deepcopy
 
@@ -173,6 +174,21 @@ def test_rotate_12_rt_func():
     assert len(st) == 3
 
 
+def test_rotate_12_rt_func_view():
+    st = testobs.copy()
+    for tr in st:
+        tr.data = tr.data.astype(np.float64)
+    inv = deepcopy(teststaxml)
+    orig = {tr.id: tr.data.copy() for tr in st}
+    t0 = st[0].stats.starttime
+    st_slice = st.slice(t0, t0 + 100.0)
+    rotate.rotate_12_rt_func(st_slice, inv, 180.0, method="NE->RT")
+    assert len(st_slice.select(component="R")) == 1
+    # data of the parent stream is not touched
+    for tr in st:
+        npt.assert_array_equal(tr.data, orig[tr.id])
+
+
 def test_rotate_12_rt_func_2():
     st = testobs.copy()
     inv = deepcopy(teststaxml)
@@ -218,6 +234,55 @@ def test_sort_stream_by_station():
     assert len(sorted) == 1
 
 
+def test_sort_stream_by_station_options():
+    st = testsyn.copy()
+    st += testobs.copy()
+    st += read(small_mseed)
+
+    sorted = rotate.sort_stream_by_station(st)
+    assert list(sorted.keys()) == ["IU.KBL.S3.MX", "IU.KBL..BH",
+                                   "BW.RJOB..EH"]
+    for key, sta_st in sorted.items():
+        assert all(key.startswith(tr.id[:-4]) for tr in sta_st)
+    assert [tr.id for tr in sorted["IU.KBL..BH"]] == \
+        [tr.id for tr in testobs]
+
+    sorted = rotate.sort_stream_by_station(st, sort_keys=True)
+    assert list(sorted.keys()) == ["BW.RJOB..EH", "IU.KBL..BH",
+                                   "IU.KBL.S3.MX"]
+
+    st[0].stats.channel = "BHZ"
+    sorted = rotate.sort_stream_by_station(st, by_channel=False)
+    assert list(sorted.keys()) == ["IU.KBL.S3", "IU.KBL.", "BW.RJOB."]
+    assert len(sorted["IU.KBL.S3"]) == 3
+
+
+def test_sort_stream_by_station_index():
+    st = testsyn.copy()
+    st += testobs.copy()
+    st += read(small_mseed)
+
+    index = rotate.build_station_index(st)
+    assert list(index.keys()) == ["BW.RJOB..EH", "IU.KBL..BH",
+                                  "IU.KBL.S3.MX"]
+    assert sum(len(v) for v in index.values()) == len(st)
+
+    sorted_ref = rotate.sort_stream_by_station(st, sort_keys=True)
+    sorted = rotate.sort_stream_by_station(st, index=index)
+    assert list(sorted.keys()) == list(sorted_ref.keys())
+    for key in sorted:
+        assert [tr.id for tr in sorted[key]] == \
+            [tr.id for tr in sorted_ref[key]]
+
+    # index of another stream
+    with pytest.raises(ValueError):
+        rotate.sort_stream_by_station(testobs, index=index)
+    with pytest.raises(ValueError):
+        rotate.sort_stream_by_station(st[:-1], index=index)
+    with pytest.raises(ValueError):
+        rotate.sort_stream_by_station(st + st[:1], index=index)
+
+
 def test_rotate_one_station_stream_obsd():
     return
     obs = testobs.copy()
@@ -284,5 +349,95 @@ def test_rotate_stream():
     assert len(st_r.select(location="S3")) == 0
 
 
+def test_get_station_geometry():
+    inv = deepcopy(teststaxml)
+    geometry = rotate.get_station_geometry(
+        [testobs, testsyn], 0.0, 0.0, inv)
+    assert list(geometry.keys()) == ["IU.KBL"]
+    sta_lat, sta_lon = rotate.extract_station_location(testobs, inv)
+    baz = rotate.calculate_baz(0.0, 0.0, sta_lat, sta_lon)
+    assert geometry["IU.KBL"]["back_azimuth"] == baz
+
+    st_ref = rotate.rotate_stream(testobs.copy(), 0.0, 0.0, inv,
+                                  mode="ALL->RT")
+    st = rotate.rotate_stream(testobs.copy(), 0.0, 0.0, inv,
+                              mode="ALL->RT", station_geometry=geometry)
+    assert len(st) == len(st_ref)
+    for tr, tr_ref in zip(st, st_ref):
+        assert tr.id == tr_ref.id
+        npt.assert_allclose(tr.data, tr_ref.data)
+
+
+def test_get_station_geometry_with_table():
+    inv = deepcopy(teststaxml)
+    geometry_ref = rotate.get_station_geometry(
+        [testobs, testsyn], 0.0, 0.0, inv)
+
+    table = GeometryTable({"E0": (10.0, 10.0)}, {})
+    geometry = rotate.get_station_geometry(
+        [testobs, testsyn], 0.0, 0.0, inv, geometry_table=table,
+        event_id="E1")
+    assert ("E1", "IU.KBL") in table
+    assert table.shape == (2, 1)
+    npt.assert_allclose(geometry["IU.KBL"]["back_azimuth"],
+                        geometry_ref["IU.KBL"]["back_azimuth"])
+
+    # nothing is computed again for the same event and stations
+    assert table.update(events={"E1": (0.0, 0.0)}) == 0
+
+    with pytest.raises(ValueError):
+        rotate.get_station_geometry([testobs], 0.0, 0.0, inv,
+                                    geometry_table=table)
+
+
+def test_rotate_stream_inventory_index():
+    inv = deepcopy(teststaxml)
+    index = rotate.InventoryIndex(inv)
+    for st in [testobs, testsyn]:
+        for sanity_check in [False, True]:
+            st_ref = rotate.rotate_stream(st.copy(), 0.0, 0.0, inv,
+                                          mode="ALL->RT",
+                                          sanity_check=sanity_check)
+            st_new = rotate.rotate_stream(st.copy(), 0.0, 0.0, index,
+                                          mode="ALL->RT",
+                                          sanity_check=sanity_check)
+            assert len(st_new) == len(st_ref)
+            for tr, tr_ref in zip(st_new, st_ref):
+                assert tr.id == tr_ref.id
+                npt.assert_allclose(tr.data, tr_ref.data)
+
+
+def test_rotate_stream_batch():
+    inv = deepcopy(teststaxml)
+    for mode in ["NE->RT", "ALL->RT"]:
+        for sanity_check in [False, True]:
+            st = testobs.copy() + testsyn.copy()
+            st_ref = rotate.rotate_stream(st, 10.0, 20.0, inv, mode=mode,
+                                          sanity_check=sanity_check,
+                                          batch_flag=False)
+            st = testobs.copy() + testsyn.copy()
+            st_new = rotate.rotate_stream(st, 10.0, 20.0, inv, mode=mode,
+                                          sanity_check=sanity_check)
+            assert len(st_new) == len(st_ref)
+            for tr, tr_ref in zip(st_new, st_ref):
+                assert tr.id == tr_ref.id
+                npt.assert_allclose(tr.data, tr_ref.data)
+
+    # rotate back, which is used by the adjoint sources
+    st_rt = rotate.rotate_stream(testsyn.copy(), 10.0, 20.0, inv,
+                                 mode="NE->RT")
+    st_ref = rotate.rotate_stream(st_rt.copy(), 10.0, 20.0, inv,
+                                  mode="RT->NE", batch_flag=False)
+    st_new = rotate.rotate_stream(st_rt.copy(), 10.0, 20.0, inv,
+                                  mode="RT->NE")
+    assert len(st_new) == len(st_ref)
+    for tr, tr_ref in zip(st_new, st_ref):
+        assert tr.id == tr_ref.id
+        npt.assert_allclose(tr.data, tr_ref.data, atol=1e-12 *
+                            np.abs(tr_ref.data).max())
+        npt.assert_allclose(tr.data, testsyn.select(id=tr.id)[0].data,
+                            atol=1e-6 * np.abs(tr_ref.data).max())
+
+
 if __name__ == "__main__":
     test_rotate_stream()
@@ -2,6 +2,7 @@ import os
 import inspect
 import numpy as np
 import numpy.testing as npt
+import pytest
 import pytomo3d.signal.rotate_utils as rotate
 from obspy import read, read_inventory
 
@@ -197,3 +198,142 @@ def test_rotate_rt_and_12():
 
     npt.assert_allclose(r, r_new)
     npt.assert_allclose(t, t_new)
+
+
+def test_check_orthogonality_batch():
+    azi1 = [0, 90, 30, 360, 10, 0.005]
+    azi2 = [90, 0, 120, 90, 20, 270]
+    status = rotate.check_orthogonality_batch(azi1, azi2)
+    true_status = []
+    for a1, a2 in zip(azi1, azi2):
+        s = rotate.check_orthogonality(a1, a2)
+        if s == "left-hand":
+            true_status.append(rotate.LEFT_HAND)
+        elif s == "right-hand":
+            true_status.append(rotate.RIGHT_HAND)
+        else:
+            true_status.append(rotate.NOT_ORTHOGONAL)
+    npt.assert_array_equal(status, true_status)
+
+
+def test_rotate_12_rt_batch():
+    np.random.seed(0)
+    nsta = 5
+    d1 = np.random.randn(nsta, 20)
+    d2 = np.random.randn(nsta, 20)
+    baz = np.array([0, 45.0, 120.0, 240.0, 359.0])
+    # left-hand, right-hand, cross 360 and not orthogonal
+    azi1 = np.array([0, 90.0, 300.0, 30.0, 10.0])
+    azi2 = np.array([90, 0.0, 30.0, 120.0, 20.0])
+
+    r, t, valid = rotate.rotate_12_rt_batch(d1, d2, baz, azi1, azi2)
+    npt.assert_array_equal(valid, [True, True, True, True, False])
+    for i in range(nsta):
+        r_true, t_true = rotate.rotate_12_rt(d1[i], d2[i], baz[i],
+                                             azi1[i], azi2[i])
+        if r_true is None:
+            continue
+        npt.assert_allclose(r[i], r_true)
+        npt.assert_allclose(t[i], t_true)
+
+    r, t, _ = rotate.rotate_12_rt_batch(
+        d1.astype(np.float32), d2.astype(np.float32), baz, azi1, azi2)
+    assert r.dtype == np.float32 and t.dtype == np.float32
+
+    with pytest.raises(ValueError):
+        rotate.rotate_12_rt_batch(d1, d2, baz + 10, azi1, azi2)
+    with pytest.raises(ValueError):
+        rotate.rotate_12_rt_batch(d1, d2[:, :10], baz, azi1, azi2)
+
+
+def test_rotate_rt_ne_batch():
+    from obspy.signal.rotate import rotate_rt_ne
+    np.random.seed(1)
+    r = np.random.randn(3, 20)
+    t = np.random.randn(3, 20)
+    baz = np.array([10.0, 170.0, 300.0])
+    n, e = rotate.rotate_rt_ne_batch(r, t, baz)
+    for i in range(3):
+        n_true, e_true = rotate_rt_ne(r[i], t[i], baz[i])
+        npt.assert_allclose(n[i], n_true, atol=1e-12)
+        npt.assert_allclose(e[i], e_true, atol=1e-12)
+
+
+def test_rotate_certain_angle_inplace():
+    np.random.seed(2)
+    d1 = np.random.randn(100)
+    d2 = np.random.randn(100)
+    scratch = np.empty(100)
+    for angle in [0, 30.0, 95.0, 180.0, 250.0, -135.0]:
+        n1, n2 = rotate.rotate_certain_angle(d1, d2, angle)
+        o1, o2 = d1.copy(), d2.copy()
+        r1, r2 = rotate.rotate_certain_angle_inplace(o1, o2, angle,
+                                                     scratch=scratch)
+        assert r1 is o1 and r2 is o2
+        npt.assert_array_equal(o1, n1)
+        npt.assert_array_equal(o2, n2)
+
+    # out arrays, float32 kept
+    d1_32 = d1.astype(np.float32)
+    d2_32 = d2.astype(np.float32)
+    out = (np.empty(100, dtype=np.float32), np.empty(100, dtype=np.float32))
+    n1, n2 = rotate.rotate_certain_angle(d1, d2, 130.0)
+    r1, r2 = rotate.rotate_certain_angle_inplace(d1_32, d2_32, 130.0,
+                                                 out=out)
+    assert r1 is out[0] and r1.dtype == np.float32
+    npt.assert_allclose(r1, n1, atol=1e-5)
+    npt.assert_allclose(r2, n2, atol=1e-5)
+    npt.assert_array_equal(d1_32, d1.astype(np.float32))
+
+    with pytest.raises(TypeError):
+        rotate.rotate_certain_angle_inplace(np.arange(10), np.arange(10), 30)
+    with pytest.raises(ValueError):
+        rotate.rotate_certain_angle_inplace(d1.copy(), d2.copy(), 30,
+                                            scratch=np.empty(10))
+
+
+def test_rotate_inplace_directions():
+    np.random.seed(3)
+    d1 = np.random.randn(50)
+    d2 = np.random.randn(50)
+    baz = 240.0
+    # left-hand and right-hand components
+    for azi1, azi2 in [(30.0, 120.0), (120.0, 30.0)]:
+        r, t = rotate.rotate_12_rt(d1, d2, baz, azi1, azi2)
+        r_new, t_new = rotate.rotate_12_rt_inplace(d1.copy(), d2.copy(),
+                                                   baz, azi1, azi2)
+        npt.assert_allclose(r_new, r, atol=1e-13)
+        npt.assert_allclose(t_new, t, atol=1e-13)
+        out = (np.empty(50), np.empty(50))
+        r_new, t_new = rotate.rotate_12_rt_inplace(d1, d2, baz, azi1, azi2,
+                                                   out=out)
+        assert r_new is out[0]
+        npt.assert_allclose(r_new, r, atol=1e-13)
+
+        x1, x2 = rotate.rotate_rt_12(r, t, baz, azi1, azi2)
+        x1_new, x2_new = rotate.rotate_rt_12_inplace(r.copy(), t.copy(),
+                                                     baz, azi1, azi2)
+        npt.assert_allclose(x1_new, x1, atol=1e-13)
+        npt.assert_allclose(x2_new, x2, atol=1e-13)
+        out = (np.empty(50), np.empty(50))
+        x1_new, _ = rotate.rotate_rt_12_inplace(r, t, baz, azi1, azi2,
+                                                out=out)
+        assert x1_new is out[0]
+        npt.assert_allclose(x1_new, d1, atol=1e-13)
+
+        n, e = rotate.rotate_12_ne(d1, d2, azi1, azi2)
+        n_new, e_new = rotate.rotate_12_ne_inplace(d1.copy(), d2.copy(),
+                                                   azi1, azi2)
+        npt.assert_allclose(n_new, n, atol=1e-13)
+        npt.assert_allclose(e_new, e, atol=1e-13)
+        x1_new, x2_new = rotate.rotate_ne_12_inplace(n_new, e_new,
+                                                     azi1, azi2)
+        npt.assert_allclose(x1_new, d1, atol=1e-13)
+        npt.assert_allclose(x2_new, d2, atol=1e-13)
+
+    assert rotate.rotate_12_rt_inplace(d1, d2, baz, 10, 20) == (None, None)
+    n, e = rotate.rotate_rt_ne_inplace(d1.copy(), d2.copy(), baz)
+    n_true, e_true = rotate.rotate_rt_ne_batch(d1[None, :], d2[None, :],
+                                               [baz])
+    npt.assert_allclose(n, n_true[0])
+    npt.assert_allclose(e, e_true[0])
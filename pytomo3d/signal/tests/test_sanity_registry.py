@@ -0,0 +1,141 @@
+import os
+import inspect
+from copy import deepcopy
+import numpy.testing as npt
+import obspy
+from obspy import UTCDateTime
+import pytomo3d.signal.rotate as rotate
+from pytomo3d.signal.inventory_index import InventoryIndex
+from pytomo3d.signal.sanity_registry import SanityRegistry
+
+
+def _upper_level(path, nlevel=4):
+    """
+    Go the nlevel dir up
+    """
+    for i in range(nlevel):
+        path = os.path.dirname(path)
+    return path
+
+
+# Most generic way to get the data folder path.
+TESTBASE_DIR = _upper_level(os.path.abspath(
+    inspect.getfile(inspect.currentframe())), 4)
+DATA_DIR = os.path.join(TESTBASE_DIR, "tests", "data")
+
+staxmlfile = os.path.join(DATA_DIR, "stationxml", "IU.KBL.xml")
+teststaxml = obspy.read_inventory(staxmlfile)
+testobs = obspy.read(os.path.join(DATA_DIR, "raw", "IU.KBL.obs.mseed"))
+testsyn = obspy.read(os.path.join(DATA_DIR, "raw", "IU.KBL.syn.mseed"))
+
+
+def test_sanity_registry():
+    registry = SanityRegistry()
+    assert registry.get_vertical("IU.KBL..BHZ") is None
+    t1 = UTCDateTime(2000, 1, 1)
+    t2 = UTCDateTime(2010, 1, 1)
+    registry.set_vertical("IU.KBL..BHZ", (t1, t2), True)
+    registry.set_vertical("IU.KBL..BHZ", (t2, None), False)
+    assert registry.get_vertical("IU.KBL..BHZ", t1 + 10) is True
+    assert registry.get_vertical("IU.KBL..BHZ", t2 + 10) is False
+    assert registry.get_vertical("IU.KBL..BHZ", t1 - 10) is None
+    registry.set_horizontal("IU.KBL..BHN", "IU.KBL..BHE", (None, None),
+                            True)
+    assert registry.get_horizontal("IU.KBL..BHN", "IU.KBL..BHE", t1)
+    assert registry.get_horizontal("IU.KBL..BHE", "IU.KBL..BHN") is None
+    assert len(registry) == 3
+
+
+def test_sanity_registry_from_inventory(tmpdir):
+    registry = SanityRegistry.from_inventory(teststaxml)
+    assert len(registry) == 2
+    tr_z = testobs.select(component="Z")[0]
+    tr_n = testobs.select(component="N")[0]
+    tr_e = testobs.select(component="E")[0]
+    time = tr_z.stats.starttime
+    assert registry.get_vertical(tr_z.id, time) == \
+        rotate.check_vertical_inventory_sanity(tr_z, teststaxml)
+    assert registry.get_horizontal(tr_n.id, tr_e.id, time) == \
+        rotate.check_horizontal_inventory_sanity(tr_n, tr_e, teststaxml)
+
+    filename = str(tmpdir.join("sanity.json"))
+    registry.save(filename)
+    registry2 = SanityRegistry.load(filename)
+    assert registry2.to_dict() == registry.to_dict()
+    assert registry2.get_vertical(tr_z.id, time) == \
+        registry.get_vertical(tr_z.id, time)
+
+
+def test_check_sanity_with_registry():
+    registry = SanityRegistry()
+    tr_z = testobs.select(component="Z")[0]
+    tr_n = testobs.select(component="N")[0]
+    tr_e = testobs.select(component="E")[0]
+    for inv in [teststaxml, InventoryIndex(teststaxml)]:
+        registry.clear()
+        result = rotate.check_vertical_inventory_sanity(
+            tr_z, inv, sanity_registry=registry)
+        assert result == rotate.check_vertical_inventory_sanity(tr_z, inv)
+        assert registry.misses == 1
+        assert rotate.check_vertical_inventory_sanity(
+            tr_z, inv, sanity_registry=registry) == result
+        assert registry.hits == 1
+
+        result = rotate.check_horizontal_inventory_sanity(
+            tr_n, tr_e, inv, sanity_registry=registry)
+        assert result == rotate.check_horizontal_inventory_sanity(
+            tr_n, tr_e, inv)
+        assert rotate.check_horizontal_inventory_sanity(
+            tr_n, tr_e, inv, sanity_registry=registry) == result
+        assert registry.hits == 2
+        assert len(registry) == 2
+
+
+def test_rotate_stream_with_registry():
+    inv = deepcopy(teststaxml)
+    registry = SanityRegistry()
+    for _ in range(2):
+        st = testobs.copy() + testsyn.copy()
+        st_ref = rotate.rotate_stream(st, 10.0, 20.0, inv, mode="ALL->RT",
+                                      sanity_check=True)
+        st = testobs.copy() + testsyn.copy()
+        st_new = rotate.rotate_stream(st, 10.0, 20.0, inv, mode="ALL->RT",
+                                      sanity_check=True,
+                                      sanity_registry=registry)
+        assert len(st_new) == len(st_ref)
+        for tr, tr_ref in zip(st_new, st_ref):
+            assert tr.id == tr_ref.id
+            npt.assert_allclose(tr.data, tr_ref.data)
+    # the second event only takes results from registry
+    assert registry.hits == registry.misses
+
+
+def test_check_sanity_channel_epochs():
+    inv = deepcopy(teststaxml)
+    chan = inv[0][0].select(channel="BHZ")[0]
+    split = UTCDateTime(2008, 1, 1)
+    old_chan = deepcopy(chan)
+    old_chan.end_date = split
+    old_chan.dip = 0.0
+    chan.start_date = split
+    inv[0][0].channels.insert(0, old_chan)
+
+    tr_z = testobs.select(component="Z")[0]
+    for _inv in [inv, InventoryIndex(inv)]:
+        assert rotate.extract_channel_orientation(tr_z, _inv) == \
+            (-90.0, 0.0)
+        assert rotate.extract_channel_epoch(tr_z, _inv) == \
+            (split, chan.end_date)
+        registry = SanityRegistry()
+        assert rotate.check_vertical_inventory_sanity(
+            tr_z, _inv, sanity_registry=registry)
+        assert registry.get_vertical(tr_z.id, split - 10) is None
+
+    # no verdict is kept for channel not in inventory
+    tr = tr_z.copy()
+    tr.stats.location = "10"
+    registry = SanityRegistry()
+    assert rotate.extract_channel_epoch(tr, inv) is None
+    assert not rotate.check_vertical_inventory_sanity(
+        tr, inv, sanity_registry=registry)
+    assert len(registry) == 0
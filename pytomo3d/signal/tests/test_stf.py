@@ -0,0 +1,53 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+import obspy
+import pytomo3d.signal.stf as stf
+import pytomo3d.signal.process as proc
+
+
+def test_gaussian_stf():
+    delta = 0.1
+    times = np.arange(-500, 501) * delta
+    npt.assert_allclose(np.sum(stf.gaussian_stf(times, 5.0)) * delta, 1.0)
+
+
+def test_convolve_stf_array():
+    delta = 0.5
+    half_duration = 10.0
+    np.random.seed(0)
+    data = np.random.randn(2, 2000)
+
+    times = np.arange(-200, 201) * delta
+    source = stf.gaussian_stf(times, half_duration) * delta
+    conv = stf.convolve_stf_array(data, delta, half_duration)
+    assert conv.shape == data.shape
+    for _data, _conv in zip(data, conv):
+        npt.assert_allclose(_conv, np.convolve(_data, source, mode="same"),
+                            atol=1e-6)
+
+    conv = stf.convolve_stf_array(data[0].astype(np.float32), delta,
+                                  half_duration)
+    assert conv.dtype == np.float32
+
+
+def test_convolve_stf_stream():
+    np.random.seed(0)
+    st = obspy.Stream()
+    for chan in ["MXZ", "MXN", "MXE"]:
+        st.append(obspy.Trace(np.random.randn(1000), header={
+            "network": "IU", "station": "KBL", "location": "S3",
+            "channel": chan, "delta": 0.5}))
+    st_ref = st.copy()
+
+    proc.convolve_stf_stream(st, 5.0)
+    for tr, tr_ref in zip(st, st_ref):
+        npt.assert_allclose(tr.data,
+                            stf.convolve_stf_array(tr_ref.data, 0.5, 5.0))
+
+    st = st_ref.copy()
+    proc.convolve_stf_stream(st, 0.0)
+    npt.assert_allclose(st[0].data, st_ref[0].data)
+
+    with pytest.raises(ValueError):
+        proc.convolve_stf_stream(st, -1.0)
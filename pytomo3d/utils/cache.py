@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache for the results of pipeline stages,
+like processing, window selection and adjoint source calculation. The
+key of result is the hash of stage name, input data(trace data and
+stats) and the stage parameters, so rerunning a stage with unchanged
+inputs just loads the result from disk. The total size of cache
+directory is bounded and the least recently used results are evicted
+first.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (absolute_import, division, print_function)
+import os
+import hashlib
+import pickle
+import weakref
+import numpy as np
+from obspy.core.event import ResourceIdentifier
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+# bump it if the format of cached results changes
+CACHE_VERSION = 1
+
+_SCALAR_TYPES = (bool, int, float, complex, str, bytes, type(None))
+
+
+def _update_hash(hasher, obj, _seen):
+    if isinstance(obj, _SCALAR_TYPES) or isinstance(obj, np.generic):
+        hasher.update(("%s:%r;" % (type(obj).__name__, obj)).encode("utf-8"))
+    elif isinstance(obj, np.ndarray):
+        hasher.update(("ndarray:%s:%s;" % (obj.dtype.str, obj.shape))
+                      .encode("utf-8"))
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, ResourceIdentifier):
+        # resource ids are labels(could be random uuid generated on
+        # reading), not content
+        hasher.update(b"ResourceIdentifier;")
+    elif isinstance(obj, weakref.ref):
+        hasher.update(b"<weakref>;")
+    elif id(obj) in _seen:
+        # reference cycle
+        hasher.update(b"<cycle>;")
+    elif isinstance(obj, Mapping):
+        _seen.add(id(obj))
+        hasher.update(("%s{" % type(obj).__name__).encode("utf-8"))
+        for key in sorted(obj.keys(), key=repr):
+            _update_hash(hasher, key, _seen)
+            _update_hash(hasher, obj[key], _seen)
+        hasher.update(b"}")
+        _seen.discard(id(obj))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        _seen.add(id(obj))
+        if isinstance(obj, (set, frozenset)):
+            obj = sorted(obj, key=repr)
+        hasher.update(("%s[" % type(obj).__name__).encode("utf-8"))
+        for value in obj:
+            _update_hash(hasher, value, _seen)
+        hasher.update(b"]")
+        _seen.discard(id(obj))
+    elif callable(obj) and hasattr(obj, "__qualname__"):
+        hasher.update(("callable:%s.%s;" % (obj.__module__, obj.__qualname__))
+                      .encode("utf-8"))
+    elif hasattr(obj, "__dict__"):
+        # general objects, like obspy.Trace, obspy.Inventory and configs
+        _seen.add(id(obj))
+        hasher.update(("%s(" % type(obj).__name__).encode("utf-8"))
+        _update_hash(hasher, vars(obj), _seen)
+        hasher.update(b")")
+        _seen.discard(id(obj))
+    else:
+        hasher.update(("%s:%r;" % (type(obj).__name__, obj)).encode("utf-8"))
+
+
+def hash_content(*args, **kwargs):
+    """
+    Hash of the content of arguments. Arrays(like trace data) are hashed
+    by their bytes, and objects(like obspy.Stream, obspy.Inventory)
+    by their attributes, recursively. So two objects with the same
+    content give the same hash.
+
+    :return: hex digest string
+    """
+    hasher = hashlib.sha1()
+    _update_hash(hasher, (CACHE_VERSION, args, kwargs), set())
+    return hasher.hexdigest()
+
+
+class ResultCache(object):
+    """
+    On-disk cache of stage results. Each result is pickled into one
+    file in cache_dir, named by its key. The modification time of file
+    is updated on every hit, and when the total size of cache exceeds
+    max_size, the files with the oldest modification time are removed.
+
+    :param cache_dir: cache directory, created if not exists
+    :type cache_dir: str
+    :param max_size: maximum size of cache directory(unit: byte)
+    :type max_size: int
+    """
+
+    suffix = ".pkl"
+
+    def __init__(self, cache_dir, max_size=1024 ** 3):
+        if max_size <= 0:
+            raise ValueError("max_size of cache should be positive: %s"
+                             % max_size)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_key(self, stage, *args, **kwargs):
+        """
+        Key of a stage result, based on the stage name and the content
+        of its input arguments
+        """
+        return hash_content(stage, *args, **kwargs)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def _files(self):
+        files = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith(self.suffix):
+                continue
+            path = os.path.join(self.cache_dir, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len(self._files())
+
+    @property
+    def size(self):
+        """ Total size of cached results(unit: byte) """
+        return sum(f[1] for f in self._files())
+
+    def get(self, key, default=None):
+        """
+        Load the result of key from disk. Return default if not found.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                value = pickle.load(fh)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        # mark it as recently used
+        os.utime(path, None)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Save the result of key to disk, then evict the least recently
+        used results if the cache is over the size limit.
+        """
+        path = self._path(key)
+        tmpfile = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmpfile, "wb") as fh:
+            pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        # atomic, so other processes never read a partial file
+        os.rename(tmpfile, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used results until the total size is
+        no larger than max_size
+        """
+        files = sorted(self._files())
+        total = sum(f[1] for f in files)
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """ Remove all cached results and reset the statistics """
+        for _, _, path in self._files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, stage, func, args=(), kwargs=None, ignored_keys=()):
+        """
+        Return the cached result of func(*args, **kwargs). If it is not
+        in the cache, func is called and the result is saved.
+
+        :param stage: stage name, part of the key
+        :type stage: str
+        :param func: function to compute the result
+        :param args: positional arguments of func
+        :type args: tuple
+        :param kwargs: keyword arguments of func
+        :type kwargs: dict
+        :param ignored_keys: keyword arguments which do not change the
+            result(like a cache or verbose flag), so they are excluded
+            from the key
+        :type ignored_keys: list
+        """
+        if kwargs is None:
+            kwargs = {}
+        key_kwargs = dict((k, v) for k, v in kwargs.items()
+                          if k not in ignored_keys)
+        key = self.get_key(stage, *args, **key_kwargs)
+        value = self.get(key)
+        if value is None:
+            value = func(*args, **kwargs)
+            if value is not None:
+                self.put(key, value)
+        return value
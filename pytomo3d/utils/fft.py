@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FFT backend used by all the spectral routines in pytomo3d. The default
+backend is numpy. The "scipy" backend uses scipy.fft, which could run
+the transforms along multiple axes with several threads(workers). Both
+backends keep a cache of FFT plans internally, so transforms of the
+same length reuse the plan. The response removal in process_stream is
+done by obspy(with numpy FFT) by default, and goes through this
+backend if a response cache is given or the backend is not numpy.
+Polynomial responses are always removed by obspy.
+
+The backend could be set globally:
+    >>> set_fft_backend("scipy", workers=4)
+or temporarily, with the context manager:
+    >>> with fft_backend("scipy", workers=-1):
+    ...     process_stream(st, ...)
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (absolute_import, division, print_function)
+import numpy as np
+
+
+FFT_BACKENDS = ("numpy", "scipy")
+
+_config = {"backend": "numpy", "workers": None}
+
+
+def set_fft_backend(backend="numpy", workers=None):
+    """
+    Set the global FFT backend
+
+    :param backend: "numpy" or "scipy"
+    :type backend: str
+    :param workers: number of threads used in the scipy backend. Negative
+        value counts from the number of cpus, e.g., -1 means using all
+        cpus. None means single thread. Ignored by the numpy backend.
+    :type workers: int
+    """
+    if backend not in FFT_BACKENDS:
+        raise ValueError("FFT backend(%s) should be one of: %s"
+                         % (backend, FFT_BACKENDS))
+    if backend == "scipy":
+        # make sure scipy.fft is available
+        import scipy.fft  # NOQA
+    _config["backend"] = backend
+    _config["workers"] = workers
+
+
+def get_fft_backend():
+    """
+    Get the global FFT backend
+
+    :return: (backend, workers)
+    """
+    return _config["backend"], _config["workers"]
+
+
+class fft_backend(object):
+    """
+    Context manager which sets the FFT backend on enter and restores
+    the previous one on exit.
+    """
+
+    def __init__(self, backend="numpy", workers=None):
+        self.backend = backend
+        self.workers = workers
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = get_fft_backend()
+        set_fft_backend(self.backend, workers=self.workers)
+        return self
+
+    def __exit__(self, *args):
+        set_fft_backend(*self._previous)
+
+
+def rfft(a, n=None, axis=-1):
+    """
+    Real input FFT, the same as numpy.fft.rfft
+    """
+    if _config["backend"] == "scipy":
+        import scipy.fft
+        return scipy.fft.rfft(a, n=n, axis=axis, workers=_config["workers"])
+    return np.fft.rfft(a, n=n, axis=axis)
+
+
+def irfft(a, n=None, axis=-1):
+    """
+    Inverse of rfft, the same as numpy.fft.irfft
+    """
+    if _config["backend"] == "scipy":
+        import scipy.fft
+        return scipy.fft.irfft(a, n=n, axis=axis, workers=_config["workers"])
+    return np.fft.irfft(a, n=n, axis=axis)
+
+
+def next_fast_len(n):
+    """
+    Smallest length larger than or equal to n, which could be
+    factorized by 2, 3 and 5 only, so the real FFT is fast.
+    """
+    length = max(int(n), 1)
+    while True:
+        m = length
+        for factor in (2, 3, 5):
+            while m % factor == 0:
+                m //= factor
+        if m == 1:
+            return length
+        length += 1
+
+
+def correlate(a, b):
+    """
+    Cross-correlation of two 1-D arrays through FFT. The result is the
+    same as numpy.correlate(a, b, "full"), with lag from -(len(b) - 1)
+    to len(a) - 1.
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    na = len(a)
+    nb = len(b)
+    nfft = next_fast_len(na + nb - 1)
+    corr = irfft(rfft(a, n=nfft) * np.conj(rfft(b, n=nfft)), n=nfft)
+    return np.concatenate((corr[(nfft - nb + 1):], corr[:na]))
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Vectorized geodesic calculations: distance, azimuth and back azimuth
+between arrays of points, instead of one gps2dist_azimuth call for each
+pair. Two precision tiers are provided:
+    1) "sphere": great circle on a sphere, cheap, the same as
+        obspy.geodetics.locations2degrees
+    2) "ellipsoid": Vincenty's inverse formula on WGS84 ellipsoid, which
+        agrees with obspy.geodetics.gps2dist_azimuth. Nearly antipodal
+        points, where Vincenty does not converge, are passed to
+        gps2dist_azimuth.
+
+The event-station geometry could be kept in a GeometryTable, which is
+saved to a json file and reused in later runs and iterations, for
+example, by pytomo3d.signal.rotate.get_station_geometry to get the back
+azimuth for rotation.
+
+:copyright:
+    Wenjie Lei (lei@princeton.edu), 2016
+:license:
+    GNU Lesser General Public License, version 3 (LGPLv3)
+    (http://www.gnu.org/licenses/lgpl-3.0.en.html)
+"""
+from __future__ import (absolute_import, division, print_function)
+import numpy as np
+from obspy.geodetics import gps2dist_azimuth
+from .io import load_json, dump_json
+
+
+# the same as obspy.geodetics
+EARTH_RADIUS = 6371.0
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+GEODESIC_METHODS = ("sphere", "ellipsoid")
+
+
+def _as_radians(*values):
+    return [np.deg2rad(np.asarray(v, dtype=np.float64)) for v in values]
+
+
+def spherical_distance_azimuth(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance, azimuth and back azimuth between points on
+    sphere. Inputs are broadcast against each other. Unit is degree.
+
+    :return: (distance_in_degree, azimuth, back_azimuth). Azimuth is
+        from point 1 to point 2, and back azimuth from point 2 to
+        point 1, both in [0, 360).
+    """
+    lat1, lon1, lat2, lon2 = _as_radians(lat1, lon1, lat2, lon2)
+    dlon = lon2 - lon1
+    sin_dlon = np.sin(dlon)
+    cos_dlon = np.cos(dlon)
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_lat2, cos_lat2 = np.sin(lat2), np.cos(lat2)
+
+    # atan2 form, which is accurate for both small and large distance
+    x = cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_dlon
+    y = cos_lat2 * sin_dlon
+    dist = np.arctan2(np.hypot(x, y),
+                      sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_dlon)
+    az = np.arctan2(y, x)
+    baz = np.arctan2(-sin_dlon * cos_lat1,
+                     cos_lat2 * sin_lat1 - sin_lat2 * cos_lat1 * cos_dlon)
+    return (np.rad2deg(dist), np.rad2deg(az) % 360.0,
+            np.rad2deg(baz) % 360.0)
+
+
+def ellipsoidal_distance_azimuth(lat1, lon1, lat2, lon2, a=WGS84_A,
+                                 f=WGS84_F, max_iter=200, tol=1e-12):
+    """
+    Distance, azimuth and back azimuth between points on ellipsoid,
+    using Vincenty's inverse formula. Inputs are broadcast against each
+    other. The iteration is done on the whole arrays, and points which
+    already converged are kept fixed. Nearly antipodal points, for
+    which the iteration does not converge, are computed one by one with
+    obspy.geodetics.gps2dist_azimuth(geographiclib).
+
+    :param a: semi-major axis of ellipsoid(unit: m)
+    :type a: float
+    :param f: flattening of ellipsoid
+    :type f: float
+    :return: (distance_in_m, azimuth, back_azimuth), the same as
+        obspy.geodetics.gps2dist_azimuth
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *_as_radians(lat1, lon1, lat2, lon2))
+    b = a * (1 - f)
+    L = lon2 - lon1
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+
+    def _terms(lamb):
+        sin_lamb, cos_lamb = np.sin(lamb), np.cos(lamb)
+        sin_sigma = np.hypot(cos_U2 * sin_lamb,
+                             cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lamb)
+        cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lamb
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        # coincident points have sin_sigma of 0
+        sin_alpha = np.where(sin_sigma == 0, 0.0,
+                             cos_U1 * cos_U2 * sin_lamb / sin_sigma)
+        cos_sq_alpha = 1 - sin_alpha ** 2
+        # points on equator have cos_sq_alpha of 0
+        cos_2sigma_m = np.where(
+            cos_sq_alpha == 0, 0.0,
+            cos_sigma - 2 * sin_U1 * sin_U2 / cos_sq_alpha)
+        return (sin_lamb, cos_lamb, sin_sigma, cos_sigma, sigma, sin_alpha,
+                cos_sq_alpha, cos_2sigma_m)
+
+    lamb = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            _, _, sin_sigma, cos_sigma, sigma, sin_alpha, cos_sq_alpha, \
+                cos_2sigma_m = _terms(lamb)
+            C = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+            lamb_new = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (
+                    cos_2sigma_m + C * cos_sigma *
+                    (-1 + 2 * cos_2sigma_m ** 2)))
+            # points already converged are kept fixed
+            converged |= np.abs(lamb_new - lamb) < tol
+            lamb = np.where(converged, lamb, lamb_new)
+            if np.all(converged):
+                break
+        sin_lamb, cos_lamb, sin_sigma, cos_sigma, sigma, _, cos_sq_alpha, \
+            cos_2sigma_m = _terms(lamb)
+
+    u_sq = cos_sq_alpha * (a ** 2 - b ** 2) / b ** 2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (
+        cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) *
+            (-3 + 4 * cos_2sigma_m ** 2)))
+    dist = b * A * (sigma - delta_sigma)
+
+    az = np.arctan2(cos_U2 * sin_lamb,
+                    cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lamb)
+    baz = np.arctan2(cos_U1 * sin_lamb,
+                     -sin_U1 * cos_U2 + cos_U1 * sin_U2 * cos_lamb) + np.pi
+    az = np.rad2deg(az) % 360.0
+    baz = np.rad2deg(baz) % 360.0
+
+    if not np.all(converged):
+        # leave the nearly antipodal points to geographiclib
+        degs = [np.rad2deg(v) for v in (lat1, lon1, lat2, lon2)]
+        dist = np.array(dist, dtype=np.float64)
+        az = np.array(az, dtype=np.float64)
+        baz = np.array(baz, dtype=np.float64)
+        for idx in np.ndindex(converged.shape):
+            if converged[idx]:
+                continue
+            dist[idx], az[idx], baz[idx] = gps2dist_azimuth(
+                *[float(v[idx]) for v in degs], a=a, f=f)
+
+    return dist, az, baz
+
+
+def calculate_distance_azimuth(lat1, lon1, lat2, lon2, method="ellipsoid"):
+    """
+    Distance, azimuth and back azimuth between arrays of points, with
+    the given precision tier. Inputs are broadcast against each other,
+    so for example, one event against an array of stations.
+
+    :param method: "sphere" or "ellipsoid"
+    :type method: str
+    :return: (distance_in_km, azimuth, back_azimuth)
+    """
+    if method not in GEODESIC_METHODS:
+        raise ValueError("Geodesic method(%s) should be one of: %s"
+                         % (method, GEODESIC_METHODS))
+    if method == "sphere":
+        dist, az, baz = spherical_distance_azimuth(lat1, lon1, lat2, lon2)
+        return np.deg2rad(dist) * EARTH_RADIUS, az, baz
+    dist, az, baz = ellipsoidal_distance_azimuth(lat1, lon1, lat2, lon2)
+    return dist / 1000.0, az, baz
+
+
+def _locations_to_arrays(locations):
+    ids = sorted(locations.keys())
+    lats = np.array([float(locations[_id][0]) for _id in ids])
+    lons = np.array([float(locations[_id][1]) for _id in ids])
+    return ids, lats, lons
+
+
+class GeometryTable(object):
+    """
+    Table of event-station geometry, with distance(unit: km), distance
+    in degree(great circle), azimuth(event to station) and back
+    azimuth(station to event) of every event and station pair. It is
+    computed once for all pairs, as 2-D arrays of (nevent, nstation),
+    and could be saved to json file and loaded in later stages.
+
+    :param events: dict of event id to (latitude, longitude)
+    :type events: dict
+    :param stations: dict of station id, like "II.AAK", to
+        (latitude, longitude)
+    :type stations: dict
+    :param method: "sphere" or "ellipsoid", see
+        calculate_distance_azimuth
+    :type method: str
+    """
+
+    fields = ("distance", "distance_in_degree", "azimuth", "back_azimuth")
+
+    def __init__(self, events, stations, method="ellipsoid"):
+        if method not in GEODESIC_METHODS:
+            raise ValueError("Geodesic method(%s) should be one of: %s"
+                             % (method, GEODESIC_METHODS))
+        self.method = method
+        self.events = dict((k, tuple(float(x) for x in v))
+                           for k, v in events.items())
+        self.stations = dict((k, tuple(float(x) for x in v))
+                             for k, v in stations.items())
+        self._compute()
+
+    def _set_index(self):
+        self.event_ids, elats, elons = _locations_to_arrays(self.events)
+        self.station_ids, slats, slons = _locations_to_arrays(self.stations)
+        self._event_index = dict((k, i) for i, k in enumerate(self.event_ids))
+        self._station_index = dict((k, i)
+                                   for i, k in enumerate(self.station_ids))
+        return elats, elons, slats, slons
+
+    def _compute(self):
+        elats, elons, slats, slons = self._set_index()
+        elats = elats[:, np.newaxis]
+        elons = elons[:, np.newaxis]
+        self.distance, self.azimuth, self.back_azimuth = \
+            calculate_distance_azimuth(elats, elons, slats, slons,
+                                       method=self.method)
+        self.distance_in_degree, _, _ = spherical_distance_azimuth(
+            elats, elons, slats, slons)
+
+    def __contains__(self, key):
+        event_id, station_id = key
+        return event_id in self._event_index and \
+            station_id in self._station_index
+
+    @property
+    def shape(self):
+        return (len(self.event_ids), len(self.station_ids))
+
+    def _index(self, event_id, station_id):
+        try:
+            return (self._event_index[event_id],
+                    self._station_index[station_id])
+        except KeyError:
+            raise KeyError("(%s, %s) is not in the geometry table"
+                           % (event_id, station_id))
+
+    def get(self, event_id, station_id):
+        """
+        Geometry of event and station pair
+
+        :return: dict with keys of "distance", "distance_in_degree",
+            "azimuth" and "back_azimuth"
+        """
+        idx = self._index(event_id, station_id)
+        return dict((field, float(getattr(self, field)[idx]))
+                    for field in self.fields)
+
+    def get_back_azimuth(self, event_id, station_id):
+        return float(self.back_azimuth[self._index(event_id, station_id)])
+
+    def get_azimuth(self, event_id, station_id):
+        return float(self.azimuth[self._index(event_id, station_id)])
+
+    def get_distance(self, event_id, station_id, unit="km"):
+        """ Get distance, unit could be "km" or "degree" """
+        idx = self._index(event_id, station_id)
+        if unit == "km":
+            return float(self.distance[idx])
+        elif unit == "degree":
+            return float(self.distance_in_degree[idx])
+        raise ValueError("Unrecognized unit(%s): 1) km; 2) degree" % unit)
+
+    def update(self, events=None, stations=None):
+        """
+        Add new events and stations, or change their locations(like
+        the relocated events after source inversion). Only the rows
+        and columns of new or changed locations are computed.
+
+        :return: number of (event, station) pairs computed
+        """
+        new_events = dict(self.events)
+        new_stations = dict(self.stations)
+        for locations, new_locations in ((events, new_events),
+                                         (stations, new_stations)):
+            if locations is None:
+                continue
+            for k, v in locations.items():
+                new_locations[k] = tuple(float(x) for x in v)
+
+        changed_events = [k for k, v in new_events.items()
+                          if self.events.get(k) != v]
+        changed_stations = [k for k, v in new_stations.items()
+                            if self.stations.get(k) != v]
+        if len(changed_events) == 0 and len(changed_stations) == 0:
+            return 0
+
+        old = self._arrays()
+        old_event_index = self._event_index
+        old_station_index = self._station_index
+        self.events = new_events
+        self.stations = new_stations
+        elats, elons, slats, slons = self._set_index()
+
+        arrays = dict((field, np.zeros(self.shape)) for field in self.fields)
+        # copy the unchanged part
+        keep_e = [(i, old_event_index[k]) for i, k in
+                  enumerate(self.event_ids) if k not in changed_events]
+        keep_s = [(j, old_station_index[k]) for j, k in
+                  enumerate(self.station_ids) if k not in changed_stations]
+        if len(keep_e) > 0 and len(keep_s) > 0:
+            new_ie, old_ie = [np.array(x) for x in zip(*keep_e)]
+            new_is, old_is = [np.array(x) for x in zip(*keep_s)]
+            for field in self.fields:
+                arrays[field][np.ix_(new_ie, new_is)] = \
+                    old[field][np.ix_(old_ie, old_is)]
+
+        # compute the rows of changed events and columns of changed
+        # stations
+        ie = np.array([self._event_index[k] for k in changed_events],
+                      dtype=int)
+        js = np.array([self._station_index[k] for k in changed_stations],
+                      dtype=int)
+        ncomputed = 0
+        for rows, cols in ((ie, np.arange(self.shape[1])),
+                           (np.arange(self.shape[0]), js)):
+            if len(rows) == 0 or len(cols) == 0:
+                continue
+            grid = np.ix_(rows, cols)
+            lat1 = elats[rows][:, np.newaxis]
+            lon1 = elons[rows][:, np.newaxis]
+            dist, az, baz = calculate_distance_azimuth(
+                lat1, lon1, slats[cols], slons[cols], method=self.method)
+            dist_deg, _, _ = spherical_distance_azimuth(
+                lat1, lon1, slats[cols], slons[cols])
+            arrays["distance"][grid] = dist
+            arrays["azimuth"][grid] = az
+            arrays["back_azimuth"][grid] = baz
+            arrays["distance_in_degree"][grid] = dist_deg
+            ncomputed += dist.size
+
+        for field in self.fields:
+            setattr(self, field, arrays[field])
+        return ncomputed
+
+    def _arrays(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+    def to_dict(self):
+        content = {"method": self.method,
+                   "events": dict((k, list(v))
+                                  for k, v in self.events.items()),
+                   "stations": dict((k, list(v))
+                                    for k, v in self.stations.items()),
+                   "event_ids": self.event_ids,
+                   "station_ids": self.station_ids}
+        for field in self.fields:
+            content[field] = getattr(self, field).tolist()
+        return content
+
+    def save(self, filename):
+        """ Save the table to json file """
+        dump_json(self.to_dict(), filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load the table from json file, without computing again """
+        content = load_json(filename)
+        table = cls.__new__(cls)
+        table.method = content["method"]
+        table.events = dict((k, tuple(v))
+                            for k, v in content["events"].items())
+        table.stations = dict((k, tuple(v))
+                              for k, v in content["stations"].items())
+        table._set_index()
+        for field in cls.fields:
+            value = np.array(content[field], dtype=np.float64)
+            setattr(table, field, value.reshape(table.shape))
+        return table
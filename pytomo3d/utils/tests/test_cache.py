@@ -0,0 +1,66 @@
+import os
+import time
+import numpy as np
+import obspy
+import pytest
+from pytomo3d.utils.cache import ResultCache, hash_content
+
+
+def test_hash_content():
+    tr = obspy.Trace(np.arange(100, dtype=np.float64))
+    assert hash_content(tr) == hash_content(tr.copy())
+    assert hash_content(tr, a=1) != hash_content(tr, a=2)
+
+    tr2 = tr.copy()
+    tr2.data[0] = 1.0
+    assert hash_content(tr) != hash_content(tr2)
+    tr2 = tr.copy()
+    tr2.stats.station = "KBL"
+    assert hash_content(tr) != hash_content(tr2)
+
+
+def test_result_cache(tmpdir):
+    cache = ResultCache(str(tmpdir))
+    ncalls = []
+
+    def func(x, scale=1.0):
+        ncalls.append(1)
+        return x * scale
+
+    data = np.arange(10.0)
+    v1 = cache.call("scale", func, args=(data, ), kwargs={"scale": 2.0})
+    v2 = cache.call("scale", func, args=(data, ), kwargs={"scale": 2.0})
+    np.testing.assert_allclose(v1, v2)
+    assert len(ncalls) == 1
+    assert cache.hits == 1
+    assert len(cache) == 1
+
+    cache.call("scale", func, args=(data, ), kwargs={"scale": 3.0})
+    assert len(ncalls) == 2
+    assert len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0
+
+    with pytest.raises(ValueError):
+        ResultCache(str(tmpdir), max_size=0)
+
+
+def test_result_cache_eviction(tmpdir):
+    data = np.zeros(1000)
+    cache = ResultCache(str(tmpdir), max_size=20000)
+    for idx in range(3):
+        key = cache.get_key("stage", idx)
+        cache.put(key, data)
+        # make sure the modification time is different
+        past = time.time() - 100 + idx
+        os.utime(cache._path(key), (past, past))
+    assert len(cache) == 2
+    assert cache.get_key("stage", 0) not in cache
+    assert cache.size <= 20000
+
+    # touch the oldest so the other one is evicted
+    assert cache.get(cache.get_key("stage", 1)) is not None
+    cache.put(cache.get_key("stage", 3), data)
+    assert cache.get_key("stage", 1) in cache
+    assert cache.get_key("stage", 2) not in cache
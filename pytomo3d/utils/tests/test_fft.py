@@ -0,0 +1,45 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+import pytomo3d.utils.fft as fftpack
+
+
+def test_set_fft_backend():
+    assert fftpack.get_fft_backend() == ("numpy", None)
+    fftpack.set_fft_backend("scipy", workers=2)
+    assert fftpack.get_fft_backend() == ("scipy", 2)
+    fftpack.set_fft_backend()
+    assert fftpack.get_fft_backend() == ("numpy", None)
+
+    with pytest.raises(ValueError):
+        fftpack.set_fft_backend("fftw")
+
+
+def test_fft_backend_context():
+    data = np.random.randn(3, 1000)
+    ref = np.fft.rfft(data, n=1200)
+    with fftpack.fft_backend("scipy", workers=-1):
+        assert fftpack.get_fft_backend() == ("scipy", -1)
+        spectrum = fftpack.rfft(data, n=1200)
+        npt.assert_allclose(spectrum, ref, atol=1e-10)
+        npt.assert_allclose(fftpack.irfft(spectrum, n=1200)[:, :1000],
+                            data, atol=1e-10)
+    assert fftpack.get_fft_backend() == ("numpy", None)
+
+
+def test_next_fast_len():
+    assert fftpack.next_fast_len(1) == 1
+    assert fftpack.next_fast_len(7) == 8
+    assert fftpack.next_fast_len(1001) == 1024
+    assert fftpack.next_fast_len(961) == 972
+
+
+def test_correlate():
+    a = np.random.randn(100)
+    b = np.random.randn(37)
+    npt.assert_allclose(fftpack.correlate(a, b),
+                        np.correlate(a, b, "full"), atol=1e-10)
+    npt.assert_allclose(fftpack.correlate(b, a),
+                        np.correlate(b, a, "full"), atol=1e-10)
+    npt.assert_allclose(fftpack.correlate(a, a[:1]),
+                        np.correlate(a, a[:1], "full"), atol=1e-10)
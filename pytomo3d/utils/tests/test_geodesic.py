@@ -0,0 +1,127 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+from obspy.geodetics import gps2dist_azimuth, locations2degrees
+import pytomo3d.utils.geodesic as geodesic
+
+
+np.random.seed(10)
+LAT1 = np.random.uniform(-89, 89, 50)
+LON1 = np.random.uniform(-180, 180, 50)
+LAT2 = np.random.uniform(-89, 89, 50)
+LON2 = np.random.uniform(-180, 180, 50)
+
+
+def test_spherical_distance_azimuth():
+    dist, az, baz = geodesic.spherical_distance_azimuth(LAT1, LON1,
+                                                        LAT2, LON2)
+    npt.assert_allclose(dist, locations2degrees(LAT1, LON1, LAT2, LON2),
+                        atol=1e-8)
+    # swap the two points
+    dist2, az2, baz2 = geodesic.spherical_distance_azimuth(LAT2, LON2,
+                                                           LAT1, LON1)
+    npt.assert_allclose(dist, dist2)
+    npt.assert_allclose(az, baz2, atol=1e-8)
+    npt.assert_allclose(baz, az2, atol=1e-8)
+
+    _, az, baz = geodesic.spherical_distance_azimuth(0, 0, [10, 0], [0, 10])
+    npt.assert_allclose(az, [0, 90], atol=1e-8)
+    npt.assert_allclose(baz, [180, 270], atol=1e-8)
+
+
+def test_ellipsoidal_distance_azimuth():
+    dist, az, baz = geodesic.ellipsoidal_distance_azimuth(LAT1, LON1,
+                                                          LAT2, LON2)
+    for i in range(len(LAT1)):
+        dist_true, az_true, baz_true = gps2dist_azimuth(
+            LAT1[i], LON1[i], LAT2[i], LON2[i])
+        npt.assert_allclose(dist[i], dist_true, atol=1e-3)
+        npt.assert_allclose(az[i], az_true, atol=1e-6)
+        npt.assert_allclose(baz[i], baz_true, atol=1e-6)
+
+    # coincident and nearly antipodal points
+    dist, _, _ = geodesic.ellipsoidal_distance_azimuth(
+        [10, 0], [20, 0], [10, 0.5], [20, 179.7])
+    assert dist[0] == 0
+    assert 1.99e7 < dist[1] < 2.01e7
+
+
+def test_ellipsoidal_distance_azimuth_antipodal():
+    # Vincenty does not converge on these, and the spherical back
+    # azimuth is off by tens of degrees
+    lat1 = np.array([10.0, 5.0, 0.0])
+    lon1 = np.array([20.0, 0.0, 0.0])
+    lat2 = np.array([-10.0, -5.0, 0.5])
+    lon2 = np.array([-160.3, 179.9, 179.7])
+    dist, az, baz = geodesic.ellipsoidal_distance_azimuth(lat1, lon1,
+                                                          lat2, lon2)
+    for i in range(len(lat1)):
+        dist_true, az_true, baz_true = gps2dist_azimuth(
+            lat1[i], lon1[i], lat2[i], lon2[i])
+        npt.assert_allclose(dist[i], dist_true, atol=1e-3)
+        npt.assert_allclose(az[i], az_true, atol=1e-6)
+        npt.assert_allclose(baz[i], baz_true, atol=1e-6)
+
+    # scalar input
+    _, _, baz = geodesic.ellipsoidal_distance_azimuth(5.0, 0.0, -5.0, 179.9)
+    npt.assert_allclose(baz, gps2dist_azimuth(5.0, 0.0, -5.0, 179.9)[2],
+                        atol=1e-6)
+
+
+def test_calculate_distance_azimuth():
+    dist, az, baz = geodesic.calculate_distance_azimuth(
+        10.0, 20.0, LAT2, LON2, method="sphere")
+    assert dist.shape == (50, )
+    npt.assert_allclose(
+        dist, locations2degrees(10.0, 20.0, LAT2, LON2) * 6371 * np.pi / 180)
+
+    dist, _, _ = geodesic.calculate_distance_azimuth(
+        10.0, 20.0, LAT2, LON2, method="ellipsoid")
+    dist_true = [gps2dist_azimuth(10.0, 20.0, lat, lon)[0] / 1000.0
+                 for lat, lon in zip(LAT2, LON2)]
+    npt.assert_allclose(dist, dist_true, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        geodesic.calculate_distance_azimuth(0, 0, 1, 1, method="flat")
+
+
+def test_geometry_table(tmpdir):
+    events = {"E1": (10.0, 20.0), "E2": (-30.0, 150.0)}
+    stations = {"II.AAK": (42.6, 74.5), "IU.KBL": (34.5, 69.0),
+                "IU.ANMO": (34.9, -106.5)}
+    table = geodesic.GeometryTable(events, stations)
+    assert table.shape == (2, 3)
+    assert ("E1", "IU.KBL") in table
+    assert ("E3", "IU.KBL") not in table
+
+    dist, az, baz = gps2dist_azimuth(-30.0, 150.0, 34.9, -106.5)
+    geo = table.get("E2", "IU.ANMO")
+    npt.assert_allclose(geo["distance"], dist / 1000.0, atol=1e-6)
+    npt.assert_allclose(geo["azimuth"], az, atol=1e-6)
+    npt.assert_allclose(table.get_back_azimuth("E2", "IU.ANMO"), baz,
+                        atol=1e-6)
+    npt.assert_allclose(table.get_distance("E2", "IU.ANMO", unit="degree"),
+                        locations2degrees(-30.0, 150.0, 34.9, -106.5))
+    with pytest.raises(KeyError):
+        table.get("E3", "IU.KBL")
+
+    filename = str(tmpdir.join("geometry.json"))
+    table.save(filename)
+    table2 = geodesic.GeometryTable.load(filename)
+    assert table2.event_ids == table.event_ids
+    assert table2.station_ids == table.station_ids
+    for field in table.fields:
+        npt.assert_allclose(getattr(table2, field), getattr(table, field))
+
+    # relocated event and new station
+    assert table2.update() == 0
+    events["E1"] = (11.0, 21.0)
+    stations["IU.COLA"] = (64.9, -147.8)
+    ncomputed = table2.update(events={"E1": events["E1"]},
+                              stations={"IU.COLA": stations["IU.COLA"]})
+    assert ncomputed == 4 + 2
+    table_true = geodesic.GeometryTable(events, stations)
+    assert table2.station_ids == table_true.station_ids
+    for field in table.fields:
+        npt.assert_allclose(getattr(table2, field),
+                            getattr(table_true, field))
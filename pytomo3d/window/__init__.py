@@ -11,3 +11,4 @@
 from __future__ import (absolute_import, division, print_function)
 
 from .window import window_on_stream, window_on_trace  # NOQA
+from .window import cached_window_on_stream  # NOQA
@@ -2,13 +2,14 @@ import os
 import inspect
 import pytest
 import json
+import multiprocessing
 
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
 from obspy import read, read_inventory, read_events
-from pyflex import WindowSelector
+from pyflex import WindowSelector, Config
 from pyflex.window import Window
 import pytomo3d.window.window as win
 import pytomo3d.window.io as wio
@@ -168,6 +169,43 @@ def test_window_on_trace_with_none_user_levels():
         assert _win == _win_bm
 
 
+def test_build_trace_index():
+    syn = read(synfile)
+    index = win.build_trace_index(syn)
+
+    assert len(index) == len(syn)
+    for tr in syn:
+        key = (tr.stats.network, tr.stats.station, tr.stats.channel[-1])
+        assert index[key] is tr
+
+    # the first trace is kept for duplicated keys
+    syn2 = syn.copy()
+    for tr in syn2:
+        tr.stats.location = "S3"
+    index = win.build_trace_index(syn + syn2)
+    assert len(index) == len(syn)
+    for tr in syn:
+        key = (tr.stats.network, tr.stats.station, tr.stats.channel[-1])
+        assert index[key] is tr
+
+
+def test_window_on_stream_missing_synt(capsys):
+    obs_tr = read(obsfile)
+    syn_tr = read(synfile).select(component="Z")
+    syn_tr[0].stats.station = "XXX"
+
+    config = Config(min_period=27.0, max_period=60.0)
+    config_dict = {"Z": config, "R": config, "T": config}
+    windows = win.window_on_stream(obs_tr, syn_tr, config_dict)
+    assert windows == {}
+
+    out = capsys.readouterr()[0]
+    assert out.count("Couldn't find corresponding synt") == 1
+    assert "3 obsd traces" in out
+    for tr in obs_tr:
+        assert tr.id in out
+
+
 def test_window_on_stream():
     obs_tr = read(obsfile)
     syn_tr = read(synfile)
@@ -191,6 +229,87 @@ def test_window_on_stream():
     assert nwins == {"IU.KBL..BHR": 5, "IU.KBL..BHZ": 2, "IU.KBL..BHT": 4}
 
 
+def test_window_on_stream_parallel():
+    obs_tr = read(obsfile)
+    syn_tr = read(synfile)
+
+    config_file = os.path.join(DATA_DIR, "window", "27_60.BHZ.config.yaml")
+    config = wio.load_window_config_yaml(config_file)
+    config_dict = {"Z": config, "R": config, "T": config}
+
+    cat = read_events(quakeml)
+    inv = read_inventory(staxml)
+
+    windows = win.window_on_stream(obs_tr, syn_tr, config_dict, station=inv,
+                                   event=cat, _verbose=False,
+                                   figure_mode=False)
+    windows_parallel = win.window_on_stream(
+        obs_tr, syn_tr, config_dict, station=inv, event=cat,
+        _verbose=False, figure_mode=False, n_workers=2)
+
+    assert list(windows_parallel.keys()) == list(windows.keys())
+    for trace_id in windows:
+        assert windows_parallel[trace_id] == windows[trace_id]
+
+
+def test_window_on_stream_error_handling(capsys):
+    obs_tr = read(obsfile)
+    syn_tr = read(synfile)
+
+    config = Config(min_period=27.0, max_period=60.0)
+    config_dict = {"Z": config}
+    # the user module could not be imported, so window selection fails
+    user_modules = {"Z": "pytomo3d.window.tests.no_such_module"}
+
+    # raised in serial mode
+    with pytest.raises(Exception):
+        win.window_on_stream(obs_tr, syn_tr, config_dict,
+                             user_modules=user_modules)
+
+    # reported and skipped in the pool
+    windows = win.window_on_stream(obs_tr, syn_tr, config_dict,
+                                   user_modules=user_modules, n_workers=2)
+    assert windows == {}
+    assert "Error in window selection(IU.KBL..BHZ)" in capsys.readouterr()[0]
+
+
+def _fake_window_on_trace(obs_tr, syn_tr, config, **kwargs):
+    if obs_tr.stats.channel[-1] == "T":
+        raise ValueError("bad trace")
+    return [obs_tr.id, syn_tr.id, config.min_period, kwargs["user_module"]]
+
+
+def test_window_on_stream_pool(monkeypatch):
+    # workers see the patched function only if they are forked
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("start method of multiprocessing is not fork")
+    monkeypatch.setattr(win, "window_on_trace", _fake_window_on_trace)
+
+    obs_tr = read(obsfile)
+    syn_tr = read(synfile)
+    config = Config(min_period=27.0, max_period=60.0)
+    config_dict = {"Z": config, "R": config}
+    user_modules = {"R": "user_module_R"}
+
+    windows = win.window_on_stream(obs_tr, syn_tr, config_dict,
+                                   user_modules=user_modules)
+    assert list(windows.keys()) == ["IU.KBL..BHZ", "IU.KBL..BHR"]
+    windows_parallel = win.window_on_stream(
+        obs_tr, syn_tr, config_dict, user_modules=user_modules,
+        n_workers=2)
+    assert list(windows_parallel.items()) == list(windows.items())
+
+    # the bad trace raises in serial mode, and is skipped in the pool
+    config_dict["T"] = config
+    with pytest.raises(ValueError):
+        win.window_on_stream(obs_tr, syn_tr, config_dict,
+                             user_modules=user_modules)
+    windows_parallel = win.window_on_stream(
+        obs_tr, syn_tr, config_dict, user_modules=user_modules,
+        n_workers=2)
+    assert list(windows_parallel.items()) == list(windows.items())
+
+
 def test_window_on_stream_user_levels():
     obs_tr = read(obsfile)
     syn_tr = read(synfile)
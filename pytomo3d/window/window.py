@@ -14,6 +14,7 @@ import pyflex
 import obspy
 import copy
 import importlib
+import multiprocessing
 
 
 def plot_window_figure(figure_dir, figure_id, ws, _verbose=False,
@@ -172,10 +173,69 @@ def window_on_trace(obs_tr, syn_tr, config, station=None,
     return windows
 
 
+def build_trace_index(stream):
+    """
+    Build the index of traces in stream by (network, station, component)
+    in one pass. If more than one trace share the same key(for example,
+    different location codes), the first one is kept, the same as
+    stream.select(...)[0].
+
+    :param stream: input stream, for example, the synthetic stream
+    :type stream: obspy.Stream
+    :return: dict of (network, station, component) to obspy.Trace
+    """
+    index = {}
+    for tr in stream:
+        key = (tr.stats.network.upper(), tr.stats.station.upper(),
+               tr.stats.channel[-1:].upper())
+        index.setdefault(key, tr)
+    return index
+
+
+# arguments shared by all the window selection jobs in a worker process,
+# set once by _init_window_worker instead of being sent with every job
+_worker_context = {}
+
+
+def _init_window_worker(context):
+    _worker_context.clear()
+    _worker_context.update(context)
+
+
+def _window_on_trace_job(job, context):
+    """
+    Job of window_on_stream on one pair of traces. The config, station,
+    event and the rest arguments are taken from context.
+    """
+    obs_tr, syn_tr, category = job
+    config = copy.deepcopy(context["config_dict"][category])
+    return window_on_trace(
+        obs_tr, syn_tr, config, station=context["station"],
+        event=context["event"],
+        user_module=context["user_modules"].get(category, None),
+        _verbose=context["_verbose"], figure_mode=context["figure_mode"],
+        figure_dir=context["figure_dir"])
+
+
+def _window_on_trace_worker(job, context=None):
+    """
+    Job of window_on_stream in worker process, with the worker context
+    if context is None. Errors are caught and reported here, so one bad
+    trace would not break the whole pool.
+    """
+    if context is None:
+        context = _worker_context
+    try:
+        return _window_on_trace_job(job, context)
+    except Exception as err:
+        print("Error in window selection(%s): %s" % (job[0].id, err))
+        return None
+
+
 def window_on_stream(observed, synthetic, config_dict, station=None,
                      event=None, user_modules=None,
                      figure_mode=False, figure_dir=None,
-                     _verbose=False):
+                     _verbose=False, n_workers=1):
     """
     Window selection on a Stream
 
@@ -199,6 +259,13 @@ def window_on_stream(observed, synthetic, config_dict, station=None,
     :type figure_dir: str
     :param _verbose: verbose flag
     :type _verbose: bool
+    :param n_workers: number of worker processes. If 1, the traces are
+        windowed in the current process, and errors are raised.
+        Otherwise, the window selection(and figure plotting) of each
+        trace is a job in the process pool, and the trace which fails is
+        skipped with error message, so one bad trace does not break the
+        pool.
+    :type n_workers: int
     :return:
     """
     if not isinstance(observed, obspy.Stream):
@@ -215,9 +282,13 @@ def window_on_stream(observed, synthetic, config_dict, station=None,
     if user_modules is None:
         user_modules = {}
 
+    synt_index = build_trace_index(synthetic)
+
+    # collect the jobs first, in the order of categories and traces, so
+    # the windows are in the same order no matter how they are computed
+    jobs = []
+    missing = []
     for category in config_dict:
-        config_base = config_dict[category]
-        user_module = user_modules.get(category, None)
         if len(category) == 1:
             # then it is component
             obs = observed.select(component=category)
@@ -231,28 +302,67 @@ def window_on_stream(observed, synthetic, config_dict, station=None,
                 "or ['BHE', 'BHN', 'BHZ']" % list(config_dict.keys()))
 
         for obs_tr in obs:
-            component = obs_tr.stats.channel[-1]
-            try:
-                syn_tr = synthetic.select(station=obs_tr.stats.station,
-                                          network=obs_tr.stats.network,
-                                          component=component)[0]
-            except Exception as err:
-                print(("Couldn't find corresponding synt for obsd trace(%s):"
-                      "%s" % (obs_tr.id, err)))
+            key = (obs_tr.stats.network.upper(),
+                   obs_tr.stats.station.upper(),
+                   obs_tr.stats.channel[-1:].upper())
+            syn_tr = synt_index.get(key)
+            if syn_tr is None:
+                missing.append(obs_tr.id)
                 continue
 
-            config = copy.deepcopy(config_base)
-            windows = window_on_trace(
-                obs_tr, syn_tr, config, station=station,
-                event=event, user_module=user_module, _verbose=_verbose,
-                figure_mode=figure_mode, figure_dir=figure_dir)
+            jobs.append((obs_tr, syn_tr, category))
+
+    if len(missing) > 0:
+        print("Couldn't find corresponding synt for %d obsd traces: %s"
+              % (len(missing), ", ".join(missing)))
+
+    context = {"config_dict": config_dict, "station": station,
+               "event": event, "user_modules": user_modules,
+               "_verbose": _verbose, "figure_mode": figure_mode,
+               "figure_dir": figure_dir}
+    if n_workers == 1:
+        results = [_window_on_trace_job(job, context) for job in jobs]
+    elif len(jobs) <= 1:
+        results = [_window_on_trace_worker(job, context) for job in jobs]
+    else:
+        # the shared arguments are sent to each worker only once
+        pool = multiprocessing.Pool(processes=n_workers,
+                                    initializer=_init_window_worker,
+                                    initargs=(context, ))
+        try:
+            results = pool.map(_window_on_trace_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for job, windows in zip(jobs, results):
+        if windows is None:
+            continue
+
+        # Notice: Ebru suggests to write out window even its length is
+        # zero, which means no windows selected on the traces, in order
+        # to keep track of every thing
+        all_windows[job[0].id] = windows
 
-            if windows is None:
-                continue
+    return all_windows
 
-            # Notice: Ebru suggests to write out window even its length is
-            # zero, which means no windows selected on the traces, in order
-            # to keep track of every thing
-            all_windows[obs_tr.id] = windows
 
-    return all_windows
+def cached_window_on_stream(observed, synthetic, config_dict, result_cache,
+                            **kwargs):
+    """
+    Same as window_on_stream, but the windows are taken from result_cache
+    if the streams and configs are unchanged. Figures are only plotted
+    when the windows are computed, so the cache is bypassed in figure
+    mode.
+
+    :param result_cache: on-disk result cache
+    :type result_cache: pytomo3d.utils.cache.ResultCache
+    :param kwargs: the rest arguments of window_on_stream
+    :return: windows, the same as window_on_stream
+    """
+    if kwargs.get("figure_mode", False):
+        return window_on_stream(observed, synthetic, config_dict, **kwargs)
+    return result_cache.call("window_on_stream", window_on_stream,
+                             args=(observed, synthetic, config_dict),
+                             kwargs=kwargs,
+                             ignored_keys=("_verbose", "n_workers"))
@@ -48,8 +48,8 @@ setup(
         "seismology", "tomography", "adjoint", "signal", "inversion", "window"
     ],
     install_requires=[
-        "numpy", "obspy>=1.0.0", "flake8", "pytest", "nose", "future>=0.14.1",
-        "pyflex", "pyadjoint", "geographiclib"
+        "numpy", "scipy", "obspy>=1.0.0", "flake8", "pytest", "nose",
+        "future>=0.14.1", "pyflex", "pyadjoint", "geographiclib"
     ],
     extras_require={
         "docs": ["sphinx", "ipython", "runipy"]